@@ -90,6 +90,8 @@ setTimezone(){
 setupSystemdServices(){
     info "Setting up systemd services"
 
+    sudo "$BASE_DIR/install/pifi_display_service_service.sh"
+    sudo "$BASE_DIR/install/pifi_prefetcher_service.sh"
     sudo "$BASE_DIR/install/pifi_queue_service.sh"
     sudo "$BASE_DIR/install/pifi_server_service.sh"
     sudo "$BASE_DIR/install/pifi_websocket_server_service.sh"
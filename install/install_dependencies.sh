@@ -40,8 +40,9 @@ updateAndInstallPackages(){
     #   (maybe it's no longer necessary to explicitly install it since we have `sudo apt -y build-dep python3-pygame` below?`)
     # parallel: needed for update_yt-dlp.sh script
     # python3-pil: needed for rgb-matrix LED driver. Also needed for processing album art in karaoke screensavers.
+    # alsa-utils: provides aplay, which plays video audio when the video is synced to it (config value: video.av_sync)
     sudo apt -y install git python3-pip ffmpeg sqlite3 mbuffer libsdl2-mixer-2.0-0 libsdl2-dev parallel \
-        libopenblas-dev python3-numpy python3-requests python3-pil
+        libopenblas-dev python3-numpy python3-requests python3-pil alsa-utils
     sudo apt -y build-dep python3-pygame # other dependencies needed for pygame
     sudo apt -y full-upgrade
 
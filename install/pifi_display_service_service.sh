@@ -0,0 +1,17 @@
+#!/usr/bin/env bash
+# creates the display service service file
+BASE_DIR="$(dirname "$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )")"
+cat <<-EOF | sudo tee /etc/systemd/system/pifi_display_service.service >/dev/null
+[Unit]
+Description=pifi display service
+After=network-online.target
+Wants=network-online.target
+
+[Service]
+Environment=HOME=/root
+ExecStart=$BASE_DIR/bin/display_service
+Restart=on-failure
+
+[Install]
+WantedBy=multi-user.target
+EOF
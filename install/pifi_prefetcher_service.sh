@@ -0,0 +1,17 @@
+#!/usr/bin/env bash
+# creates the prefetcher service file
+BASE_DIR="$(dirname "$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )")"
+cat <<-EOF | sudo tee /etc/systemd/system/pifi_prefetcher.service >/dev/null
+[Unit]
+Description=pifi prefetcher
+After=network-online.target
+Wants=network-online.target
+
+[Service]
+Environment=HOME=/root
+ExecStart=$BASE_DIR/bin/prefetcher
+Restart=on-failure
+
+[Install]
+WantedBy=multi-user.target
+EOF
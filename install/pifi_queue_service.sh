@@ -4,7 +4,7 @@ BASE_DIR="$(dirname "$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 &&
 cat <<-EOF | sudo tee /etc/systemd/system/pifi_queue.service >/dev/null
 [Unit]
 Description=pifi queue
-After=network-online.target
+After=network-online.target pifi_display_service.service
 Wants=network-online.target
 
 [Service]
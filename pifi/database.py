@@ -1,3 +1,4 @@
+import random
 import sqlite3
 import threading
 import time
@@ -7,6 +8,9 @@ from pifi.logger import Logger
 import pifi.playlist
 import pifi.games.scores
 import pifi.settingsdb
+import pifi.video.startuptimeline
+import pifi.video.transcodecache
+import pifi.video.ytdlpinfocache
 
 def dict_factory(cursor, row):
     d = {}
@@ -17,12 +21,161 @@ def dict_factory(cursor, row):
 
 thread_local = threading.local()
 
+# Wraps a sqlite3 cursor. Statements that fail because another connection held a lock for longer than the busy
+# timeout are retried with jittered backoff, so that writers contending for the lock don't retry in lockstep.
+#
+# Every statement's latency and lock waits are recorded. Stats are kept per process, across threads, and logged
+# periodically, so that contention between the server's threads, the Queue, and playback processes shows up in the
+# logs. See: get_stats
+class DatabaseCursor:
+
+    # How long to keep retrying a statement that fails with `database is locked` before giving up.
+    __MAX_LOCK_WAIT_S = 5
+
+    # Backoff between retries doubles from the min up to the max, and is then scaled by a random factor in
+    # [0.5, 1.5).
+    __MIN_RETRY_BACKOFF_S = 0.01
+    __MAX_RETRY_BACKOFF_S = 0.5
+
+    # How often to log stats.
+    __STATS_LOG_INTERVAL_S = 60
+
+    # How many statements to log stats for, ordered by their total time.
+    __NUM_STATEMENTS_TO_LOG = 5
+
+    # Statements are keyed by their sql, with whitespace collapsed, and truncated to this length.
+    __MAX_STATEMENT_KEY_LENGTH = 120
+
+    __stats = {}
+    __stats_lock = threading.Lock()
+    __stats_log_time = time.monotonic()
+
+    def __init__(self, cursor):
+        self.__cursor = cursor
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+
+    def execute(self, sql, parameters = ()):
+        return self.__run(self.__cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.__run(self.__cursor.executemany, sql, seq_of_parameters)
+
+    def fetchone(self):
+        return self.__cursor.fetchone()
+
+    def fetchall(self):
+        return self.__cursor.fetchall()
+
+    @property
+    def lastrowid(self):
+        return self.__cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self.__cursor.rowcount
+
+    @property
+    def description(self):
+        return self.__cursor.description
+
+    # Returns a dict of stats for the statements run by this process since stats were last logged, keyed by sql.
+    @staticmethod
+    def get_stats():
+        with DatabaseCursor.__stats_lock:
+            return {sql: dict(stats) for sql, stats in DatabaseCursor.__stats.items()}
+
+    def __run(self, method, sql, parameters):
+        start = time.monotonic()
+        num_lock_waits = 0
+        while True:
+            try:
+                method(sql, parameters)
+                break
+            except sqlite3.OperationalError as e:
+                # Inside an explicit transaction, retrying just the statement isn't safe: the whole transaction may
+                # need to be rolled back. Leave that up to the caller.
+                if (
+                    'locked' not in str(e) or self.__cursor.connection.in_transaction or
+                    time.monotonic() - start >= self.__MAX_LOCK_WAIT_S
+                ):
+                    self.__record(sql, time.monotonic() - start, num_lock_waits, did_fail = True)
+                    raise
+                time.sleep(
+                    min(self.__MIN_RETRY_BACKOFF_S * 2 ** num_lock_waits, self.__MAX_RETRY_BACKOFF_S) *
+                    random.uniform(0.5, 1.5)
+                )
+                num_lock_waits += 1
+            except Exception:
+                self.__record(sql, time.monotonic() - start, num_lock_waits, did_fail = True)
+                raise
+        self.__record(sql, time.monotonic() - start, num_lock_waits)
+        return self
+
+    # A statement's time includes the time it spent waiting for locks.
+    def __record(self, sql, elapsed_s, num_lock_waits, did_fail = False):
+        key = ' '.join(sql.split())[:self.__MAX_STATEMENT_KEY_LENGTH]
+        with DatabaseCursor.__stats_lock:
+            stats = DatabaseCursor.__stats.get(key)
+            if stats is None:
+                # Lock waits count the retries of statements that failed with `database is locked`. Waits shorter
+                # than the busy timeout happen inside sqlite, and only show up in a statement's time. lock_wait_s
+                # is the total time of statements that had to be retried.
+                stats = {
+                    'num_statements': 0, 'total_s': 0, 'max_s': 0, 'num_lock_waits': 0, 'lock_wait_s': 0,
+                    'num_failed': 0,
+                }
+                DatabaseCursor.__stats[key] = stats
+            stats['num_statements'] += 1
+            stats['total_s'] += elapsed_s
+            stats['max_s'] = max(stats['max_s'], elapsed_s)
+            stats['num_lock_waits'] += num_lock_waits
+            if num_lock_waits > 0:
+                stats['lock_wait_s'] += elapsed_s
+            if did_fail:
+                stats['num_failed'] += 1
+
+            now = time.monotonic()
+            elapsed_since_log_s = now - DatabaseCursor.__stats_log_time
+            if elapsed_since_log_s < self.__STATS_LOG_INTERVAL_S:
+                return
+            all_stats = DatabaseCursor.__stats
+            DatabaseCursor.__stats = {}
+            DatabaseCursor.__stats_log_time = now
+        self.__log_stats(all_stats, elapsed_since_log_s)
+
+    def __log_stats(self, all_stats, elapsed_s):
+        num_statements = sum(stats['num_statements'] for stats in all_stats.values())
+        num_lock_waits = sum(stats['num_lock_waits'] for stats in all_stats.values())
+        lock_wait_s = sum(stats['lock_wait_s'] for stats in all_stats.values())
+        num_failed = sum(stats['num_failed'] for stats in all_stats.values())
+        msg = (
+            f'Ran {num_statements} statements over the last {round(elapsed_s)} s. {num_lock_waits} lock waits ' +
+            f'took {round(lock_wait_s, 3)} s. {num_failed} statements failed. Statements by total time:'
+        )
+        top_stats = sorted(all_stats.items(), key = lambda item: item[1]['total_s'], reverse = True)
+        for sql, stats in top_stats[:self.__NUM_STATEMENTS_TO_LOG]:
+            msg += (
+                f"\n  {stats['num_statements']} x {sql}: total {round(stats['total_s'] * 1000, 1)} ms, " +
+                f"max {round(stats['max_s'] * 1000, 1)} ms, {stats['num_lock_waits']} lock waits"
+            )
+
+        # Contention is what's worth noticing. Otherwise, keep the logs quiet.
+        if num_lock_waits > 0 or num_failed > 0:
+            self.__logger.info(msg)
+        else:
+            self.__logger.debug(msg)
+
+
 class Database:
 
     __DB_PATH = DirectoryUtils().root_dir + '/pifi.db'
 
     # Zero indexed schema_version (first version is v0).
-    __SCHEMA_VERSION = 4
+    __SCHEMA_VERSION = 8
+
+    # How long sqlite waits for a lock before a statement fails with `database is locked`. DatabaseCursor retries
+    # such statements with jittered backoff, which spreads out writers that would otherwise retry in lockstep.
+    __BUSY_TIMEOUT_S = 0.1
 
     def __init__(self):
         self.__logger = Logger().set_namespace(self.__class__.__name__)
@@ -61,13 +214,22 @@ class Database:
     # 4) Call the method in the below for loop.
     # 5) Run ./install/install.sh
     def construct(self):
-        self.get_cursor().execute("BEGIN TRANSACTION")
+        # Take the write lock up front. DatabaseCursor doesn't retry statements inside a transaction, but it does
+        # retry BEGIN, so this waits for other writers rather than failing partway through after the busy timeout.
+        self.get_cursor().execute("BEGIN IMMEDIATE TRANSACTION")
         try:
-            self.get_cursor().execute("SELECT version FROM pifi_schema_version")
-            current_schema_version = int(self.get_cursor().fetchone()['version'])
-        except Exception:
-            current_schema_version = -1
+            did_construct = self.__construct_schema()
+            self.get_cursor().execute("COMMIT")
+        except BaseException:
+            # Don't hold on to the write lock, which would block every other writer until we exit.
+            self.get_cursor().execute("ROLLBACK")
+            raise
+        if did_construct:
+            self.__logger.info("Database schema constructed successfully.")
 
+    # Returns False if the schema was already up to date.
+    def __construct_schema(self):
+        current_schema_version = self.__get_current_schema_version()
         self.__logger.info("current_schema_version: {}".format(current_schema_version))
 
         if current_schema_version == -1:
@@ -77,6 +239,9 @@ class Database:
             pifi.playlist.Playlist().construct()
             pifi.games.scores.Scores().construct()
             pifi.settingsdb.SettingsDb().construct()
+            pifi.video.transcodecache.TranscodeCache().construct()
+            pifi.video.startuptimeline.StartupTimeline().construct()
+            pifi.video.ytdlpinfocache.YtDlpInfoCache().construct()
         elif current_schema_version < self.__SCHEMA_VERSION:
             self.__logger.info(
                 f"Database schema is outdated. Updating from version {current_schema_version} to " +
@@ -94,6 +259,14 @@ class Database:
                     self.__update_schema_to_v3()
                 elif i == 4:
                     self.__update_schema_to_v4()
+                elif i == 5:
+                    self.__update_schema_to_v5()
+                elif i == 6:
+                    self.__update_schema_to_v6()
+                elif i == 7:
+                    self.__update_schema_to_v7()
+                elif i == 8:
+                    self.__update_schema_to_v8()
                 else:
                     msg = "No update schema method defined for version: {}.".format(i)
                     self.__logger.error(msg)
@@ -101,24 +274,42 @@ class Database:
                 self.get_cursor().execute("UPDATE pifi_schema_version set version = ?", [i])
         elif current_schema_version == self.__SCHEMA_VERSION:
             self.__logger.info("Database schema is already up to date!")
-            return
+            return False
         else:
             msg = ("Database schema is newer than should be possible. This should never happen. " +
                 "current_schema_version: {}. Tried to update to version: {}."
                 .format(current_schema_version, self.__SCHEMA_VERSION))
             self.__logger.error(msg)
             raise Exception(msg)
+        return True
 
-        self.get_cursor().execute("COMMIT")
-        self.__logger.info("Database schema constructed successfully.")
+    # Returns -1 if the schema hasn't been constructed yet.
+    def __get_current_schema_version(self):
+        try:
+            self.get_cursor().execute("SELECT version FROM pifi_schema_version")
+        except sqlite3.OperationalError as e:
+            if 'no such table' not in str(e):
+                raise
+            return -1
+        row = self.get_cursor().fetchone()
+        if row is None:
+            return -1
+        return int(row['version'])
 
     def get_cursor(self):
         cursor = getattr(thread_local, 'database_cursor', None)
         if cursor is None:
             # `isolation_level = None` specifies autocommit mode.
-            conn = sqlite3.connect(self.__DB_PATH, isolation_level = None)
+            conn = sqlite3.connect(self.__DB_PATH, isolation_level = None, timeout = self.__BUSY_TIMEOUT_S)
             conn.row_factory = dict_factory
-            cursor = conn.cursor()
+            cursor = DatabaseCursor(conn.cursor())
+
+            # In WAL mode, readers don't block the writer and the writer doesn't block readers, so the server's
+            # threads, the Queue, and playback processes only contend with each other when writing. With WAL,
+            # synchronous = NORMAL is still safe from corruption; a power loss may only roll back the most recent
+            # transactions.
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute("PRAGMA synchronous = NORMAL")
             thread_local.database_cursor = cursor
         return cursor
 
@@ -153,3 +344,15 @@ class Database:
         self.get_cursor().execute("CREATE INDEX status_type_priority_idx ON playlist_videos (status, type, priority)")
         self.get_cursor().execute("DROP INDEX IF EXISTS status_priority_idx")
         self.get_cursor().execute("CREATE INDEX status_priority_idx ON playlist_videos (status, priority DESC, playlist_video_id ASC)")
+
+    def __update_schema_to_v5(self):
+        pifi.video.transcodecache.TranscodeCache().construct()
+
+    def __update_schema_to_v6(self):
+        pifi.video.startuptimeline.StartupTimeline().construct()
+
+    def __update_schema_to_v7(self):
+        pifi.video.ytdlpinfocache.YtDlpInfoCache().construct()
+
+    def __update_schema_to_v8(self):
+        self.get_cursor().execute("ALTER TABLE playlist_videos ADD COLUMN playback_position_s REAL DEFAULT 0")
@@ -0,0 +1,73 @@
+import numpy as np
+
+# A ring buffer of fixed size frames, backed by a single preallocated ndarray of shape [capacity, *frame_shape].
+#
+# Writing is done in place: get_write_slot() returns a writable byte view of the next free slot, e.g. to
+# `readinto` from a file, and commit_write() makes the slot readable. No memory is allocated per frame.
+#
+# Like ReadOnceCircularBuffer, when you do `frame = my_buffer[i]`, under the hood, the buffer will remove all
+# frames with index < i. You can only access the frames once; this makes room for more frames. The frame
+# returned by the most recent access is a view into the buffer, and it stays valid until a later index is
+# accessed.
+class ReadOnceFrameRingBuffer():
+
+    # capacity: number of frames. Must be at least 2, because the most recently accessed frame is kept.
+    def __init__(self, capacity, frame_shape):
+        if capacity < 2:
+            raise Exception(f'Capacity must be at least 2, got {capacity}.')
+
+        self.__capacity = capacity
+        self.__frames = np.zeros([capacity] + list(frame_shape), np.uint8)
+        self.__write_slots = [memoryview(slot).cast('B') for slot in self.__frames.reshape(capacity, -1)]
+
+        # number of frames that have been added over this object's lifetime
+        self.__len = 0
+        self.__max_gotten_index = -1
+
+    # capacity: number of frames that fit in memory_budget_bytes, but at least 2.
+    @staticmethod
+    def make_for_memory_budget(memory_budget_bytes, frame_shape):
+        bytes_per_frame = int(np.prod(frame_shape))
+        return ReadOnceFrameRingBuffer(max(2, memory_budget_bytes // bytes_per_frame), frame_shape)
+
+    def get_capacity(self):
+        return self.__capacity
+
+    def is_full(self):
+        # The most recently gotten frame still occupies its slot.
+        num_occupied_slots = self.__len - max(self.__max_gotten_index, 0)
+        return num_occupied_slots >= self.__capacity
+
+    # Returns a writable, flat byte view of the next slot. Its contents are not readable until commit_write().
+    def get_write_slot(self):
+        if self.is_full():
+            raise Exception('buffer is full!')
+        return self.__write_slots[self.__len % self.__capacity]
+
+    def commit_write(self):
+        if self.is_full():
+            raise Exception('buffer is full!')
+        self.__len += 1
+
+    # number of unread frames in the buffer.
+    # This should return an integer in the range: [0, capacity]
+    def unread_length(self):
+        return self.__len - self.__max_gotten_index - 1
+
+    def __getitem__(self, index):
+        if index >= len(self) or index < 0:
+            raise IndexError('index out of range')
+
+        if index <= self.__max_gotten_index:
+            raise IndexError('index already gotten')
+
+        self.__max_gotten_index = index
+        return self.__frames[index % self.__capacity]
+
+    # number of frames that have been added over this object's lifetime
+    def __len__(self):
+        return self.__len
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}(capacity: {self.__capacity}, len: {len(self)}, ' +
+            f'max gotten index: {self.__max_gotten_index})')
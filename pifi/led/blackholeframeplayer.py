@@ -20,6 +20,6 @@ class BlackHoleFramePlayer(FramePlayerBase):
             return None
         return self.__current_frame.copy()
 
-    def fade_to_frame(self, frame):
+    def fade_to_frame(self, frame, duration = None):
         """Skip the fade animation and just capture the target frame."""
         self.__current_frame = frame
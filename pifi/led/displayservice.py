@@ -0,0 +1,88 @@
+import select
+import time
+
+import numpy as np
+
+from pifi.config import Config
+from pifi.led.drivers.leddrivers import LedDrivers
+from pifi.led.sharedframering import SharedFrameRing
+from pifi.logger import Logger
+
+# The display service is a long lived process that owns the only instance of the LED driver. Producer
+# processes (the Queue, video playback, screensavers, games) transform their frames as usual, and then publish
+# them into a SharedFrameRing instead of writing them to the LEDs. See: DriverDisplayService
+#
+# This avoids re-initializing the LED driver every time a process starts, and lets the Queue show the loading
+# screen and clear the screen even with drivers that don't support multiple instances.
+# See: DriverBase.can_multiple_driver_instances_coexist
+class DisplayService:
+
+    # Upper bound on how long to block waiting for a wakeup. Wakeups are best effort, so we also check for new
+    # frames periodically.
+    __MAX_WAIT_S = 0.5
+
+    # How often to log stats.
+    __STATS_LOG_INTERVAL_S = 60
+
+    def __init__(self):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        display_width = Config.get_or_throw('leds.display_width')
+        display_height = Config.get_or_throw('leds.display_height')
+        self.__ring = SharedFrameRing(display_width, display_height)
+        self.__ring.create()
+        self.__wakeup_socket = self.__ring.make_wakeup_server_socket()
+        self.__frame = np.zeros([display_height, display_width, 3], np.uint8)
+        self.__driver = LedDrivers.make_driver(clear_screen = True)
+        self.__brightness = None
+
+        self.__stats_log_time = time.monotonic()
+        self.__num_displayed_frames = 0
+        self.__num_superseded_frames = 0
+
+    def run(self):
+        self.__logger.info('Starting display service...')
+        last_sequence = self.__ring.get_sequence()
+        while True:
+            select.select([self.__wakeup_socket], [], [], self.__MAX_WAIT_S)
+            self.__drain_wakeup_socket()
+
+            result = self.__ring.read_newest(last_sequence, self.__frame)
+            if result is not None:
+                sequence, kind, brightness = result
+                self.__display(kind, brightness)
+                self.__num_displayed_frames += 1
+                self.__num_superseded_frames += max(0, sequence - last_sequence - 1)
+                last_sequence = sequence
+            self.__maybe_log_stats()
+
+    def __display(self, kind, brightness):
+        if kind == SharedFrameRing.KIND_CLEAR:
+            self.__driver.clear_screen()
+            return
+
+        # Brightness doesn't matter for a cleared screen, so it's only applied along with frames.
+        if brightness != self.__brightness:
+            self.__driver.set_brightness(brightness)
+            self.__brightness = brightness
+        self.__driver.display_frame(self.__frame)
+
+    def __drain_wakeup_socket(self):
+        while True:
+            try:
+                self.__wakeup_socket.recv(16)
+            except BlockingIOError:
+                return
+
+    def __maybe_log_stats(self):
+        now = time.monotonic()
+        elapsed = now - self.__stats_log_time
+        if elapsed < self.__STATS_LOG_INTERVAL_S:
+            return
+
+        self.__logger.info(
+            f'Displayed {self.__num_displayed_frames} frames over the last {round(elapsed)} s. ' +
+            f'{self.__num_superseded_frames} frames were superseded by a newer frame before being displayed.'
+        )
+        self.__stats_log_time = now
+        self.__num_displayed_frames = 0
+        self.__num_superseded_frames = 0
@@ -11,22 +11,42 @@ class DriverApa102(DriverBase):
     __LED_ORDER = 'rgb'
 
     def __init__(self, clear_screen=True):
+        display_width = Config.get_or_throw('leds.display_width')
+        display_height = Config.get_or_throw('leds.display_height')
+        num_leds = display_width * display_height
         self.__pixels = apa102.APA102(
-            num_led=(Config.get_or_throw('leds.display_width') * Config.get_or_throw('leds.display_height')),
+            num_led=num_leds,
             mosi=self.__MOSI_PIN,
             sclk=self.__SCLK_PIN,
             order=self.__LED_ORDER
         )
 
-        if clear_screen:
-            self.clear_screen()
+        # The bytes we send over SPI: one row of 4 bytes per LED. The first byte of each LED is the
+        # "LED start frame", which also holds the brightness. The next 3 are the color values.
+        # See: https://github.com/dasl-/pifi/issues/26
+        #
+        # The numpy array is a view of a bytearray, which is what we send. The SPI library checks whether its buffer
+        # is empty with `if not buf`, which raises for numpy arrays of more than one element.
+        self.__spi_bytes = bytearray(num_leds * 4)
+        self.__led_bytes = np.frombuffer(self.__spi_bytes, np.uint8).reshape(num_leds, 4)
+        self.__led_bytes[:, 0] = self.__pixels.LED_START
+        self.__led_color_bytes = self.__led_bytes[:, 1:]
 
-        # Look up the order in which to write each color value to the LED strip.
-        # It's 1-indexed, so subtract by 1.
-        self.__color_order = [x - 1 for x in apa102.RGB_MAP[self.__LED_ORDER]]
+        # For each color byte we send, precompute the index in the flattened frame that it is read from.
+        #
+        # Each row is zig-zagged, so every other row needs to be flipped horizontally. Starting at row 0,
+        # with stride 2, each row's columns are reversed.
+        #
+        # Additionally, each RGB tuple needs to be re-ordered to match the order that's expected by the
+        # LED strip. Look up the order in which to write each color value to the LED strip. It's
+        # 1-indexed, so subtract by 1.
+        pixel_indices = np.arange(num_leds).reshape(display_height, display_width)
+        pixel_indices[0::2, :] = pixel_indices[0::2, ::-1]
+        color_order = np.array([x - 1 for x in apa102.RGB_MAP[self.__LED_ORDER]])
+        self.__frame_index_for_color_byte = pixel_indices.reshape(-1, 1) * 3 + color_order
 
-        # Initialize ledstart; will be set properly by set_brightness() called from LedFramePlayer.
-        self.__ledstart = self.__pixels.LED_START
+        if clear_screen:
+            self.clear_screen()
 
     # CAUTION:
     # This method has been heavily optimized. The program spends the bulk of its execution time in this loop.
@@ -37,31 +57,25 @@ class DriverApa102(DriverBase):
     # Here are some graphs about the performance, generated like so:
     # https://gist.github.com/dasl-/d552c0abb38fca823e97fb3b49898f2d
     # https://docs.google.com/spreadsheets/d/1psa070FdMv2w8RPqzFuRVg1eqzTiLwlekClMsEG3qwE/edit#gid=716887181
+    #
+    # The zig-zag and color re-ordering are done in a single gather from the frame into the persistent
+    # SPI byte buffer. The caller's frame is never mutated.
     def display_frame(self, frame):
-        # Each row is zig-zagged, so every other row needs to be flipped
-        # horizontally.
-        #
-        # Starting at row 1, with stride 2, set each column to itself with
-        # stride -1, which reverses the column.
-        frame[0::2, :, :] = frame[0::2, ::-1, :]
-
-        # Additionally, each RGB tuple needs to be re-ordered to match the order
-        # that's expected by the LED strip, which is defined in
-        # self.__color_order.
-        frame = frame[:, :, self.__color_order]
-
-        # Now, populate the LEDs array by flattening the array, interposing
-        # each RGB triple with the "LED start frame".
-        # See: https://github.com/dasl-/pifi/issues/26
-        self.__pixels.leds = np.insert(frame.flat, range(0, frame.size, 3), self.__ledstart).tolist()
-
-        # We're done! Tell the underlying driver to send data to the LEDs.
-        self.__pixels.show()
+        np.take(frame.reshape(-1), self.__frame_index_for_color_byte, out = self.__led_color_bytes, mode = 'wrap')
+        self.__send_led_bytes()
 
     def set_brightness(self, brightness):
         mapped = brightness * 31 // 100
         self.__pixels.set_global_brightness(mapped)
-        self.__ledstart = (mapped & 0b00011111) | self.__pixels.LED_START
+        self.__led_bytes[:, 0] = (mapped & 0b00011111) | self.__pixels.LED_START
 
     def clear_screen(self):
-        self.__pixels.clear_strip()
+        self.__led_color_bytes.fill(0)
+        self.__send_led_bytes()
+
+    # Send the bytes straight to SPI, rather than via the apa102 library's `show` method, which operates
+    # on a python list of ints. See: apa102.APA102.show
+    def __send_led_bytes(self):
+        self.__pixels.clock_start_frame()
+        self.__pixels.send_to_spi(self.__spi_bytes)
+        self.__pixels.clock_end_frame()
@@ -7,6 +7,8 @@ class DriverBase(ABC):
     def __init__(self, clear_screen=True):
         pass
 
+    # Drivers may return False if the frame was rejected rather than displayed, e.g. DriverDisplayService when another
+    # process owns the display. Any other return value means the frame was displayed.
     @abstractmethod
     def display_frame(self, frame):
         pass
@@ -20,6 +22,11 @@ class DriverBase(ABC):
         """Set brightness using the driver's native API. brightness is 0-100."""
         pass
 
+    # Seconds spent waiting for the display's vertical sync while displaying the most recent frame, or None if the
+    # driver doesn't wait for vsync. A long wait means we're limited by the display's refresh rate rather than by python.
+    def get_last_vsync_wait_time(self):
+        return None
+
     # For some drivers, only one instance of the driver can exist at a time because all of them
     # would send competing signals to the LEDs. The screensaver, video playback, etc processes
     # that the Queue launches might have their own instance of the driver as well as the
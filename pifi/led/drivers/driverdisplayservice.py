@@ -0,0 +1,88 @@
+import time
+
+from pifi.config import Config
+from pifi.led.drivers.driverbase import DriverBase
+from pifi.led.sharedframering import SharedFrameRing
+from pifi.logger import Logger
+
+# A driver that hands frames to the display service rather than writing them to the LEDs itself. The display
+# service owns the only instance of the real LED driver. See: DisplayService, SharedFrameRing
+class DriverDisplayService(DriverBase):
+
+    # If the display service isn't running yet, how often to retry attaching to its frame ring.
+    __ATTACH_RETRY_INTERVAL_S = 1
+
+    # priority: one of the SharedFrameRing.PRIORITY_* constants.
+    def __init__(self, clear_screen=True, priority=SharedFrameRing.PRIORITY_PLAYBACK):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__priority = priority
+        self.__brightness = 0
+        self.__ring = SharedFrameRing(
+            Config.get_or_throw('leds.display_width'), Config.get_or_throw('leds.display_height')
+        )
+        self.__last_attach_attempt_time = None
+        self.__is_owner = False
+
+        # Frames dropped since another producer took over the display.
+        self.__num_rejected_frames = 0
+
+        # Take over the display from any other producer of equal or lower priority.
+        if self.__maybe_attach():
+            self.__is_owner = self.__ring.acquire(self.__priority)
+
+        if clear_screen:
+            self.clear_screen()
+
+    # Returns False if the frame was rejected, because another process owns the display.
+    def display_frame(self, frame):
+        return self.__publish(SharedFrameRing.KIND_FRAME, frame)
+
+    # The brightness is sent along with each frame, and applied by the display service.
+    def set_brightness(self, brightness):
+        self.__brightness = brightness
+
+    def clear_screen(self):
+        self.__publish(SharedFrameRing.KIND_CLEAR, None)
+
+    # The display service serializes access to the real driver, so any number of instances may coexist.
+    def can_multiple_driver_instances_coexist(self):
+        return True
+
+    # Returns whether the frame was published.
+    def __publish(self, kind, frame):
+        if not self.__maybe_attach():
+            return False
+
+        self.__is_owner = self.__ring.publish(kind, frame, self.__brightness, self.__priority)
+        if self.__is_owner:
+            if self.__num_rejected_frames > 0:
+                self.__logger.info(
+                    f'Got the display back after dropping {self.__num_rejected_frames} frames while another ' +
+                    'process owned it.'
+                )
+                self.__num_rejected_frames = 0
+            return True
+
+        if self.__num_rejected_frames == 0:
+            self.__logger.info('Another process owns the display. Dropping frames until it exits.')
+        self.__num_rejected_frames += 1
+        return False
+
+    def __maybe_attach(self):
+        if self.__ring.is_attached():
+            return True
+
+        now = time.monotonic()
+        if (
+            self.__last_attach_attempt_time is not None and
+            now - self.__last_attach_attempt_time < self.__ATTACH_RETRY_INTERVAL_S
+        ):
+            return False
+
+        is_first_attempt = self.__last_attach_attempt_time is None
+        self.__last_attach_attempt_time = now
+        if self.__ring.attach():
+            return True
+        if is_first_attempt:
+            self.__logger.warning('Unable to attach to the display service frame ring. Is the display service running?')
+        return False
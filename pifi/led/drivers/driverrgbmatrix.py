@@ -1,13 +1,20 @@
-import gc
+import time
+
+import numpy as np
 from PIL import Image
 from rgbmatrix import RGBMatrix, RGBMatrixOptions
 
 from pifi.config import Config
 from pifi.led.drivers.driverbase import DriverBase
+from pifi.logger import Logger
 
 class DriverRgbMatrix(DriverBase):
 
+    # How often to log frame timing stats.
+    __STATS_LOG_INTERVAL_S = 60
+
     def __init__(self, clear_screen=True):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
         options = RGBMatrixOptions()
         options.rows = Config.get_or_throw('leds.display_height')
         options.cols = Config.get_or_throw('leds.display_width')
@@ -25,37 +32,57 @@ class DriverRgbMatrix(DriverBase):
 
         self.__matrix = RGBMatrix(options = options)
         self.__pixels = self.__matrix.CreateFrameCanvas()
-
-        # Pre-allocate image buffer to avoid per-frame allocations that trigger GC
         self.__width = options.cols
         self.__height = options.rows
-        self.__img_buffer = Image.new('RGB', (self.__width, self.__height))
+
+        # Pre-allocate a contiguous RGBX pixel buffer, and a PIL image that shares its memory. PIL stores
+        # RGB images with 4 bytes per pixel, so mapping an RGBX buffer (rather than an RGB one) lets PIL
+        # use the buffer directly instead of copying it. Each frame is copied into the buffer in place,
+        # and the canvas reads the pixels straight from it. No memory is allocated per frame.
+        self.__pixel_buffer = np.zeros([self.__height, self.__width, 4], np.uint8)
+        self.__rgb_pixel_buffer = self.__pixel_buffer[:, :, :3]
+        self.__img_buffer = Image.frombuffer(
+            'RGBX', (self.__width, self.__height), self.__pixel_buffer, 'raw', 'RGBX', 0, 1
+        )
+
+        # SetPixelsPillow is the fast path underlying SetImage. Calling it directly lets us pass our RGBX
+        # image, whereas SetImage only accepts RGB mode images. Fall back to SetImage if it's not present.
+        self.__can_set_pixels_pillow = hasattr(self.__pixels, 'SetPixelsPillow')
+
+        # Time spent in SwapOnVSync for the most recent frame, and stats since they were last logged.
+        # A long wait means we're limited by the panel refresh rate rather than by python.
+        self.__last_vsync_wait_s = 0
+        self.__stats_log_time = time.monotonic()
+        self.__num_frames_since_stats_log = 0
+        self.__total_vsync_wait_s = 0
+        self.__max_vsync_wait_s = 0
+        self.__total_set_pixels_s = 0
 
         if clear_screen:
             self.clear_screen()
 
     def display_frame(self, frame):
-        # Disable GC during the critical display section to prevent timing jitter
-        gc_was_enabled = gc.isenabled()
-        gc.disable()
-
-        try:
-            # Reuse pre-allocated image buffer instead of creating new Image each frame
-            # frombuffer with 'raw' mode avoids a data copy
-            self.__img_buffer = Image.frombuffer(
-                'RGB',
-                (self.__width, self.__height),
-                frame.astype('uint8').tobytes(),
-                'raw',
-                'RGB',
-                0,
-                1
-            )
-            self.__pixels.SetImage(self.__img_buffer)
-            self.__pixels = self.__matrix.SwapOnVSync(self.__pixels)
-        finally:
-            if gc_was_enabled:
-                gc.enable()
+        start_time = time.monotonic()
+        np.copyto(self.__rgb_pixel_buffer, frame, casting = 'unsafe')
+        if self.__can_set_pixels_pillow:
+            self.__pixels.SetPixelsPillow(0, 0, self.__width, self.__height, self.__img_buffer)
+        else:
+            self.__pixels.SetImage(self.__img_buffer.convert('RGB'))
+
+        vsync_start_time = time.monotonic()
+        self.__pixels = self.__matrix.SwapOnVSync(self.__pixels)
+        end_time = time.monotonic()
+
+        self.__last_vsync_wait_s = end_time - vsync_start_time
+        self.__total_vsync_wait_s += self.__last_vsync_wait_s
+        self.__max_vsync_wait_s = max(self.__max_vsync_wait_s, self.__last_vsync_wait_s)
+        self.__total_set_pixels_s += vsync_start_time - start_time
+        self.__num_frames_since_stats_log += 1
+        self.__maybe_log_stats(end_time)
+
+    # Seconds spent waiting in SwapOnVSync while displaying the most recent frame.
+    def get_last_vsync_wait_time(self):
+        return self.__last_vsync_wait_s
 
     def set_brightness(self, brightness):
         clamped = max(1, min(100, brightness))
@@ -80,3 +107,21 @@ class DriverRgbMatrix(DriverBase):
     #      https://github.com/dasl-/pifi/issues/33
     def can_multiple_driver_instances_coexist(self):
         return False
+
+    def __maybe_log_stats(self, now):
+        elapsed = now - self.__stats_log_time
+        if elapsed < self.__STATS_LOG_INTERVAL_S:
+            return
+
+        num_frames = self.__num_frames_since_stats_log
+        self.__logger.info(
+            f'Displayed {round(num_frames / elapsed, 1)} fps over the last {round(elapsed)} s. ' +
+            f'Avg time setting pixels: {round(self.__total_set_pixels_s / num_frames * 1000, 2)} ms. ' +
+            f'Avg SwapOnVSync wait: {round(self.__total_vsync_wait_s / num_frames * 1000, 2)} ms. ' +
+            f'Max SwapOnVSync wait: {round(self.__max_vsync_wait_s * 1000, 2)} ms.'
+        )
+        self.__stats_log_time = now
+        self.__num_frames_since_stats_log = 0
+        self.__total_vsync_wait_s = 0
+        self.__max_vsync_wait_s = 0
+        self.__total_set_pixels_s = 0
@@ -1,15 +1,32 @@
+import ctypes
+import time
+
 import rpi_ws281x
 import numpy as np
 
 from pifi.config import Config
 from pifi.led.drivers.driverbase import DriverBase
+from pifi.logger import Logger
 
 class DriverWs2812b(DriverBase):
 
-    def __init__(self, clear_screen=True):
+    # WS2812B LEDs are clocked at 800 kHz, with 24 bits of data per LED.
+    __FREQ_HZ = 800000
+    __BITS_PER_LED = 24
+
+    # After sending data to the LEDs, the ws281x library waits this long before the next frame can be
+    # rendered, to allow the LEDs to latch the data.
+    # See: https://github.com/jgarff/rpi_ws281x/blob/7fc0bf8b31d715bbecf28e852ede5aaa5ab74d61/ws2811.c#L68
+    __RESET_WAIT_TIME_S = 0.0003
+
+    # How often to log the achieved frame rate.
+    __FPS_LOG_INTERVAL_S = 60
 
+    def __init__(self, clear_screen=True):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
         self.__display_width = Config.get_or_throw('leds.display_width')
         self.__display_height = Config.get_or_throw('leds.display_height')
+        num_leds = self.__display_width * self.__display_height
 
         """
         View something of an API reference by doing:
@@ -24,8 +41,9 @@ class DriverWs2812b(DriverBase):
         Also: https://github.com/rpi-ws281x/rpi-ws281x-python/blob/29a99c00ac3eefebf01480d7cb3e6c355f40ce0c/library/rpi_ws281x/rpi_ws281x.py#L57
         """
         self.__pixels = rpi_ws281x.PixelStrip(
-            num=self.__display_width * self.__display_height,
+            num=num_leds,
             pin=10, # SPI pin https://pinout.xyz/pinout/pin19_gpio10
+            freq_hz=self.__FREQ_HZ,
             brightness=255, # will be set properly by set_brightness() called from LedFramePlayer
             strip_type=rpi_ws281x.WS2811_STRIP_GRB,
             gamma=None
@@ -33,22 +51,49 @@ class DriverWs2812b(DriverBase):
 
         self.__pixels.begin()
 
+        # The LEDs are wired column by column: the LED at index (x * display_height + y) displays the
+        # pixel at row y, column x. For each LED, precompute the index of the pixel it displays in the
+        # row-major flattened frame.
+        self.__frame_index_for_led = (np.arange(num_leds)
+            .reshape(self.__display_height, self.__display_width)
+            .T
+            .ravel())
+
+        # Colors packed as 24-bit RGB values, in row-major frame order and in LED order respectively.
+        # This is the same packing as rpi_ws281x.Color(); the library reorders the channels to GRB
+        # according to the strip_type when rendering.
+        self.__packed_frame = np.zeros(num_leds, np.uint32)
+        self.__led_buffer = np.zeros(num_leds, np.uint32)
+        self.__leds_address = self.__get_leds_address()
+
+        self.__max_fps = 1 / (num_leds * self.__BITS_PER_LED / self.__FREQ_HZ + self.__RESET_WAIT_TIME_S)
+        self.__fps_log_time = time.monotonic()
+        self.__num_frames_since_fps_log = 0
+
         if clear_screen:
             self.clear_screen()
 
     def display_frame(self, frame):
-        # TODO: vectorize this shit
-        frame = frame.tolist()
-        for x in range(self.__display_width):
-            for y in range(self.__display_height):
-                r, g, b = frame[y][x]
-                pixel_index = x * self.__display_height + y
-                # TODO: this could also maybe be vectorized? e.g. use setPixelColor instead of setPixelColorRGB
-                # https://github.com/rpi-ws281x/rpi-ws281x-python/blob/29a99c00ac3eefebf01480d7cb3e6c355f40ce0c/library/rpi_ws281x/rpi_ws281x.py#L140-L149
-                self.__pixels.setPixelColorRGB(pixel_index, r, g, b)
+        # Pack each RGB triple into a single uint32: (r << 16) | (g << 8) | b
+        pixels = frame.reshape(-1, 3)
+        np.copyto(self.__packed_frame, pixels[:, 0])
+        self.__packed_frame <<= 8
+        self.__packed_frame |= pixels[:, 1]
+        self.__packed_frame <<= 8
+        self.__packed_frame |= pixels[:, 2]
+
+        # Reorder from frame order to LED order.
+        np.take(self.__packed_frame, self.__frame_index_for_led, out = self.__led_buffer)
+
+        if self.__leds_address is not None:
+            ctypes.memmove(self.__leds_address, self.__led_buffer.ctypes.data, self.__led_buffer.nbytes)
+        else:
+            for pixel_index, color in enumerate(self.__led_buffer.tolist()):
+                self.__pixels.setPixelColor(pixel_index, color)
 
         # We're done! Tell the underlying driver to send data to the LEDs.
         self.__pixels.show()
+        self.__maybe_log_fps()
 
     def set_brightness(self, brightness):
         mapped = brightness * 255 // 100
@@ -57,3 +102,31 @@ class DriverWs2812b(DriverBase):
     def clear_screen(self):
         shape = [self.__display_height, self.__display_width, 3]
         self.display_frame(np.zeros(shape, np.uint8))
+
+    # Returns the address of the ws281x library's LED buffer (an array of uint32, one per LED), so that
+    # a whole frame can be copied into it at once. The python bindings only expose per-LED setters, so
+    # we reach into the underlying SWIG channel struct. Returns None if that isn't possible, in which
+    # case we fall back to setting the LEDs one at a time.
+    def __get_leds_address(self):
+        try:
+            leds = rpi_ws281x.ws.ws2811_channel_t_leds_get(self.__pixels._channel)
+            address = int(leds)
+        except Exception as e:
+            self.__logger.warning(f'Unable to get ws281x LED buffer address, falling back to per-LED writes: {e}')
+            return None
+        if not address:
+            return None
+        return address
+
+    def __maybe_log_fps(self):
+        self.__num_frames_since_fps_log += 1
+        now = time.monotonic()
+        elapsed = now - self.__fps_log_time
+        if elapsed < self.__FPS_LOG_INTERVAL_S:
+            return
+
+        fps = self.__num_frames_since_fps_log / elapsed
+        self.__logger.info(f'Displayed {round(fps, 1)} fps over the last {round(elapsed)} s. Theoretical max ' +
+            f'refresh rate for {self.__led_buffer.size} LEDs: {round(self.__max_fps, 1)} fps.')
+        self.__fps_log_time = now
+        self.__num_frames_since_fps_log = 0
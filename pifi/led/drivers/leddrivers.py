@@ -1,5 +1,24 @@
+from pifi.config import Config
+
 class LedDrivers:
     
     DRIVER_APA102 = 'apa102'
     DRIVER_RGBMATRIX = 'rgbmatrix'
     DRIVER_WS2812B = 'ws2812b'
+
+    # Instantiates the driver for the hardware configured in `leds.driver`. The drivers are imported
+    # lazily, because each of them depends on a hardware library that the others don't need.
+    @staticmethod
+    def make_driver(clear_screen = True):
+        led_driver = Config.get_or_throw('leds.driver')
+        if led_driver == LedDrivers.DRIVER_APA102:
+            from pifi.led.drivers.driverapa102 import DriverApa102
+            return DriverApa102(clear_screen)
+        elif led_driver == LedDrivers.DRIVER_RGBMATRIX:
+            from pifi.led.drivers.driverrgbmatrix import DriverRgbMatrix
+            return DriverRgbMatrix(clear_screen)
+        elif led_driver == LedDrivers.DRIVER_WS2812B:
+            from pifi.led.drivers.driverws2812b import DriverWs2812b
+            return DriverWs2812b(clear_screen)
+        else:
+            raise Exception(f'Unsupported driver: {led_driver}.')
@@ -17,5 +17,5 @@ class FramePlayerBase(ABC):
         pass
 
     @abstractmethod
-    def fade_to_frame(self, frame):
+    def fade_to_frame(self, frame, duration = None):
         pass
@@ -0,0 +1,110 @@
+import numpy as np
+import sys
+
+from pifi.led.gamma import Gamma
+from pifi.video.videocolormode import VideoColorMode
+
+# A FrameTransformPlan turns an input frame, which may be either a 2-dimensional byte array if
+# VideoColorMode.is_color_mode_rgb() is false, or 3d otherwise, into an output frame suitable
+# for final display.
+#
+# The color mode mapping, per-channel gamma curves, and inversion are all folded into lookup
+# tables when the plan is built. Flipping is folded into the read of the input frame by way of
+# a reversed view. Thus, transforming a frame is a single gather into an output buffer that is
+# reused for every frame, and no memory is allocated per frame.
+#
+# Note that the output buffer is overwritten by each call to transform(). Callers that need to
+# hold onto a transformed frame must copy it.
+class FrameTransformPlan:
+
+    __NUM_COLOR_VALUES = 256
+
+    # gamma_controller: a Gamma instance, or None to skip gamma correction.
+    def __init__(self, video_color_mode, gamma_controller, display_width, display_height, flip_x, flip_y):
+        if video_color_mode not in VideoColorMode.COLOR_MODES:
+            raise Exception(f'Unexpected color mode: {video_color_mode}.')
+
+        self.__is_color_mode_rgb = VideoColorMode.is_color_mode_rgb(video_color_mode)
+        self.__gamma_controller = gamma_controller
+        self.__output_frame = np.zeros([display_height, display_width, 3], np.uint8)
+        self.__flip_slices = (
+            slice(None, None, -1) if flip_y else slice(None),
+            slice(None, None, -1) if flip_x else slice(None),
+        )
+
+        # Static gamma is used for RGB color modes, dynamic gamma (one table per gamma curve, chosen
+        # per frame based on the frame's brightness) for monochrome color modes.
+        self.__is_dynamic_gamma = gamma_controller is not None and not self.__is_color_mode_rgb
+        if gamma_controller is None:
+            curve_indices = [None]
+        elif self.__is_dynamic_gamma:
+            curve_indices = range(len(gamma_controller.scale_red_curves))
+        else:
+            curve_indices = [Gamma.DEFAULT_GAMMA_INDEX]
+
+        # Each table has shape [256, 3]: table[v] is the output RGB triple for input value v.
+        self.__tables = np.stack([
+            self.__build_table(video_color_mode, gamma_controller, curve_index) for curve_index in curve_indices
+        ])
+
+        if self.__is_color_mode_rgb:
+            self.__is_identity = (
+                gamma_controller is None and video_color_mode == VideoColorMode.COLOR_MODE_COLOR
+            )
+
+            # For RGB color modes, each channel has its own lookup table. They are laid out back to back
+            # in a flat lookup table, such that channel c of input value v is at index (c * 256 + v).
+            self.__flat_table = np.ascontiguousarray(self.__tables[0].T).reshape(-1)
+
+            # The gather index for each output value is a uint16 whose high byte is the channel number
+            # and whose low byte is the input value. The high bytes are constant, so only the low bytes
+            # need to be written for each frame.
+            self.__gather_index = np.empty([display_height, display_width, 3], np.uint16)
+            self.__gather_index[...] = np.arange(3, dtype = np.uint16) * self.__NUM_COLOR_VALUES
+            low_byte_offset = 0 if sys.byteorder == 'little' else 1
+            self.__gather_index_low_bytes = self.__gather_index.view(np.uint8)[..., low_byte_offset::2]
+
+    def transform(self, frame):
+        source = frame[self.__flip_slices]
+
+        if self.__is_color_mode_rgb:
+            if self.__is_identity:
+                np.copyto(self.__output_frame, source, casting = 'unsafe')
+            else:
+                np.copyto(self.__gather_index_low_bytes, source, casting = 'unsafe')
+                np.take(self.__flat_table, self.__gather_index, out = self.__output_frame, mode = 'wrap')
+            return self.__output_frame
+
+        table = self.__tables[0]
+        if self.__is_dynamic_gamma:
+            table = self.__tables[self.__gamma_controller.getGammaIndexForMonochromeFrame(frame)]
+        np.take(table, source, axis = 0, out = self.__output_frame, mode = 'wrap')
+        return self.__output_frame
+
+    def __build_table(self, video_color_mode, gamma_controller, curve_index):
+        values = np.arange(self.__NUM_COLOR_VALUES)
+        if video_color_mode in (VideoColorMode.COLOR_MODE_INVERT_COLOR, VideoColorMode.COLOR_MODE_INVERT_BW):
+            values = values[::-1]
+
+        if video_color_mode == VideoColorMode.COLOR_MODE_R:
+            channels = (0,)
+        elif video_color_mode == VideoColorMode.COLOR_MODE_G:
+            channels = (1,)
+        elif video_color_mode == VideoColorMode.COLOR_MODE_B:
+            channels = (2,)
+        else:
+            channels = (0, 1, 2)
+
+        if gamma_controller is None:
+            curves = [np.arange(self.__NUM_COLOR_VALUES)] * 3
+        else:
+            curves = [
+                np.array(gamma_controller.scale_red_curves[curve_index]),
+                np.array(gamma_controller.scale_green_curves[curve_index]),
+                np.array(gamma_controller.scale_blue_curves[curve_index]),
+            ]
+
+        table = np.zeros([self.__NUM_COLOR_VALUES, 3], np.uint8)
+        for channel in channels:
+            table[:, channel] = curves[channel][values]
+        return table
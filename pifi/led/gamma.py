@@ -1,5 +1,10 @@
+import os
+import tempfile
+
 import numpy as np
 
+from pifi.directoryutils import DirectoryUtils
+from pifi.logger import Logger
 from pifi.video.videocolormode import VideoColorMode
 
 class Gamma:
@@ -15,27 +20,93 @@ class Gamma:
     __GREEN_MAX_BRIGHTNESS = .45
     __BLUE_MAX_BRIGHTNESS = .375
 
+    # The gamma curves for each channel are persisted to this file so that they're loaded with a single file read
+    # rather than computed in each process. It holds two arrays:
+    #   curves: uint8 array of shape [3, num gamma curves, 256]. The red, green, and blue curves, before any color
+    #       mode specific tweaks.
+    #   params: the parameters the curves were generated with. See: __get_params
+    CURVES_FILE_PATH = DirectoryUtils().root_dir + '/data/gamma_tables.npz'
+
+    # Bump this when changing how the curves are generated, so that existing curves files are regenerated.
+    __CURVES_VERSION = 1
+
+    # Process-wide cache of the curves, keyed by color mode and per-channel max brightness.
+    __curves_cache = {}
+
+    # Estimators for choosing the gamma curve for each monochrome frame.
+    #   exact: computes the mean and standard deviation of every pixel in each frame.
+    #   streaming: computes them on a strided subsample of each frame, and smooths the chosen gamma curve over
+    #       time so that it doesn't flicker between neighboring curves from frame to frame.
+    ESTIMATOR_EXACT = 'exact'
+    ESTIMATOR_STREAMING = 'streaming'
+    ESTIMATORS = [ESTIMATOR_EXACT, ESTIMATOR_STREAMING]
+
+    # Max number of pixels the streaming estimator samples per frame. The starting offset rotates each frame, so
+    # consecutive frames sample different pixels.
+    __STREAMING_SAMPLE_SIZE = 256
+
+    # Weight of the newest frame in the streaming estimator's exponential moving average of the gamma index.
+    __STREAMING_SMOOTHING = 0.25
+
+    # How far the smoothed gamma index must drift from the current gamma curve before switching curves.
+    __STREAMING_HYSTERESIS = 1
+
+    # A jump in the gamma index at least this large (e.g. a scene cut) is followed immediately rather than smoothed.
+    __STREAMING_SCENE_CUT_THRESHOLD = 6
+
     # video_color_mode: only applicable when playing videos
-    def __init__(self, video_color_mode = VideoColorMode.COLOR_MODE_COLOR):
-        # list of gamma curves from min to max
-        self.scale_red_curves = []
-        self.scale_blue_curves = []
-        self.scale_green_curves = []
+    # estimator: one of Gamma.ESTIMATORS. Only applicable for monochrome color modes.
+    def __init__(self, video_color_mode = VideoColorMode.COLOR_MODE_COLOR, estimator = ESTIMATOR_EXACT):
+        if estimator not in Gamma.ESTIMATORS:
+            raise Exception(f'Unexpected gamma estimator: {estimator}.')
+        self.__estimator = estimator
 
-        self.__generateGammaScales(video_color_mode)
+        # Arrays of gamma curves from min to max, each of shape [num gamma curves, 256]. These are shared
+        # between instances and must not be modified.
+        self.scale_red_curves, self.scale_green_curves, self.scale_blue_curves = Gamma.__get_curves(video_color_mode)
+
+        # State for the streaming estimator.
+        self.__num_frames = 0
+        self.__smoothed_gamma_index = None
+        self.__gamma_index = None
 
     # powers auto dynamic gamma curve using the average brightness of the given frame
     def getGammaIndexForMonochromeFrame(self, frame):
-        brightness_avg = np.mean(frame)
-        brightness_std = np.std(frame)
+        if self.__estimator == Gamma.ESTIMATOR_STREAMING:
+            return self.__get_streaming_gamma_index(frame)
+        return self.__clamp_gamma_index(self.__get_unclamped_gamma_index(np.mean(frame), np.std(frame)))
+
+    def __get_streaming_gamma_index(self, frame):
+        pixels = frame.reshape(-1)
+        stride = max(1, pixels.size // Gamma.__STREAMING_SAMPLE_SIZE)
+        sample = pixels[self.__num_frames % stride::stride].astype(np.float32)
+        self.__num_frames += 1
+
+        # A sum and a dot product are much cheaper than np.mean and np.std, which make several passes.
+        brightness_avg = float(sample.sum()) / sample.size
+        brightness_var = float(np.dot(sample, sample)) / sample.size - brightness_avg * brightness_avg
+        gamma_index = self.__get_unclamped_gamma_index(brightness_avg, max(0, brightness_var) ** 0.5)
+        if (
+            self.__smoothed_gamma_index is None or
+            abs(gamma_index - self.__smoothed_gamma_index) >= Gamma.__STREAMING_SCENE_CUT_THRESHOLD
+        ):
+            self.__smoothed_gamma_index = gamma_index
+        else:
+            self.__smoothed_gamma_index += Gamma.__STREAMING_SMOOTHING * (gamma_index - self.__smoothed_gamma_index)
+
+        if self.__gamma_index is None or abs(self.__smoothed_gamma_index - self.__gamma_index) >= Gamma.__STREAMING_HYSTERESIS:
+            self.__gamma_index = self.__clamp_gamma_index(self.__smoothed_gamma_index)
+        return self.__gamma_index
 
+    def __get_unclamped_gamma_index(self, brightness_avg, brightness_std):
         # magic defined here: https://docs.google.com/spreadsheets/d/1hF3N0hCOzZlIG9VZPjADr9MhL_TWClaLHs6NJCH47AM/edit#gid=0
         # calibrated with:
         #   * --brightness of 3 (i think?)
         #   * black and white video
         #   * using opencv LED color averaging rather than ffmpeg (https://github.com/dasl-/pifi/commit/8a4703fb479421160b9c119dc718b747a8627b4f#commitcomment-34206224)
-        gamma_index = (-0.2653691135 * brightness_std) + (0.112790567 * (brightness_avg)) + 18.25205188
+        return (-0.2653691135 * brightness_std) + (0.112790567 * (brightness_avg)) + 18.25205188
 
+    def __clamp_gamma_index(self, gamma_index):
         if gamma_index < 0:
             return 0
         elif gamma_index >= ((self.__MAX_GAMMA_CURVE - self.__MIN_GAMMA_CURVE) * 10) - 1:
@@ -43,37 +114,86 @@ class Gamma:
         else:
             return int(round(gamma_index))
 
-    # gamma: Correction factor
+    @staticmethod
+    def __get_curves(video_color_mode):
+        # Black and white is the only color mode with its own curves, so the other color modes share a key.
+        key = (
+            video_color_mode == VideoColorMode.COLOR_MODE_BW,
+            Gamma.__RED_MAX_BRIGHTNESS, Gamma.__GREEN_MAX_BRIGHTNESS, Gamma.__BLUE_MAX_BRIGHTNESS,
+        )
+        if key not in Gamma.__curves_cache:
+            curves = Gamma.__get_base_curves().copy()
+
+            # for black and white, if r, g, or b has a zero in the scale they all should be 0
+            # otherwise dim pixels will be just that color
+            if video_color_mode == VideoColorMode.COLOR_MODE_BW:
+                is_leading_zero = np.logical_and.accumulate(curves.min(axis = 0) == 0, axis = 1)
+                curves[:, is_leading_zero] = 0
+
+            curves.setflags(write = False)
+            Gamma.__curves_cache[key] = curves
+        return Gamma.__curves_cache[key]
+
+    @staticmethod
+    def __get_base_curves():
+        params = Gamma.__get_params()
+        try:
+            with np.load(Gamma.CURVES_FILE_PATH) as curves_file:
+                if np.array_equal(curves_file['params'], params):
+                    curves = curves_file['curves']
+                    if curves.dtype == np.uint8 and curves.shape == (3, Gamma.__get_num_curves(), 256):
+                        return curves
+        except (OSError, ValueError, KeyError):
+            pass
+
+        curves = Gamma.__generate_base_curves(Gamma.__get_max_outs())
+        Gamma.__save_base_curves(curves, params)
+        return curves
+
+    # gamma: Correction factor, one per curve
     # max_in: Top end of INPUT range
-    # max_out: Top end of OUTPUT range
+    # max_out: Top end of OUTPUT range, one per channel
     # https://learn.adafruit.com/led-tricks-gamma-correction/
-    def __getGammaScaleValues(self, gamma, max_in, max_out):
-        gamma_list = []
-        for i in range(0, max_in + 1):
-            gamma_list.append(
-                int(
-                    round(
-                        pow(float(i / max_in), gamma) * max_out
-                    )
-                )
-            )
-
-        return gamma_list
-
-    def __generateGammaScales(self, video_color_mode):
-        for i in range(self.__MIN_GAMMA_CURVE * 10, self.__MAX_GAMMA_CURVE * 10):
-            self.scale_red_curves.append(self.__getGammaScaleValues(i / 10, 255, int(255 * self.__RED_MAX_BRIGHTNESS)))
-            self.scale_blue_curves.append(self.__getGammaScaleValues(i / 10, 255, int(255 * self.__BLUE_MAX_BRIGHTNESS)))
-            self.scale_green_curves.append(self.__getGammaScaleValues(i / 10, 255, int(255 * self.__GREEN_MAX_BRIGHTNESS)))
-
-        # for black and white, if r, g, or b has a zero in the scale they all should be 0
-        # otherwise dim pixels will be just that color
-        if video_color_mode == VideoColorMode.COLOR_MODE_BW:
-            for g in range(0, ((self.__MAX_GAMMA_CURVE - self.__MIN_GAMMA_CURVE) * 10)):
-                for i in range(0, 256):
-                    if min(self.scale_red_curves[g][i], self.scale_green_curves[g][i], self.scale_blue_curves[g][i]) == 0:
-                        self.scale_red_curves[g][i] = 0
-                        self.scale_green_curves[g][i] = 0
-                        self.scale_blue_curves[g][i] = 0
-                    else:
-                        break
+    @staticmethod
+    def __generate_base_curves(max_outs):
+        max_in = 255
+        gammas = np.arange(Gamma.__MIN_GAMMA_CURVE * 10, Gamma.__MAX_GAMMA_CURVE * 10) / 10
+        inputs = np.arange(0, max_in + 1) / max_in
+        curves = np.power(inputs[np.newaxis, :], gammas[:, np.newaxis])
+
+        # np.round, like python's round, rounds halves to even.
+        return np.round(curves[np.newaxis, :, :] * max_outs[:, :, np.newaxis]).astype(np.uint8)
+
+    # Write to a temp file and rename it into place, so that concurrent readers never see a partial file.
+    @staticmethod
+    def __save_base_curves(curves, params):
+        try:
+            directory = os.path.dirname(Gamma.CURVES_FILE_PATH)
+            os.makedirs(directory, exist_ok = True)
+            fd, tmp_path = tempfile.mkstemp(dir = directory, suffix = '.npz')
+            with os.fdopen(fd, 'wb') as tmp_file:
+                np.savez(tmp_file, curves = curves, params = params)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, Gamma.CURVES_FILE_PATH)
+        except OSError as e:
+            Logger().set_namespace('Gamma').warning(f'Unable to save gamma curves to {Gamma.CURVES_FILE_PATH}: {e}')
+
+    # Everything the curves depend on. If any of these change, the curves file is stale.
+    @staticmethod
+    def __get_params():
+        return np.array([
+            Gamma.__CURVES_VERSION, Gamma.__MIN_GAMMA_CURVE, Gamma.__MAX_GAMMA_CURVE,
+            Gamma.__RED_MAX_BRIGHTNESS, Gamma.__GREEN_MAX_BRIGHTNESS, Gamma.__BLUE_MAX_BRIGHTNESS,
+        ], np.float64)
+
+    @staticmethod
+    def __get_max_outs():
+        return np.array([
+            [int(255 * Gamma.__RED_MAX_BRIGHTNESS)],
+            [int(255 * Gamma.__GREEN_MAX_BRIGHTNESS)],
+            [int(255 * Gamma.__BLUE_MAX_BRIGHTNESS)],
+        ])
+
+    @staticmethod
+    def __get_num_curves():
+        return (Gamma.__MAX_GAMMA_CURVE - Gamma.__MIN_GAMMA_CURVE) * 10
@@ -1,25 +1,56 @@
+import atexit
+import threading
 import time
+import traceback
 
 import numpy as np
 
 from pifi.config import Config
 from pifi.directoryutils import DirectoryUtils
 from pifi.led.frameplayerbase import FramePlayerBase
+from pifi.led.frametransformplan import FrameTransformPlan
 from pifi.led.gamma import Gamma
+from pifi.led.sharedframering import SharedFrameRing
 from pifi.led.drivers.leddrivers import LedDrivers
+from pifi.logger import Logger
 from pifi.settingsdb import SettingsDb
 from pifi.video.videocolormode import VideoColorMode
 
 class LedFramePlayer(FramePlayerBase):
 
-    __FADE_STEPS = 5
+    # Default duration of fade_to_frame, in seconds.
+    __DEFAULT_FADE_DURATION_S = 0.1
+
+    # Max rate at which intermediate fade frames are scheduled. Slow drivers will naturally
+    # display fewer intermediate frames, but the fade still lasts the same wall-clock time.
+    __FADE_MAX_FPS = 60
+
+    # Fade progress is expressed as a fixed point integer in [0, 2 ** __FADE_FIXED_POINT_BITS].
+    # With 7 bits, the largest intermediate value (255 * 128) still fits in an int16.
+    __FADE_FIXED_POINT_BITS = 7
+
+    # Default rate at which the output thread pushes frames to the LEDs, when async output is enabled.
+    __DEFAULT_OUTPUT_REFRESH_RATE = 60
+
+    # How often to log output stats. See: get_output_stats
+    __STATS_LOG_INTERVAL_S = 60
 
     # clear_screen: whether to clear the screen when initializing
-    def __init__(self, clear_screen = True):
+    # display_priority: only applicable when the display service is enabled. One of the
+    #   SharedFrameRing.PRIORITY_* constants. See: SharedFrameRing
+    def __init__(self, clear_screen = True, display_priority = SharedFrameRing.PRIORITY_PLAYBACK):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+
+        # A copy of the most recent frame that was displayed. In async output mode, the most recent frame that was
+        # published to the output thread. Fades start from it.
         self.__current_frame = None
-        self.__cached_brightness = max(0, min(100, Config.get('leds.brightness')))
         self.__last_driver_brightness = None
-        self.__brightness_cache_time = 0
+
+        # Scratch buffers for fade_to_frame, preallocated lazily for the shape of the frames being faded.
+        self.__fade_from = None
+        self.__fade_delta = None
+        self.__fade_scratch = None
+        self.__fade_frame = None
 
         # Check if gamma correction should be applied
         # RGB Matrix panels typically don't need the aggressive gamma/color correction
@@ -27,89 +58,144 @@ class LedFramePlayer(FramePlayerBase):
         led_driver = Config.get_or_throw('leds.driver')
         default_gamma = led_driver != LedDrivers.DRIVER_RGBMATRIX
         self.__gamma_enabled = Config.get('leds.gamma_enabled', default_gamma)
+        self.__gamma_estimator = Config.get('leds.dynamic_gamma_estimator', Gamma.ESTIMATOR_EXACT)
+
+        # These are read once rather than per frame, because Config.get is relatively expensive in
+        # the per-frame hot path.
+        self.__display_width = Config.get_or_throw('leds.display_width')
+        self.__display_height = Config.get_or_throw('leds.display_height')
+        self.__flip_x = Config.get('leds.flip_x')
+        self.__flip_y = Config.get('leds.flip_y')
+
+        # Transform plans are memoized per color mode, because VideoProcessor switches the color mode
+        # at least twice per video.
+        self.__transform_plans = {}
 
         self.set_video_color_mode(VideoColorMode.COLOR_MODE_COLOR)
-        if led_driver == LedDrivers.DRIVER_APA102:
-            from pifi.led.drivers.driverapa102 import DriverApa102
-            self.__driver = DriverApa102(clear_screen)
-        elif led_driver == LedDrivers.DRIVER_RGBMATRIX:
-            from pifi.led.drivers.driverrgbmatrix import DriverRgbMatrix
-            self.__driver = DriverRgbMatrix(clear_screen)
-        elif led_driver == LedDrivers.DRIVER_WS2812B:
-            from pifi.led.drivers.driverws2812b import DriverWs2812b
-            self.__driver = DriverWs2812b(clear_screen)
+        if Config.get('leds.display_service.enabled', False):
+            from pifi.led.drivers.driverdisplayservice import DriverDisplayService
+            self.__driver = DriverDisplayService(clear_screen, display_priority)
         else:
-            raise Exception(f'Unsupported driver: {led_driver}.')
+            self.__driver = LedDrivers.make_driver(clear_screen)
 
         initial_brightness = self.__get_brightness()
         self.__driver.set_brightness(initial_brightness)
         self.__last_driver_brightness = initial_brightness
 
+        # Frames that are byte-identical to the last displayed frame are not written to the driver again,
+        # except every keep-alive interval, for LEDs that benefit from a periodic refresh.
+        self.__should_skip_unchanged_frames = Config.get('leds.skip_unchanged_frames', True)
+        self.__unchanged_frame_keep_alive_interval = Config.get('leds.unchanged_frame_keep_alive_interval', 0)
+        self.__last_displayed_frame = None
+        self.__is_last_displayed_frame_valid = False
+        self.__was_last_frame_rejected = False
+        self.__last_display_time = 0
+        self.__num_skipped_unchanged_frames = 0
+
+        # In async output mode, a dedicated thread owns the driver. Producers publish frames into a double
+        # buffer and return immediately, rather than blocking for the duration of the driver write. The
+        # output thread pushes the newest published frame to the LEDs at a fixed cadence.
+        self.__is_async_output = Config.get('leds.output_thread.enabled', False)
+        self.__num_output_frames = 0
+        self.__num_superseded_frames = 0
+        self.__num_dropped_frames = 0
+        self.__stats_log_time = time.monotonic()
+        self.__output_thread = None
+        if self.__is_async_output:
+            self.__start_output_thread()
+
     def set_video_color_mode(self, video_color_mode):
-        self.__gamma_controller = Gamma(video_color_mode=video_color_mode)
         self.__video_color_mode = video_color_mode
-
-        # static gamma curve
-        self.__scale_red_gamma_curve = None
-        self.__scale_green_gamma_curve = None
-        self.__scale_blue_gamma_curve = None
-
-        # dynamic gamma curves
-        self.__scale_red_gamma_curves = None
-        self.__scale_green_gamma_curves = None
-        self.__scale_blue_gamma_curves = None
-
-        # Memoizing the specific gamma curve index for static gamma videos enables us to shave
-        # 1 or 2 milliseconds off the loop per frame. See: self.__set_frame_pixels
-        if VideoColorMode.is_color_mode_rgb(video_color_mode):
-            # static gamma
-            self.__scale_red_gamma_curve = self.__gamma_controller.scale_red_curves[Gamma.DEFAULT_GAMMA_INDEX]
-            self.__scale_green_gamma_curve = self.__gamma_controller.scale_green_curves[Gamma.DEFAULT_GAMMA_INDEX]
-            self.__scale_blue_gamma_curve = self.__gamma_controller.scale_blue_curves[Gamma.DEFAULT_GAMMA_INDEX]
-        else:
-            # dynamic gamma
-            self.__scale_red_gamma_curves = self.__gamma_controller.scale_red_curves
-            self.__scale_green_gamma_curves = self.__gamma_controller.scale_green_curves
-            self.__scale_blue_gamma_curves = self.__gamma_controller.scale_blue_curves
+        if video_color_mode not in self.__transform_plans:
+            gamma_controller = None
+            if self.__gamma_enabled:
+                gamma_controller = Gamma(video_color_mode = video_color_mode, estimator = self.__gamma_estimator)
+            self.__transform_plans[video_color_mode] = FrameTransformPlan(
+                video_color_mode, gamma_controller, self.__display_width, self.__display_height,
+                self.__flip_x, self.__flip_y
+            )
+        self.__transform_plan = self.__transform_plans[video_color_mode]
 
     def clear_screen(self):
+        if not self.__is_async_output:
+            self.__clear_driver_screen()
+            return
+
+        # Discard any frame that hasn't been displayed yet, so that it doesn't show up after the clear.
+        with self.__driver_lock, self.__output_lock:
+            self.__has_pending_frame = False
+            self.__clear_driver_screen()
+
+    def __clear_driver_screen(self):
         self.__driver.clear_screen()
+        self.__is_last_displayed_frame_valid = False
 
     def play_frame(self, frame):
-        self.__current_frame = frame
-        self.__set_frame_pixels(frame)
+        if not self.__set_frame_pixels(frame):
+            return
+
+        # Callers may reuse their frame arrays, e.g. a ReadOnceFrameRingBuffer slot, so keep a copy.
+        if (
+            self.__current_frame is None or self.__current_frame.shape != frame.shape or
+            self.__current_frame.dtype != frame.dtype
+        ):
+            self.__current_frame = np.empty(frame.shape, frame.dtype)
+        np.copyto(self.__current_frame, frame)
 
     def get_current_frame(self):
         if self.__current_frame is None:
             return None
         return self.__current_frame.copy()
 
-    def fade_to_frame(self, frame):
-        if (self.__current_frame is None):
-            self.__current_frame = frame
+    # duration: how long the fade should last, in seconds. The intermediate frames are scheduled
+    #   against a deadline, so the fade lasts the same wall-clock time regardless of panel size
+    #   or how long the driver takes to display each frame.
+    def fade_to_frame(self, frame, duration = None):
+        if self.__current_frame is None or self.__current_frame.shape != frame.shape:
             return self.play_frame(frame)
 
-        display_width = Config.get_or_throw('leds.display_width')
-        display_height = Config.get_or_throw('leds.display_height')
-        frame_steps = np.zeros([display_height, display_width, 3], np.int8)
-
-        for x in range(display_width):
-            for y in range(display_height):
-                for rgb in range(0, 3):
-                    frame_steps[y, x, rgb] = ((frame[y, x, rgb].astype(np.int16) - self.__current_frame[y, x, rgb].astype(np.int16)) / self.__FADE_STEPS).astype(np.int8)
-
-        for current_step in range(1, self.__FADE_STEPS):
-            new_frame = np.zeros([display_height, display_width, 3], np.uint8)
-            for x in range(display_width):
-                for y in range(display_height):
-                    for rgb in range(0, 3):
-                        new_frame[y, x, rgb] = self.__current_frame[y, x, rgb] + (frame_steps[y, x, rgb] * current_step)
-
-            # no need to sleep since the above calculation takes some small amount of time
-            self.__set_frame_pixels(new_frame)
+        if duration is None:
+            duration = self.__DEFAULT_FADE_DURATION_S
+        if duration <= 0:
+            return self.play_frame(frame)
 
-        self.__current_frame = frame
-        self.__set_frame_pixels(frame)
+        self.__ensure_fade_buffers(frame.shape)
+        np.copyto(self.__fade_from, self.__current_frame, casting = 'unsafe')
+        np.subtract(frame, self.__fade_from, out = self.__fade_delta, casting = 'unsafe')
+
+        max_progress = 1 << self.__FADE_FIXED_POINT_BITS
+        frame_interval = 1 / self.__FADE_MAX_FPS
+        fade_start_time = time.monotonic()
+        deadline = fade_start_time + duration
+        next_frame_time = fade_start_time + frame_interval
+        while True:
+            now = time.monotonic()
+            if next_frame_time > now:
+                time.sleep(next_frame_time - now)
+                now = next_frame_time
+            if now >= deadline:
+                break
+
+            progress = int((now - fade_start_time) / duration * max_progress)
+            np.multiply(self.__fade_delta, progress, out = self.__fade_scratch)
+            np.right_shift(self.__fade_scratch, self.__FADE_FIXED_POINT_BITS, out = self.__fade_scratch)
+            np.add(self.__fade_scratch, self.__fade_from, out = self.__fade_scratch)
+            np.copyto(self.__fade_frame, self.__fade_scratch, casting = 'unsafe')
+            self.__set_frame_pixels(self.__fade_frame)
+
+            # If displaying the frame made us fall behind schedule, skip ahead rather than trying to
+            # catch up. This drops intermediate frames instead of extending the fade.
+            next_frame_time = max(next_frame_time + frame_interval, time.monotonic())
+
+        self.play_frame(frame)
+
+    def __ensure_fade_buffers(self, shape):
+        if self.__fade_frame is not None and self.__fade_frame.shape == shape:
+            return
+        self.__fade_from = np.zeros(shape, np.int16)
+        self.__fade_delta = np.zeros(shape, np.int16)
+        self.__fade_scratch = np.zeros(shape, np.int16)
+        self.__fade_frame = np.zeros(shape, np.uint8)
 
     def show_loading_screen(self):
         filename = 'loading_screen_monochrome.npy'
@@ -121,91 +207,55 @@ class LedFramePlayer(FramePlayerBase):
     def can_multiple_driver_instances_coexist(self):
         return self.__driver.can_multiple_driver_instances_coexist()
 
-    __BRIGHTNESS_CACHE_TTL = 1.5
+    # See: DriverBase.get_last_vsync_wait_time
+    def get_last_vsync_wait_time(self):
+        return self.__driver.get_last_vsync_wait_time()
+
+    # Counters:
+    #   skipped_unchanged_frames: driver writes avoided because the frame was identical to the last displayed one.
+    # Counters for async output mode:
+    #   output_frames: frames pushed to the LEDs by the output thread.
+    #   superseded_frames: frames that were replaced by a newer frame before the output thread displayed them.
+    #   dropped_frames: refresh ticks that the output thread missed because a driver write overran the cadence.
+    def get_output_stats(self):
+        return {
+            'skipped_unchanged_frames': self.__num_skipped_unchanged_frames,
+            'output_frames': self.__num_output_frames,
+            'superseded_frames': self.__num_superseded_frames,
+            'dropped_frames': self.__num_dropped_frames,
+        }
+
+    # Stops the output thread, if any. The most recently published frame may not be displayed. This happens
+    # automatically when the process exits, so that the thread isn't killed in the middle of a driver write.
+    def stop_output_thread(self):
+        if self.__output_thread is None:
+            return
+        self.__stop_output_event.set()
+        self.__output_thread.join()
+        self.__output_thread = None
+        atexit.unregister(self.stop_output_thread)
+        self.__log_output_stats()
 
     def __get_brightness(self):
         """Get brightness from settings DB as 0-100 int. Falls back to config's leds.brightness."""
-        now = time.time()
-        if now - self.__brightness_cache_time < self.__BRIGHTNESS_CACHE_TTL:
-            return self.__cached_brightness
-
+        # Cheap enough to call for every frame: SettingsDb mirrors the settings table in memory.
         try:
             brightness_str = SettingsDb().get(SettingsDb.BRIGHTNESS)
             if brightness_str is not None:
-                self.__cached_brightness = max(0, min(100, int(brightness_str)))
-            else:
-                self.__cached_brightness = max(0, min(100, Config.get('leds.brightness')))
+                return max(0, min(100, int(brightness_str)))
         except (ValueError, TypeError):
-            self.__cached_brightness = max(0, min(100, Config.get('leds.brightness')))
-        self.__brightness_cache_time = now
-        return self.__cached_brightness
+            pass
+        return max(0, min(100, Config.get('leds.brightness')))
 
     # This method transforms an input frame, which may be either a 2-dimensional
     # byte array if VideoColorMode.is_color_mode_rgb() is false, or 3d
     # otherwise, into an output frame by applying the user-provided transforms
     # such as color mode and flipping. The output is a 3d byte array suitable
-    # for final display.
-    def __transform_frame(self, frame):
-        shape = [Config.get_or_throw('leds.display_height'), Config.get_or_throw('leds.display_width'), 3]
-        transformed_frame = np.zeros(shape, np.uint8)
-
-        if self.__gamma_enabled:
-            if not VideoColorMode.is_color_mode_rgb(self.__video_color_mode):
-                gamma_index = self.__gamma_controller.getGammaIndexForMonochromeFrame(frame)
-
-            if self.__video_color_mode == VideoColorMode.COLOR_MODE_COLOR:
-                transformed_frame[:, :, 0] = np.take(self.__scale_red_gamma_curve, frame[:, :, 0])
-                transformed_frame[:, :, 1] = np.take(self.__scale_green_gamma_curve, frame[:, :, 1])
-                transformed_frame[:, :, 2] = np.take(self.__scale_blue_gamma_curve, frame[:, :, 2])
-            elif self.__video_color_mode == VideoColorMode.COLOR_MODE_R:
-                transformed_frame[:, :, 0] = np.take(self.__scale_red_gamma_curves[gamma_index], frame[:, :])
-            elif self.__video_color_mode == VideoColorMode.COLOR_MODE_G:
-                transformed_frame[:, :, 1] = np.take(self.__scale_green_gamma_curves[gamma_index], frame[:, :])
-            elif self.__video_color_mode == VideoColorMode.COLOR_MODE_B:
-                transformed_frame[:, :, 2] = np.take(self.__scale_blue_gamma_curves[gamma_index], frame[:, :])
-            elif self.__video_color_mode == VideoColorMode.COLOR_MODE_BW:
-                transformed_frame[:, :, 0] = np.take(self.__scale_red_gamma_curves[gamma_index], frame[:, :])
-                transformed_frame[:, :, 1] = np.take(self.__scale_green_gamma_curves[gamma_index], frame[:, :])
-                transformed_frame[:, :, 2] = np.take(self.__scale_blue_gamma_curves[gamma_index], frame[:, :])
-            elif self.__video_color_mode == VideoColorMode.COLOR_MODE_INVERT_COLOR:
-                transformed_frame[:, :, 0] = np.take(self.__scale_red_gamma_curve, 255 - frame[:, :, 0])
-                transformed_frame[:, :, 1] = np.take(self.__scale_green_gamma_curve, 255 - frame[:, :, 1])
-                transformed_frame[:, :, 2] = np.take(self.__scale_blue_gamma_curve, 255 - frame[:, :, 2])
-            elif self.__video_color_mode == VideoColorMode.COLOR_MODE_INVERT_BW:
-                transformed_frame[:, :, 0] = np.take(self.__scale_red_gamma_curves[gamma_index], 255 - frame[:, :])
-                transformed_frame[:, :, 1] = np.take(self.__scale_green_gamma_curves[gamma_index], 255 - frame[:, :])
-                transformed_frame[:, :, 2] = np.take(self.__scale_blue_gamma_curves[gamma_index], 255 - frame[:, :])
-            else:
-                raise Exception(f'Unexpected color mode: {self.__video_color_mode}.')
-        else:
-            if self.__video_color_mode == VideoColorMode.COLOR_MODE_COLOR:
-                transformed_frame[:, :, :] = frame
-            elif self.__video_color_mode == VideoColorMode.COLOR_MODE_R:
-                transformed_frame[:, :, 0] = frame[:, :]
-            elif self.__video_color_mode == VideoColorMode.COLOR_MODE_G:
-                transformed_frame[:, :, 1] = frame[:, :]
-            elif self.__video_color_mode == VideoColorMode.COLOR_MODE_B:
-                transformed_frame[:, :, 2] = frame[:, :]
-            elif self.__video_color_mode == VideoColorMode.COLOR_MODE_BW:
-                transformed_frame[:, :, 0] = frame[:, :]
-                transformed_frame[:, :, 1] = frame[:, :]
-                transformed_frame[:, :, 2] = frame[:, :]
-            elif self.__video_color_mode == VideoColorMode.COLOR_MODE_INVERT_COLOR:
-                transformed_frame[:, :, :] = 255 - frame
-            elif self.__video_color_mode == VideoColorMode.COLOR_MODE_INVERT_BW:
-                transformed_frame[:, :, 0] = 255 - frame[:, :]
-                transformed_frame[:, :, 1] = 255 - frame[:, :]
-                transformed_frame[:, :, 2] = 255 - frame[:, :]
-            else:
-                raise Exception(f'Unexpected color mode: {self.__video_color_mode}.')
-
-        flips = ()
-        if Config.get('leds.flip_y'):
-            flips += (0,)
-        if Config.get('leds.flip_x'):
-            flips += (1,)
-        if flips:
-            transformed_frame = np.flip(transformed_frame, flips)
+    # for final display. See: FrameTransformPlan
+    #
+    # The returned array is reused for every frame; it is overwritten by the next call.
+    def __transform_frame(self, frame, transform_plan):
+        transformed_frame = transform_plan.transform(frame)
 
         # Apply brightness via native driver API
         brightness = self.__get_brightness()
@@ -213,8 +263,142 @@ class LedFramePlayer(FramePlayerBase):
             self.__driver.set_brightness(brightness)
             self.__last_driver_brightness = brightness
 
+            # Some drivers only apply the new brightness when the next frame is written.
+            self.__is_last_displayed_frame_valid = False
+
         return transformed_frame
 
+    # Returns False if the driver rejected the frame. See: DriverBase.display_frame
     def __set_frame_pixels(self, frame):
-        output_frame = self.__transform_frame(frame)
-        self.__driver.display_frame(output_frame)
+        if self.__is_async_output:
+            self.__publish_frame(frame)
+            return True
+        output_frame = self.__transform_frame(frame, self.__transform_plan)
+        self.__display_transformed_frame(output_frame)
+        self.__maybe_log_output_stats()
+        return not self.__was_last_frame_rejected
+
+    # Returns whether the frame was written to the driver. Sets __was_last_frame_rejected.
+    def __display_transformed_frame(self, output_frame):
+        self.__was_last_frame_rejected = False
+        if not self.__should_skip_unchanged_frames:
+            return self.__write_to_driver(output_frame)
+
+        now = time.monotonic()
+        if (
+            self.__is_last_displayed_frame_valid and
+            (
+                self.__unchanged_frame_keep_alive_interval <= 0 or
+                now - self.__last_display_time < self.__unchanged_frame_keep_alive_interval
+            ) and
+            np.array_equal(output_frame, self.__last_displayed_frame)
+        ):
+            self.__num_skipped_unchanged_frames += 1
+            return False
+
+        if not self.__write_to_driver(output_frame):
+            return False
+
+        # The transformed frame is a buffer that's reused by the transform plan, so keep a copy of it.
+        if self.__last_displayed_frame is None or self.__last_displayed_frame.shape != output_frame.shape:
+            self.__last_displayed_frame = np.empty(output_frame.shape, np.uint8)
+        np.copyto(self.__last_displayed_frame, output_frame)
+        self.__is_last_displayed_frame_valid = True
+        self.__last_display_time = now
+        return True
+
+    # Returns False if the driver rejected the frame.
+    def __write_to_driver(self, output_frame):
+        if self.__driver.display_frame(output_frame) is False:
+            # Whatever is on the display now, it isn't our last displayed frame.
+            self.__was_last_frame_rejected = True
+            self.__is_last_displayed_frame_valid = False
+            return False
+        return True
+
+    def __start_output_thread(self):
+        refresh_rate = Config.get('leds.output_thread.refresh_rate', self.__DEFAULT_OUTPUT_REFRESH_RATE)
+        if not refresh_rate or refresh_rate <= 0:
+            refresh_rate = self.__DEFAULT_OUTPUT_REFRESH_RATE
+        self.__output_interval = 1 / refresh_rate
+
+        # Lock ordering: __driver_lock is always acquired before __output_lock. Producers only ever take
+        # __output_lock, and only for as long as it takes to copy a frame into the back buffer.
+        self.__driver_lock = threading.Lock()
+        self.__output_lock = threading.Lock()
+
+        # Producers write into the back buffer; the output thread displays the front buffer. Callers may
+        # reuse their frame arrays after play_frame returns, so frames are always copied on publish.
+        self.__back_buffer = None
+        self.__front_buffer = None
+        self.__has_pending_frame = False
+
+        # The transform plan is captured along with each frame, because the color mode may change between
+        # publishing a frame and displaying it.
+        self.__pending_transform_plan = None
+
+        self.__stop_output_event = threading.Event()
+        self.__output_thread = threading.Thread(target = self.__run_output_loop, daemon = True)
+        self.__output_thread.start()
+        atexit.register(self.stop_output_thread)
+
+    # Latest frame wins: if the previously published frame hasn't been displayed yet, it is overwritten.
+    def __publish_frame(self, frame):
+        with self.__output_lock:
+            if self.__back_buffer is None or self.__back_buffer.shape != frame.shape:
+                self.__back_buffer = np.empty(frame.shape, np.uint8)
+            np.copyto(self.__back_buffer, frame, casting = 'unsafe')
+            if self.__has_pending_frame:
+                self.__num_superseded_frames += 1
+            self.__has_pending_frame = True
+            self.__pending_transform_plan = self.__transform_plan
+
+    def __run_output_loop(self):
+        next_tick_time = time.monotonic()
+        while not self.__stop_output_event.is_set():
+            now = time.monotonic()
+            if next_tick_time > now:
+                # Sleep until the next tick, waking early if we're asked to stop.
+                if self.__stop_output_event.wait(next_tick_time - now):
+                    break
+
+            with self.__driver_lock:
+                with self.__output_lock:
+                    frame = None
+                    if self.__has_pending_frame:
+                        self.__front_buffer, self.__back_buffer = self.__back_buffer, self.__front_buffer
+                        self.__has_pending_frame = False
+                        frame = self.__front_buffer
+                        transform_plan = self.__pending_transform_plan
+
+                if frame is not None:
+                    try:
+                        if self.__display_transformed_frame(self.__transform_frame(frame, transform_plan)):
+                            self.__num_output_frames += 1
+                    except Exception:
+                        self.__logger.error(f'Error displaying frame from output thread: {traceback.format_exc()}')
+
+            # If the driver write overran one or more ticks, skip them rather than trying to catch up.
+            next_tick_time += self.__output_interval
+            num_missed_ticks = int((time.monotonic() - next_tick_time) // self.__output_interval)
+            if num_missed_ticks > 0:
+                self.__num_dropped_frames += num_missed_ticks
+                next_tick_time += num_missed_ticks * self.__output_interval
+            self.__maybe_log_output_stats()
+
+    def __maybe_log_output_stats(self):
+        if time.monotonic() - self.__stats_log_time < self.__STATS_LOG_INTERVAL_S:
+            return
+        self.__log_output_stats()
+
+    def __log_output_stats(self):
+        self.__stats_log_time = time.monotonic()
+        stats = self.get_output_stats()
+        msg = f"Skipped writing {stats['skipped_unchanged_frames']} frames that were unchanged."
+        if self.__is_async_output:
+            msg += (
+                f" Output thread displayed {stats['output_frames']} frames. {stats['superseded_frames']} frames " +
+                f"were superseded by a newer frame before being displayed, and {stats['dropped_frames']} refresh " +
+                "ticks were missed."
+            )
+        self.__logger.info(msg)
@@ -0,0 +1,254 @@
+import contextlib
+import fcntl
+import mmap
+import os
+import socket
+
+import numpy as np
+
+from pifi.processutils import ProcessUtils
+
+# A SharedFrameRing is a ring of fully transformed LED frames in a memory-mapped file, shared between the
+# display service (which owns the only LED driver instance) and the producer processes that want to display
+# frames: the Queue, video playback, screensavers, and games.
+#
+# Layout of the file, all integers are uint64:
+#   header: magic, sequence number of the newest published slot, owner pid, owner priority, num slots,
+#       display height, display width, padding.
+#   slot headers: one row of (sequence number, kind, brightness) per slot.
+#   frames: one [display_height, display_width, 3] uint8 frame per slot.
+#
+# Publishing is a seqlock: the writer marks the slot as being written (sequence number 0), writes it, stamps
+# it with its sequence number, and only then advances the header's sequence number. The reader copies the
+# newest slot and checks that its sequence number didn't change while copying. Only the newest frame is ever
+# read: if several frames were published since the reader last looked, the older ones are superseded.
+#
+# Only one producer owns the display at a time. Producers claim ownership under an exclusive flock on the
+# file, which also serializes publishing. A producer may take ownership if nobody owns the display, if the
+# owner process has exited, or if its priority is at least the owner's priority. Once another producer has
+# taken ownership, frames from the previous owner are dropped unless it has a strictly higher priority.
+class SharedFrameRing:
+
+    DEFAULT_PATH = '/dev/shm/pifi_display_frames'
+    DEFAULT_WAKEUP_SOCKET_PATH = '/tmp/pifi_display_service_unix_socket'
+
+    # The Queue only displays the loading screen and clears the screen between playbacks, so it must not
+    # take over the display from a running playback process.
+    PRIORITY_QUEUE = 1
+    PRIORITY_PLAYBACK = 2
+
+    KIND_FRAME = 1
+    KIND_CLEAR = 2
+
+    __MAGIC = 0x70696669_72696e67 # 'pifiring'
+    __NUM_SLOTS = 4
+
+    __HEADER_LENGTH = 8
+    __HEADER_MAGIC = 0
+    __HEADER_SEQUENCE = 1
+    __HEADER_OWNER_PID = 2
+    __HEADER_OWNER_PRIORITY = 3
+    __HEADER_NUM_SLOTS = 4
+    __HEADER_HEIGHT = 5
+    __HEADER_WIDTH = 6
+
+    __SLOT_HEADER_LENGTH = 3
+    __SLOT_SEQUENCE = 0
+    __SLOT_KIND = 1
+    __SLOT_BRIGHTNESS = 2
+
+    def __init__(self, display_width, display_height, path = DEFAULT_PATH,
+        wakeup_socket_path = DEFAULT_WAKEUP_SOCKET_PATH
+    ):
+        self.__display_width = display_width
+        self.__display_height = display_height
+        self.__path = path
+        self.__wakeup_socket_path = wakeup_socket_path
+        self.__fd = None
+        self.__mmap = None
+        self.__wakeup_socket = None
+
+    # Called by the display service. Creates the file if necessary, and (re)initializes it unless it already
+    # holds a ring of the right dimensions. An existing file is reused rather than replaced, so that
+    # producers which already mapped it keep working across display service restarts.
+    def create(self):
+        fd = os.open(self.__path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            # Producers may run as other users than the display service, so make the file writable by everyone,
+            # regardless of our umask. Only the file's owner may change its mode.
+            if os.fstat(fd).st_uid == os.geteuid():
+                os.fchmod(fd, 0o666)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.ftruncate(fd, self.__get_file_size())
+            self.__map(fd)
+            if not self.__has_expected_header():
+                self.__header[:] = 0
+                self.__slot_headers[:] = 0
+                self.__header[self.__HEADER_NUM_SLOTS] = self.__NUM_SLOTS
+                self.__header[self.__HEADER_HEIGHT] = self.__display_height
+                self.__header[self.__HEADER_WIDTH] = self.__display_width
+                self.__header[self.__HEADER_MAGIC] = self.__MAGIC
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    # Called by producers. Returns False if the display service hasn't created the ring yet.
+    def attach(self):
+        if self.__mmap is not None:
+            return True
+        try:
+            fd = os.open(self.__path, os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        if os.fstat(fd).st_size != self.__get_file_size():
+            os.close(fd)
+            return False
+        self.__map(fd)
+        if not self.__has_expected_header():
+            self.close()
+            return False
+        return True
+
+    def is_attached(self):
+        return self.__mmap is not None
+
+    # Returns whether we own the display after the call.
+    def acquire(self, priority):
+        with self.__locked():
+            return self.__maybe_take_ownership(priority, may_take_over_equal_priority = True)
+
+    # Returns whether the frame was published. It isn't if another producer owns the display.
+    # frame: a transformed [display_height, display_width, 3] frame, or None for KIND_CLEAR.
+    def publish(self, kind, frame, brightness, priority):
+        with self.__locked():
+            if not self.__maybe_take_ownership(priority, may_take_over_equal_priority = False):
+                return False
+
+            sequence = int(self.__header[self.__HEADER_SEQUENCE]) + 1
+            slot = sequence % self.__NUM_SLOTS
+            slot_header = self.__slot_headers[slot]
+            slot_header[self.__SLOT_SEQUENCE] = 0
+            if frame is not None:
+                np.copyto(self.__frames[slot], frame, casting = 'unsafe')
+            slot_header[self.__SLOT_KIND] = kind
+            slot_header[self.__SLOT_BRIGHTNESS] = brightness
+            slot_header[self.__SLOT_SEQUENCE] = sequence
+            self.__header[self.__HEADER_SEQUENCE] = sequence
+
+        self.__wake_reader()
+        return True
+
+    def get_sequence(self):
+        return int(self.__header[self.__HEADER_SEQUENCE])
+
+    # Copies the newest slot into out_frame if it's newer than last_sequence.
+    # Returns a tuple of (sequence, kind, brightness), or None if there's nothing new.
+    def read_newest(self, last_sequence, out_frame):
+        while True:
+            sequence = int(self.__header[self.__HEADER_SEQUENCE])
+            if sequence == last_sequence:
+                return None
+
+            slot = sequence % self.__NUM_SLOTS
+            slot_header = self.__slot_headers[slot]
+            kind = int(slot_header[self.__SLOT_KIND])
+            brightness = int(slot_header[self.__SLOT_BRIGHTNESS])
+            if kind == self.KIND_FRAME:
+                np.copyto(out_frame, self.__frames[slot])
+
+            # If the slot was overwritten while we were reading it, a newer frame has been published. Read
+            # that one instead.
+            if int(slot_header[self.__SLOT_SEQUENCE]) == sequence:
+                return (sequence, kind, brightness)
+
+    def close(self):
+        if self.__mmap is not None:
+            self.__header = None
+            self.__slot_headers = None
+            self.__frames = None
+            self.__mmap.close()
+            self.__mmap = None
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+        if self.__wakeup_socket is not None:
+            self.__wakeup_socket.close()
+            self.__wakeup_socket = None
+
+    # Called by the display service. Returns a datagram socket that receives a message whenever a frame is
+    # published, suitable for blocking on with select.
+    def make_wakeup_server_socket(self):
+        try:
+            os.remove(self.__wakeup_socket_path)
+        except FileNotFoundError:
+            pass
+        wakeup_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        wakeup_socket.bind(self.__wakeup_socket_path)
+        wakeup_socket.setblocking(False)
+        return wakeup_socket
+
+    # The wakeup is best effort: the display service may not be running, or its socket buffer may be full
+    # because it already has a wakeup pending.
+    def __wake_reader(self):
+        if self.__wakeup_socket is None:
+            self.__wakeup_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.__wakeup_socket.setblocking(False)
+        try:
+            self.__wakeup_socket.sendto(b'\0', self.__wakeup_socket_path)
+        except OSError:
+            pass
+
+    def __maybe_take_ownership(self, priority, may_take_over_equal_priority):
+        pid = os.getpid()
+        owner_pid = int(self.__header[self.__HEADER_OWNER_PID])
+        if owner_pid == pid:
+            return True
+
+        owner_priority = int(self.__header[self.__HEADER_OWNER_PRIORITY])
+        if (
+            owner_pid == 0 or
+            not ProcessUtils.is_process_alive(owner_pid) or
+            priority > owner_priority or
+            (may_take_over_equal_priority and priority == owner_priority)
+        ):
+            self.__header[self.__HEADER_OWNER_PID] = pid
+            self.__header[self.__HEADER_OWNER_PRIORITY] = priority
+            return True
+        return False
+
+    def __has_expected_header(self):
+        return (
+            int(self.__header[self.__HEADER_MAGIC]) == self.__MAGIC and
+            int(self.__header[self.__HEADER_NUM_SLOTS]) == self.__NUM_SLOTS and
+            int(self.__header[self.__HEADER_HEIGHT]) == self.__display_height and
+            int(self.__header[self.__HEADER_WIDTH]) == self.__display_width
+        )
+
+    def __map(self, fd):
+        self.__fd = fd
+        self.__mmap = mmap.mmap(fd, self.__get_file_size())
+        self.__header = np.frombuffer(self.__mmap, np.uint64, self.__HEADER_LENGTH)
+        slot_headers_offset = self.__header.nbytes
+        self.__slot_headers = np.frombuffer(
+            self.__mmap, np.uint64, self.__NUM_SLOTS * self.__SLOT_HEADER_LENGTH, slot_headers_offset
+        ).reshape(self.__NUM_SLOTS, self.__SLOT_HEADER_LENGTH)
+        frames_offset = slot_headers_offset + self.__slot_headers.nbytes
+        self.__frames = np.frombuffer(
+            self.__mmap, np.uint8, self.__NUM_SLOTS * self.__get_frame_size(), frames_offset
+        ).reshape(self.__NUM_SLOTS, self.__display_height, self.__display_width, 3)
+
+    def __get_frame_size(self):
+        return self.__display_height * self.__display_width * 3
+
+    def __get_file_size(self):
+        return (
+            (self.__HEADER_LENGTH + self.__NUM_SLOTS * self.__SLOT_HEADER_LENGTH) * 8 +
+            self.__NUM_SLOTS * self.__get_frame_size()
+        )
+
+    @contextlib.contextmanager
+    def __locked(self):
+        fcntl.flock(self.__fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.__fd, fcntl.LOCK_UN)
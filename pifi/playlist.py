@@ -48,7 +48,8 @@ class Playlist:
                 status VARCHAR(20),
                 is_skip_requested INTEGER DEFAULT 0,
                 settings TEXT DEFAULT '',
-                priority INTEGER DEFAULT 0
+                priority INTEGER DEFAULT 0,
+                playback_position_s REAL DEFAULT 0
             )""")
 
         self.__cursor.execute("DROP INDEX IF EXISTS status_type_priority_idx")
@@ -70,7 +71,8 @@ class Playlist:
         )
         return self.__cursor.lastrowid
 
-    # Re-enqueue a video at the front of the queue.
+    # Re-enqueue a video at the front of the queue. When it's played again, it resumes from its playback position.
+    # See: set_playback_position
     #
     # Note: this method only works for videos of type TYPE_VIDEO. Attempting to use this for
     # type TYPE_GAME would result in integer overflow incrementing the priority if we
@@ -183,6 +185,14 @@ class Playlist:
             return True
         return False
 
+    # Records how many seconds into the video playback has gotten, so that if the video is re-enqueued, it resumes
+    # from there. See: reenqueue
+    def set_playback_position(self, playlist_video_id, playback_position_s):
+        self.__cursor.execute(
+            "UPDATE playlist_videos set playback_position_s = ? WHERE playlist_video_id = ?",
+            [playback_position_s, playlist_video_id]
+        )
+
     def end_video(self, playlist_video_id):
         self.__cursor.execute(
             "UPDATE playlist_videos set status=? WHERE playlist_video_id=?",
@@ -0,0 +1,15 @@
+import os
+
+class ProcessUtils:
+
+    # Whether a process with the given pid is running. Processes that we aren't allowed to signal, e.g. because they
+    # belong to another user, count as running.
+    @staticmethod
+    def is_process_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
@@ -1,4 +1,5 @@
 import os
+import select
 import time
 import shlex
 import signal
@@ -8,8 +9,10 @@ import traceback
 
 from pifi.directoryutils import DirectoryUtils
 from pifi.playlist import Playlist
+from pifi.queueevents import QueueEvents
 from pifi.logger import Logger
 from pifi.led.ledframeplayer import LedFramePlayer
+from pifi.led.sharedframering import SharedFrameRing
 from pifi.games.unixsockethelper import UnixSocketHelper
 from pifi.volumecontroller import VolumeController
 from pifi.games.snake import Snake
@@ -21,6 +24,20 @@ class Queue:
 
     UNIX_SOCKET_PATH = '/tmp/queue_unix_socket'
 
+    # How long to block waiting for an event before checking the DB anyway. Events are best effort (see:
+    # QueueEvents), so this is a safety net.
+    __MAX_WAIT_S = 1
+
+    # How often to check whether the playback proc is still running, if we can't wait on its pidfd.
+    __PLAYBACK_PROC_POLL_INTERVAL_S = 0.050
+
+    # A playback proc that exits within this many seconds of starting probably failed, e.g. due to bad config. Rather
+    # than respawning it back to back, we wait before starting the next playback. The wait starts at
+    # __MIN_RESTART_DELAY_S and doubles each time this happens in a row, up to __MAX_RESTART_DELAY_S.
+    __MIN_PLAYBACK_DURATION_S = 5
+    __MIN_RESTART_DELAY_S = 0.5
+    __MAX_RESTART_DELAY_S = 10
+
     def __init__(self):
         self.__playlist = Playlist()
         self.__settings_db = SettingsDb()
@@ -28,13 +45,27 @@ class Queue:
         self.__last_screen_clear_while_screensaver_disabled_time = 0
         self.__logger = Logger().set_namespace(self.__class__.__name__)
         self.__unix_socket = UnixSocketHelper().create_server_unix_socket(self.UNIX_SOCKET_PATH)
+        self.__queue_events_socket = QueueEvents().make_server_socket()
+
+        # Unix time at which the playlist change we were woken up for was published, if any. Used to log how long
+        # it took us to react to it.
+        self.__playlist_changed_time = None
 
         # True if a screensaver, a video, or a game (like snake) is playing
         self.__is_anything_playing = False
         self.__playback_proc = None
+        self.__playback_proc_pidfd = None
+        self.__playback_start_time = None
         self.__playlist_item = None
 
-        self.__led_frame_player = LedFramePlayer()
+        # How many playback procs in a row exited soon after starting, and the monotonic time before which we won't
+        # start the next playback.
+        self.__num_short_playbacks = 0
+        self.__next_playback_time = 0
+
+        # When the display service is enabled, the Queue only gets to use the display while nothing else
+        # is playing. See: SharedFrameRing
+        self.__led_frame_player = LedFramePlayer(display_priority = SharedFrameRing.PRIORITY_QUEUE)
         if not self.__led_frame_player.can_multiple_driver_instances_coexist():
             # The queue should not create a long lived instance of the LED driver because the various
             # processes that are launched by the Queue (video playback, screensaver, etc) will
@@ -53,14 +84,43 @@ class Queue:
                 self.__maybe_skip_playback()
                 if self.__playback_proc and self.__playback_proc.poll() is not None:
                     self.__logger.info("Ending playback because playback proc is no longer running...")
+                    self.__maybe_delay_next_playback()
                     self.__stop_playback_if_playing()
-            else:
+                if not self.__is_anything_playing and not self.__is_next_playback_delayed():
+                    # Start whatever is next right away.
+                    continue
+            elif not self.__is_next_playback_delayed():
                 next_item = self.__playlist.get_next_playlist_item()
                 if next_item:
                     self.__play_playlist_item(next_item)
+                    if self.__is_anything_playing:
+                        self.__log_playlist_change_latency('Started playback')
                 else:
                     self.__maybe_play_screensaver()
-            time.sleep(0.050)
+            self.__wait_for_events()
+
+    # Blocks until an event is published (see: QueueEvents), the playback proc exits, or __MAX_WAIT_S elapses.
+    def __wait_for_events(self):
+        fds = [self.__queue_events_socket]
+        timeout_s = self.__MAX_WAIT_S
+        if self.__playback_proc_pidfd is not None:
+            # A pidfd becomes readable when its process exits.
+            fds.append(self.__playback_proc_pidfd)
+        elif self.__playback_proc is not None:
+            timeout_s = self.__PLAYBACK_PROC_POLL_INTERVAL_S
+        elif self.__is_next_playback_delayed():
+            timeout_s = max(0, min(timeout_s, self.__next_playback_time - time.monotonic()))
+        select.select(fds, [], [], timeout_s)
+        events = QueueEvents.receive(self.__queue_events_socket)
+        if QueueEvents.EVENT_SETTINGS_CHANGED in events:
+            SettingsDb.invalidate_mirror()
+        self.__playlist_changed_time = events.get(QueueEvents.EVENT_PLAYLIST_CHANGED)
+
+    def __log_playlist_change_latency(self, action):
+        if self.__playlist_changed_time is None:
+            return
+        latency_ms = round((time.time() - self.__playlist_changed_time) * 1000)
+        self.__logger.info(f"{action} {latency_ms} ms after the playlist change was published.")
 
     def __play_playlist_item(self, playlist_item):
         log_uuid = Logger.make_uuid()
@@ -74,7 +134,11 @@ class Queue:
                 Logger.set_uuid('')
                 return
             cmd = (f"{DirectoryUtils().root_dir}/bin/play_video --url {shlex.quote(playlist_item['url'])} " +
+                f"--playlist-video-id {shlex.quote(str(playlist_item['playlist_video_id']))} " +
                 "--no-clear-screen --use-extractors youtube")
+            if playlist_item['playback_position_s']:
+                # The video was re-enqueued after it was preempted. Resume it where it left off.
+                cmd += f" --start-position-s {shlex.quote(str(playlist_item['playback_position_s']))}"
         elif playlist_item["type"] == Playlist.TYPE_GAME:
             if playlist_item["title"] == Snake.GAME_TITLE:
                 try:
@@ -149,8 +213,34 @@ class Queue:
         self.__playback_proc = subprocess.Popen(
             cmd, shell = True, executable = '/usr/bin/bash', start_new_session = False, pass_fds = pass_fds
         )
+        try:
+            self.__playback_proc_pidfd = os.pidfd_open(self.__playback_proc.pid)
+        except (AttributeError, OSError):
+            # pidfd_open requires python 3.9+ and linux 5.3+. Fall back to polling the playback proc.
+            self.__playback_proc_pidfd = None
+        self.__playback_start_time = time.monotonic()
         self.__is_anything_playing = True
 
+    # Called when the playback proc exited on its own. See: __MIN_PLAYBACK_DURATION_S
+    def __maybe_delay_next_playback(self):
+        playback_duration_s = time.monotonic() - self.__playback_start_time
+        if playback_duration_s >= self.__MIN_PLAYBACK_DURATION_S:
+            self.__num_short_playbacks = 0
+            return
+
+        self.__num_short_playbacks += 1
+        delay_s = min(
+            self.__MIN_RESTART_DELAY_S * 2 ** (self.__num_short_playbacks - 1), self.__MAX_RESTART_DELAY_S
+        )
+        self.__next_playback_time = time.monotonic() + delay_s
+        self.__logger.warning(
+            f"Playback proc exited {round(playback_duration_s, 2)} s after starting " +
+            f"({self.__num_short_playbacks} times in a row). Waiting {delay_s} s before starting the next playback."
+        )
+
+    def __is_next_playback_delayed(self):
+        return time.monotonic() < self.__next_playback_time
+
     def __maybe_skip_playback(self):
         if not self.__is_anything_playing:
             return
@@ -167,6 +257,7 @@ class Queue:
 
         if should_skip:
             self.__stop_playback_if_playing(was_skipped = True)
+            self.__log_playlist_change_latency('Stopped playback')
             return True
 
         return False
@@ -203,6 +294,9 @@ class Queue:
 
         self.__logger.info("Ended playback.")
         Logger.set_uuid('')
+        if self.__playback_proc_pidfd is not None:
+            os.close(self.__playback_proc_pidfd)
+            self.__playback_proc_pidfd = None
         self.__playback_proc = None
         self.__playlist_item = None
         self.__is_anything_playing = False
@@ -271,6 +365,6 @@ class Queue:
 
     def __clear_screen(self):
         if self.__led_frame_player is None:
-            LedFramePlayer(clear_screen = True)
+            LedFramePlayer(clear_screen = True).stop_output_thread()
         else:
             self.__led_frame_player.clear_screen()
@@ -0,0 +1,67 @@
+import json
+import os
+import socket
+import time
+
+# Lets the server tell the Queue that something it cares about changed, so that the Queue can react right away
+# instead of finding out on its next poll of the DB. Each event is a datagram sent to a unix socket that the Queue
+# blocks on with select.
+#
+# Events are best effort: the Queue may not be running, or its socket buffer may be full. So the Queue still polls
+# the DB every so often as a safety net. An event only says that something changed; the DB remains the source of
+# truth for what changed.
+class QueueEvents:
+
+    DEFAULT_SOCKET_PATH = '/tmp/pifi_queue_events_unix_socket'
+
+    # Something was enqueued, skipped, removed, reordered, etc.
+    EVENT_PLAYLIST_CHANGED = 'playlist_changed'
+
+    # The screensaver was toggled, or its settings changed.
+    EVENT_SETTINGS_CHANGED = 'settings_changed'
+
+    # Events are small. Anything longer than this is truncated, and then ignored by the receiver.
+    __MAX_MSG_LENGTH = 256
+
+    def __init__(self, socket_path = DEFAULT_SOCKET_PATH):
+        self.__socket_path = socket_path
+        self.__socket = None
+
+    # Called by the Queue. Returns a datagram socket that receives events, suitable for blocking on with select.
+    def make_server_socket(self):
+        try:
+            os.remove(self.__socket_path)
+        except FileNotFoundError:
+            pass
+        server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        server_socket.bind(self.__socket_path)
+        server_socket.setblocking(False)
+        return server_socket
+
+    # Returns a dict of the events that are pending on server_socket, without blocking. Values are the unix time at
+    # which each event was first published, which is used to log how long it took the Queue to react.
+    @staticmethod
+    def receive(server_socket):
+        events = {}
+        while True:
+            try:
+                msg = server_socket.recv(QueueEvents.__MAX_MSG_LENGTH)
+            except BlockingIOError:
+                return events
+            try:
+                msg = json.loads(msg)
+                event = msg['event']
+                publish_time = float(msg['time'])
+            except (ValueError, KeyError, TypeError):
+                continue
+            events[event] = min(publish_time, events.get(event, publish_time))
+
+    def publish(self, event):
+        if self.__socket is None:
+            self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.__socket.setblocking(False)
+        msg = json.dumps({'event': event, 'time': time.time()}).encode('utf-8')
+        try:
+            self.__socket.sendto(msg, self.__socket_path)
+        except OSError:
+            pass
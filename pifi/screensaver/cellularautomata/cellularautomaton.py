@@ -2,6 +2,7 @@ from abc import ABC, abstractmethod
 import hashlib
 import time
 
+from pifi.config import Config
 from pifi.logger import Logger
 from pifi.datastructure.limitedsizedict import LimitedSizeDict
 from pifi.screensaver.screensaver import Screensaver
@@ -39,7 +40,7 @@ class CellularAutomaton(Screensaver, ABC):
         frame = self._board_to_frame()
 
         if self._should_fade_to_frame():
-            self._led_frame_player.fade_to_frame(frame)
+            self._led_frame_player.fade_to_frame(frame, self._get_fade_duration())
         else:
             self._led_frame_player.play_frame(frame)
 
@@ -95,6 +96,10 @@ class CellularAutomaton(Screensaver, ABC):
     def _should_fade_to_frame(self):
         pass
 
+    # Seconds. None means use the LedFramePlayer's default fade duration.
+    def _get_fade_duration(self):
+        return Config.get(f'screensavers.configs.{self.get_id()}.fade_duration')
+
     def _get_max_state_repetitions_for_game_over(self):
         return self._DEFAULT_MAX_STATE_REPETITIONS_FOR_GAME_OVER
 
@@ -1,38 +1,152 @@
 import os
 import random
+import time
+
 from pifi.config import Config
 from pifi.directoryutils import DirectoryUtils
+from pifi.logger import Logger
+from pifi.video.decodedclip import DecodedClip
+from pifi.video.videocolormode import VideoColorMode
 from pifi.video.videoprocessor import VideoProcessor
 from pifi.screensaver.screensaver import Screensaver
 
+# Plays saved video clips back to back, without gaps between them.
+#
+# Each clip is decoded once into memory-mapped frames at the LED matrix resolution (see: DecodedClip), and played
+# frame by frame from _tick, following the frames' timestamps. While a clip plays, the next one is decoded in the
+# background, if it hasn't been decoded before, and its first frames are read shortly before the current clip ends.
+# The next clip then starts exactly when the current one ends.
+#
+# Because _tick never blocks, the screensaver timeout is honored, and the screensaver can take part in live
+# transitions. Clips are played without audio.
 class VideoScreensaver(Screensaver):
 
     __DATA_DIRECTORY = 'data/screensavers'
 
+    # How long before the current clip ends to read the first frames of the next clip.
+    __PRE_ROLL_S = 2
+
+    # Longest we sleep between ticks, e.g. while waiting for a clip to be decoded.
+    __MAX_TICK_SLEEP_S = 0.1
+
     def __init__(self, led_frame_player=None):
         super().__init__(led_frame_player)
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
         # Get video list from config instead of constructor parameter
         self.video_list = Config.get("screensavers.configs.video_screensaver.saved_videos", [])
 
+        self.__video_color_mode = Config.get('video.color_mode', VideoColorMode.COLOR_MODE_COLOR)
+        self.__pix_fmt = VideoProcessor.get_pix_fmt()
+
+        self.__clip = None
+        self.__clip_start_time = None
+        self.__is_next_clip_pre_rolled = False
+        self.__next_clip = None
+        self.__frame_index = None
+        self.__num_consecutive_failed_clips = 0
+
     def __getScreensaverPath(self):
         save_dir = DirectoryUtils().root_dir + '/' + self.__DATA_DIRECTORY
         os.makedirs(save_dir, exist_ok=True)
         return save_dir
 
+    def _setup(self):
+        if not self.video_list:
+            return
+        self.__set_video_color_mode(self.__video_color_mode)
+        self.__next_clip = self.__make_next_clip()
+
+    def _teardown(self):
+        for clip in [self.__clip, self.__next_clip]:
+            if clip:
+                clip.stop()
+        self.__clip = None
+        self.__next_clip = None
+        # Subsequent screensavers pass RGB frames.
+        self.__set_video_color_mode(VideoColorMode.COLOR_MODE_COLOR)
+
     def _tick(self):
         if not self.video_list:
             return False
 
-        # Note: process_and_play() is a blocking call that plays the entire video.
-        # The base class timeout check only runs between ticks, so timeout is
-        # effectively governed by video length, not the configured timeout.
-        url = self.__getScreensaverPath() + '/' + random.choice(self.video_list)
-        VideoProcessor(
-            url = url,
-            clear_screen = True,
-            show_loading_screen = False,
-            led_frame_player = self._led_frame_player
-        ).process_and_play()
+        now = time.monotonic()
+        if self.__clip is None or now - self.__clip_start_time >= self.__clip.get_duration_s():
+            if not self.__start_next_clip(now):
+                return self.__num_consecutive_failed_clips < len(self.video_list)
+
+        elapsed_s = now - self.__clip_start_time
+        frame_index = self.__clip.get_frame_index(elapsed_s)
+        if frame_index != self.__frame_index:
+            self._led_frame_player.play_frame(self.__clip.get_frame(frame_index))
+            self.__frame_index = frame_index
+
+        if (
+            not self.__is_next_clip_pre_rolled and self.__clip.get_duration_s() - elapsed_s < self.__PRE_ROLL_S and
+            self.__next_clip.is_ready()
+        ):
+            self.__next_clip.pre_roll(self.__PRE_ROLL_S)
+            self.__is_next_clip_pre_rolled = True
+
+    # Sleeps until the next frame is due, rather than for a configured time.
+    def get_tick_sleep(self):
+        if self.__clip is None or self.__clip_start_time is None:
+            return self.__MAX_TICK_SLEEP_S
+
+        now = time.monotonic()
+        if now - self.__clip_start_time >= self.__clip.get_duration_s() and not self.__next_clip.is_ready():
+            # Waiting for the next clip to be decoded.
+            return self.__MAX_TICK_SLEEP_S
+
+        next_frame_time = self.__clip.get_next_frame_time(self.__frame_index)
+        tick_sleep = self.__clip_start_time + next_frame_time - now
+        return min(max(tick_sleep, 0), self.__MAX_TICK_SLEEP_S)
+
+    # Returns False if the next clip isn't ready yet, or failed.
+    def __start_next_clip(self, now):
+        if not self.__next_clip.is_ready():
+            if self.__next_clip.is_failed():
+                self.__num_consecutive_failed_clips += 1
+                self.__next_clip = self.__make_next_clip()
+            return False
+        self.__num_consecutive_failed_clips = 0
+
+        if self.__clip is not None:
+            # Start the next clip exactly when the current one ends, unless the next clip wasn't ready in time.
+            clip_end_time = self.__clip_start_time + self.__clip.get_duration_s()
+            self.__clip_start_time = clip_end_time if now - clip_end_time < self.__MAX_TICK_SLEEP_S else now
+            if self.__clip is not self.__next_clip:
+                self.__clip.stop()
+        else:
+            self.__clip_start_time = now
+        self.__clip = self.__next_clip
+        self.__frame_index = None
+        self.__logger.info(f'Playing screensaver clip: {self.__clip.get_path()}')
+
+        self.__next_clip = self.__make_next_clip()
+        self.__is_next_clip_pre_rolled = False
+        return True
+
+    def __make_next_clip(self):
+        paths = [self.__getScreensaverPath() + '/' + video for video in self.video_list]
+        if self.__clip is not None:
+            # Avoid playing the same clip twice in a row, unless it's the only one.
+            paths = [path for path in paths if path != self.__clip.get_path()] or [self.__clip.get_path()]
+        path = random.choice(paths)
+        if self.__clip is not None and path == self.__clip.get_path():
+            # Loop the current clip.
+            return self.__clip
+
+        clip = DecodedClip(path, self.__pix_fmt)
+        clip.start_decoding()
+        return clip
+
+    # The BlackHoleFramePlayer used to render live transitions has no color modes.
+    def __set_video_color_mode(self, video_color_mode):
+        if (
+            self.__video_color_mode != VideoColorMode.COLOR_MODE_COLOR and
+            hasattr(self._led_frame_player, 'set_video_color_mode')
+        ):
+            self._led_frame_player.set_video_color_mode(video_color_mode)
 
     @classmethod
     def get_id(cls) -> str:
@@ -46,5 +160,7 @@ class VideoScreensaver(Screensaver):
     def get_description(cls) -> str:
         return 'Plays saved video files from the data/screensavers directory.'
 
+    # Live transitions blend RGB frames. Monochrome color modes produce grayscale frames, and the other color modes
+    # are only applied by the LedFramePlayer.
     def supports_live_transition(self) -> bool:
-        return False
+        return self.__video_color_mode == VideoColorMode.COLOR_MODE_COLOR
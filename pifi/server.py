@@ -7,6 +7,7 @@ import urllib
 from urllib.parse import urlparse
 import time
 from pifi.playlist import Playlist
+from pifi.queueevents import QueueEvents
 from pifi.logger import Logger
 from pifi.config import Config
 from pifi.directoryutils import DirectoryUtils
@@ -18,6 +19,7 @@ from pifi.games.unixsockethelper import UnixSocketHelper
 from pifi.settingsdb import SettingsDb
 from pifi.database import Database
 from pifi.screensaver.screensavermanager import ScreensaverManager
+from pifi.video.startuptimeline import StartupTimeline
 
 class PifiAPI():
 
@@ -25,6 +27,7 @@ class PifiAPI():
         self.__playlist = Playlist()
         self.__vol_controller = VolumeController()
         self.__settings_db = SettingsDb()
+        self.__queue_events = QueueEvents()
         self.__logger = Logger().set_namespace(self.__class__.__name__)
 
     # get all the data that we poll for every second in the pifi
@@ -70,6 +73,7 @@ class PifiAPI():
         self.__playlist.enqueue(
             post_data['url'], post_data['color_mode'], post_data['thumbnail'], post_data['title'], post_data['duration'], Playlist.TYPE_VIDEO, ''
         )
+        self.__queue_events.publish(QueueEvents.EVENT_PLAYLIST_CHANGED)
         response_details = post_data
         response_details['success'] = True
         return response_details
@@ -143,6 +147,7 @@ class PifiAPI():
                     self.__playlist.skip(current_video['playlist_video_id'])
                 else:
                     break
+            self.__queue_events.publish(QueueEvents.EVENT_PLAYLIST_CHANGED)
 
         response = {
             'success': True,
@@ -173,22 +178,27 @@ class PifiAPI():
 
     def skip(self, post_data):
         success = self.__playlist.skip(post_data['playlist_video_id'])
+        self.__queue_events.publish(QueueEvents.EVENT_PLAYLIST_CHANGED)
         return {'success': success}
 
     def remove(self, post_data):
         success = self.__playlist.remove(post_data['playlist_video_id'])
+        self.__queue_events.publish(QueueEvents.EVENT_PLAYLIST_CHANGED)
         return {'success': success}
 
     def clear(self):
         self.__playlist.clear()
+        self.__queue_events.publish(QueueEvents.EVENT_PLAYLIST_CHANGED)
         return {'success': True}
 
     def play_next(self, post_data):
         success = self.__playlist.play_next(post_data['playlist_video_id'])
+        self.__queue_events.publish(QueueEvents.EVENT_PLAYLIST_CHANGED)
         return {'success': success}
 
     def set_screensaver_enabled(self, post_data):
         self.__settings_db.set(SettingsDb.IS_SCREENSAVER_ENABLED, bool(post_data[SettingsDb.IS_SCREENSAVER_ENABLED]))
+        self.__queue_events.publish(QueueEvents.EVENT_SETTINGS_CHANGED)
         return {'success': True}
 
     def set_vol_pct(self, post_data):
@@ -219,6 +229,18 @@ class PifiAPI():
             'success': True
         }
 
+    # p50 / p95 of how long each stage of starting to play a video takes. See: StartupTimeline
+    def get_video_startup_stats(self, get_data):
+        num_videos = 100
+        with_stage = None
+        if get_data:
+            num_videos = int(get_data.get('num_videos', num_videos))
+            with_stage = get_data.get('with_stage')
+        return {
+            'success': True,
+            'stages': StartupTimeline.get_stage_percentiles(num_videos, with_stage),
+        }
+
     def get_youtube_api_key(self):
         return {
             SettingsDb.SETTING_YOUTUBE_API_KEY: self.__settings_db.get(SettingsDb.SETTING_YOUTUBE_API_KEY),
@@ -310,6 +332,7 @@ class PifiAPI():
 
         # Signal queue to restart screensaver so changes take effect immediately
         self.__settings_db.set(SettingsDb.RESTART_SCREENSAVER, '1')
+        self.__queue_events.publish(QueueEvents.EVENT_SETTINGS_CHANGED)
         return {'success': True}
 
 
@@ -370,6 +393,8 @@ class PifiServerRequestHandler(BaseHTTPRequestHandler):
             response = self.__api.get_youtube_api_key()
         elif parsed_path.path == 'screensavers':
             response = self.__api.get_screensavers()
+        elif parsed_path.path == 'video_startup_stats':
+            response = self.__api.get_video_startup_stats(get_data)
         else:
             self.__do_404()
             return
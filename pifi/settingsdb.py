@@ -1,3 +1,6 @@
+import threading
+import time
+
 from pifi.logger import Logger
 import pifi.database
 
@@ -6,6 +9,11 @@ This differs from the json configuration (see: Config) in that these settings ar
 They are stored in a DB and re-read during program execution. They may be modified from a UI. Whereas
 the json configuration is written manually and require a program restart to take effect, because they are
 only read at program startup.
+
+Settings are read from hot paths, e.g. the brightness for every frame that is displayed. So each thread mirrors the
+whole settings table in memory, and reads are dict lookups. At most every __CHECK_INTERVAL_S, a read first checks
+`PRAGMA data_version` to see whether any other connection has committed to the DB since the mirror was loaded, and
+if so, reloads the mirror. Thus reads see changes made by other processes within one check interval.
 """
 class SettingsDb:
 
@@ -24,6 +32,12 @@ class SettingsDb:
     # Global LED brightness (0-100 percentage)
     BRIGHTNESS = 'brightness'
 
+    # How often reads check whether the settings were changed by another connection.
+    __CHECK_INTERVAL_S = 0.1
+
+    # The mirror is per thread, because `PRAGMA data_version` is per connection, and connections are per thread.
+    __mirror = threading.local()
+
     def __init__(self):
         self.__cursor = pifi.database.Database().get_cursor()
         self.__logger = Logger().set_namespace(self.__class__.__name__)
@@ -37,6 +51,7 @@ class SettingsDb:
                 create_date DATETIME DEFAULT CURRENT_TIMESTAMP,
                 update_date DATETIME DEFAULT CURRENT_TIMESTAMP
             )""")
+        self.invalidate_mirror()
 
     def set(self, key, value):
         self.__cursor.execute(
@@ -44,23 +59,22 @@ class SettingsDb:
                 "UPDATE SET value=excluded.value, update_date=excluded.update_date"),
             [key, value]
         )
+        # Our own commits don't change our connection's data_version.
+        self.invalidate_mirror()
         return self.__cursor.rowcount == 1
 
     def get(self, key, default = None):
-        self.__cursor.execute(
-            "SELECT value FROM settings WHERE key = ?", [key]
-        )
-        res = self.__cursor.fetchone()
-        if res is None:
+        row = self.__get_settings().get(key)
+        if row is None:
             return default
-        return res['value']
+        return row['value']
 
     # This may return None if the row doesn't exist.
     def get_row(self, key):
-        self.__cursor.execute(
-            "SELECT * FROM settings WHERE key = ?", [key]
-        )
-        return self.__cursor.fetchone()
+        row = self.__get_settings().get(key)
+        if row is None:
+            return None
+        return dict(row)
 
     def is_enabled(self, key, default = False):
         res = self.get(key, default)
@@ -68,3 +82,31 @@ class SettingsDb:
             return True
         else:
             return False
+
+    # Makes the next read in this thread reload the settings, e.g. when we've been told that they changed.
+    @staticmethod
+    def invalidate_mirror():
+        SettingsDb.__mirror.settings = None
+
+    # Returns the settings table as a dict of rows, keyed by key.
+    def __get_settings(self):
+        mirror = self.__mirror
+        now = time.monotonic()
+        if (
+            getattr(mirror, 'settings', None) is not None and mirror.cursor is self.__cursor and
+            now - mirror.check_time < self.__CHECK_INTERVAL_S
+        ):
+            return mirror.settings
+
+        self.__cursor.execute("PRAGMA data_version")
+        data_version = self.__cursor.fetchone()['data_version']
+        if (
+            getattr(mirror, 'settings', None) is None or mirror.cursor is not self.__cursor or
+            mirror.data_version != data_version
+        ):
+            self.__cursor.execute("SELECT * FROM settings")
+            mirror.settings = {row['key']: row for row in self.__cursor.fetchall()}
+            mirror.cursor = self.__cursor
+            mirror.data_version = data_version
+        mirror.check_time = now
+        return mirror.settings
@@ -0,0 +1,147 @@
+import array
+import fcntl
+import os
+import select
+import signal
+import subprocess
+import termios
+import threading
+import traceback
+
+from pifi.logger import Logger
+
+# Plays a video's audio, and reports how much of it has been played, so that the video can be synced to it. See:
+# AvSync, and config value: "video.av_sync.enabled"
+#
+# ffmpeg decodes the audio to raw PCM and writes it to a fifo. We relay the PCM from the fifo to aplay's stdin on a
+# background thread, counting the bytes we write. Whatever aplay hasn't read yet is still in the pipe, and whatever it
+# has read but not played yet is in the sound card's buffer, whose size we set. Thus:
+#
+#   played = written - still in the pipe - sound card buffer
+#
+# ffplay, which we otherwise play audio with, buffers an unknown amount of audio internally, and doesn't report its
+# playback position.
+class AudioSink:
+
+    SAMPLE_RATE = 48000
+    NUM_CHANNELS = 2
+    SAMPLE_FORMAT = 's16le'
+    __BYTES_PER_SAMPLE = 2
+
+    # Small, so that the sound card's buffer is a small part of the uncertainty in our playback position.
+    __SOUND_CARD_BUFFER_TIME_S = 0.1
+
+    __READ_SIZE_BYTES = 16 * 1024
+
+    # How often to check whether we were stopped, while waiting for ffmpeg to open the fifo.
+    __OPEN_FIFO_POLL_INTERVAL_S = 0.1
+
+    # pcm_fifo_name: the fifo that ffmpeg writes the PCM to. See: get_ffmpeg_output_args
+    # device: the ALSA device to play to, e.g. 'default' or 'hw:0'.
+    def __init__(self, pcm_fifo_name, device = 'default'):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__pcm_fifo_name = pcm_fifo_name
+        self.__device = device
+        self.__bytes_per_s = self.SAMPLE_RATE * self.NUM_CHANNELS * self.__BYTES_PER_SAMPLE
+
+        self.__num_bytes_written = 0
+        self.__is_done = False
+        self.__player_proc = None
+        self.__thread = None
+        self.__should_stop = False
+
+    @staticmethod
+    def get_ffmpeg_output_args():
+        return (f'-vn -f {AudioSink.SAMPLE_FORMAT} -ac {AudioSink.NUM_CHANNELS} -ar {AudioSink.SAMPLE_RATE} ' +
+            'pipe:1')
+
+    def start(self):
+        player_cmd = self.__get_player_cmd()
+        self.__logger.info(f'executing audio player cmd: {player_cmd}')
+        # Unbuffered, so that everything we've written is either in the pipe or has been read by aplay.
+        self.__player_proc = subprocess.Popen(
+            player_cmd, stdin = subprocess.PIPE, bufsize = 0, start_new_session = True
+        )
+        self.__thread = threading.Thread(target = self.__relay, daemon = True)
+        self.__thread.start()
+
+    # Seconds of audio that have been played, or None if we haven't sent any audio to the sound card yet.
+    def get_position_s(self):
+        if self.__num_bytes_written <= 0:
+            return None
+
+        num_bytes_in_pipe = 0
+        if not self.__is_done:
+            try:
+                num_bytes_in_pipe = self.__get_num_bytes_in_pipe()
+            except (OSError, ValueError):
+                # The pipe was closed in the meantime.
+                pass
+        num_bytes_sent = self.__num_bytes_written - num_bytes_in_pipe
+        return max(0, num_bytes_sent / self.__bytes_per_s - self.__SOUND_CARD_BUFFER_TIME_S)
+
+    # True once all the audio has been sent to the sound card, or the audio failed.
+    def is_done(self):
+        return self.__is_done
+
+    # Seconds of audio sent so far. Once we're done, this is the audio's duration.
+    def get_duration_s(self):
+        return self.__num_bytes_written / self.__bytes_per_s
+
+    def stop(self):
+        self.__should_stop = True
+        if self.__player_proc and self.__player_proc.poll() is None:
+            self.__player_proc.terminate()
+
+    def __relay(self):
+        # If aplay exits early, e.g. because we stopped it, let writing to it fail with BrokenPipeError in this thread.
+        # Otherwise the SIGPIPE would go to VideoProcessor's signal handler, which would stop the video.
+        signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGPIPE])
+        try:
+            pcm_fifo = self.__open_fifo()
+            if pcm_fifo is None:
+                return
+            with pcm_fifo:
+                while True:
+                    data = pcm_fifo.read(self.__READ_SIZE_BYTES)
+                    if not data:
+                        break
+                    data = memoryview(data)
+                    while data:
+                        num_bytes_written = self.__player_proc.stdin.write(data)
+                        self.__num_bytes_written += num_bytes_written
+                        data = data[num_bytes_written:]
+        except BrokenPipeError:
+            self.__logger.info('The audio player exited before the audio was done.')
+        except Exception:
+            self.__logger.error(f'Caught exception while playing audio: {traceback.format_exc()}')
+        finally:
+            self.__is_done = True
+            try:
+                self.__player_proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    # Returns None if we were stopped before ffmpeg opened the fifo, e.g. because the video failed to download.
+    def __open_fifo(self):
+        # Opening the fifo without O_NONBLOCK would block until ffmpeg opens it too, which it may never do. Until then,
+        # the fifo isn't readable.
+        fd = os.open(self.__pcm_fifo_name, os.O_RDONLY | os.O_NONBLOCK)
+        while not select.select([fd], [], [], self.__OPEN_FIFO_POLL_INTERVAL_S)[0]:
+            if self.__should_stop:
+                os.close(fd)
+                return None
+        os.set_blocking(fd, True)
+        return open(fd, 'rb', buffering = 0)
+
+    def __get_num_bytes_in_pipe(self):
+        num_bytes = array.array('i', [0])
+        fcntl.ioctl(self.__player_proc.stdin.fileno(), termios.FIONREAD, num_bytes)
+        return num_bytes[0]
+
+    def __get_player_cmd(self):
+        return [
+            'aplay', '--quiet', '--device', self.__device, '--file-type', 'raw', '--format', 'S16_LE',
+            '--channels', str(self.NUM_CHANNELS), '--rate', str(self.SAMPLE_RATE),
+            '--buffer-time', str(int(self.__SOUND_CARD_BUFFER_TIME_S * 1000 * 1000)),
+        ]
@@ -0,0 +1,150 @@
+import array
+import time
+
+import numpy as np
+
+from pifi.logger import Logger
+
+# The video clock: how many seconds into the video we are, which determines which frame is due to be played.
+#
+# Without an AudioSink, the clock is the wall clock since the first frame was decoded. With one, the clock follows
+# the audio's playback position:
+# * Until the audio starts playing, the clock holds at 0, so the first frame is held.
+# * Small drift is corrected gradually, by running the clock slightly faster or slower than the wall clock, which
+#   spreads out the frames we drop or hold to catch up.
+# * Large drift, e.g. after the audio stalled, is corrected all at once. If the video is behind, the frames in
+#   between are dropped. If it's ahead, the current frame is held until the audio catches up.
+# * Once the audio is done, or if the video has no audio, the clock runs on the wall clock.
+#
+# Also keeps statistics of the drift, and of how late frames were played, for each video.
+class AvSync:
+
+    # Drift within this is jitter in our measurement of the audio's playback position, so we don't correct it.
+    __MAX_DRIFT_TO_IGNORE_S = 0.02
+
+    # Drift beyond this is corrected all at once.
+    __MAX_DRIFT_TO_CORRECT_GRADUALLY_S = 0.15
+
+    # Gradual corrections run the clock up to this fraction faster or slower than the wall clock.
+    __MAX_CORRECTION_RATE = 0.05
+
+    # If the audio hasn't started playing by this long after the first frame was decoded, start the video without it.
+    __AUDIO_START_TIMEOUT_S = 3
+
+    # While the clock follows the audio, it may not run at the same rate as the wall clock. Check it at least this
+    # often when waiting for a frame to be due.
+    __MAX_WAIT_S = 0.05
+
+    # audio_sink: AudioSink, or None to run on the wall clock.
+    # start_delay_s: without an audio_sink, how long after start() the clock starts.
+    def __init__(self, audio_sink = None, start_delay_s = 0):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__audio_sink = audio_sink
+        self.__start_delay_s = start_delay_s
+
+        # The wall clock time at which the video clock was / will be at 0.
+        self.__start_time = None
+        self.__first_frame_decoded_time = None
+        self.__last_sync_time = None
+        self.__is_following_audio = audio_sink is not None
+
+        # The most recently measured drift, if the clock is following the audio.
+        self.__drift_s = None
+
+        # Sampled whenever a frame is played.
+        self.__drifts_s = array.array('d')
+        self.__frame_latenesses_s = array.array('d')
+        self.__num_resyncs = 0
+        self.__num_dropped_frames = 0
+
+    # Call once the first frame is decoded.
+    def start(self):
+        now = time.monotonic()
+        self.__first_frame_decoded_time = now
+        self.__last_sync_time = now
+        self.__start_time = now + (0 if self.__is_following_audio else self.__start_delay_s)
+
+    def is_started(self):
+        return self.__start_time is not None
+
+    # How many seconds into the video we are.
+    def get_elapsed_s(self):
+        now = time.monotonic()
+        if self.__is_following_audio:
+            self.__sync_to_audio(now)
+        return max(now - self.__start_time, 0)
+
+    # How many seconds to wait until the clock reaches video_time_s, at most.
+    def get_wait_s(self, video_time_s):
+        wait_s = max(0, self.__start_time + video_time_s - time.monotonic())
+        if self.__is_following_audio:
+            wait_s = min(wait_s, self.__MAX_WAIT_S)
+        return wait_s
+
+    # Call whenever a frame is played. lateness_s: how long after the frame was due it was played.
+    # num_dropped_frames: how many frames were skipped, because they were already overdue.
+    def on_frame_played(self, lateness_s, num_dropped_frames):
+        self.__frame_latenesses_s.append(lateness_s)
+        self.__num_dropped_frames += num_dropped_frames
+        if self.__is_following_audio and self.__drift_s is not None:
+            self.__drifts_s.append(self.__drift_s)
+
+    def get_stats(self):
+        stats = {
+            'num_frames_played': len(self.__frame_latenesses_s),
+            'num_dropped_frames': self.__num_dropped_frames,
+            'p95_frame_lateness_s': None,
+            'num_drift_measurements': len(self.__drifts_s),
+            'p50_abs_drift_s': None,
+            'p95_abs_drift_s': None,
+            'max_abs_drift_s': None,
+            'num_resyncs': self.__num_resyncs,
+        }
+        if self.__frame_latenesses_s:
+            stats['p95_frame_lateness_s'] = round(float(np.percentile(self.__frame_latenesses_s, 95)), 3)
+        if self.__drifts_s:
+            abs_drifts_s = np.abs(self.__drifts_s)
+            stats['p50_abs_drift_s'] = round(float(np.percentile(abs_drifts_s, 50)), 3)
+            stats['p95_abs_drift_s'] = round(float(np.percentile(abs_drifts_s, 95)), 3)
+            stats['max_abs_drift_s'] = round(float(np.max(abs_drifts_s)), 3)
+        return stats
+
+    def log_stats(self):
+        stats = self.get_stats()
+        self.__logger.info('A/V sync stats: ' + ', '.join(f'{key}: {value}' for key, value in stats.items()))
+
+    def __sync_to_audio(self, now):
+        audio_position_s = self.__audio_sink.get_position_s()
+        if self.__audio_sink.is_done():
+            if audio_position_s is None:
+                self.__logger.info('The video has no audio. Not syncing it to the audio.')
+            self.__is_following_audio = False
+            return
+
+        if not audio_position_s:
+            if now - self.__first_frame_decoded_time > self.__AUDIO_START_TIMEOUT_S:
+                self.__logger.warning(
+                    f"The audio didn't start playing within {self.__AUDIO_START_TIMEOUT_S} s. Starting the video " +
+                    "without it."
+                )
+                self.__is_following_audio = False
+                self.__start_time = now
+                return
+
+            # Hold the first frame until the audio starts.
+            self.__start_time = now
+            self.__last_sync_time = now
+            return
+
+        # Positive if the video is ahead of the audio.
+        drift_s = (now - self.__start_time) - audio_position_s
+        self.__drift_s = drift_s
+        if abs(drift_s) > self.__MAX_DRIFT_TO_CORRECT_GRADUALLY_S:
+            if self.__num_resyncs == 0 or abs(drift_s) > 1:
+                self.__logger.info(f'Video is {round(drift_s, 3)} s off from the audio. Resyncing it.')
+            self.__start_time += drift_s
+            self.__num_resyncs += 1
+        elif abs(drift_s) > self.__MAX_DRIFT_TO_IGNORE_S:
+            max_correction_s = (now - self.__last_sync_time) * self.__MAX_CORRECTION_RATE
+            self.__start_time += min(max(drift_s, -max_correction_s), max_correction_s)
+        self.__last_sync_time = now
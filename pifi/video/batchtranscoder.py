@@ -0,0 +1,206 @@
+import hashlib
+import os
+import shlex
+import shutil
+import signal
+import subprocess
+import time
+
+from pifi.logger import Logger
+from pifi.video.transcodecache import TranscodeCache
+from pifi.video.videocolormode import VideoColorMode
+from pifi.video.videoprocessor import VideoProcessor
+
+# Adds a batch of videos to the transcode cache ahead of time, e.g. to warm the cache for a party playlist. Videos
+# may be urls or local files. See: utils/batch_transcode
+#
+# Each video is processed by a job: a bash pipeline that downloads the video, unless it's a local file or has
+# already been saved, and then transcodes it into a cache entry for each pixel format. Up to num_jobs jobs run at
+# once. Downloaded videos are kept as saved videos (see: VideoProcessor.get_saved_video_path), so that
+# transcoding for other pixel formats later doesn't download them again.
+#
+# Videos whose entries are already cached are skipped, so an interrupted batch resumes where it left off when it's
+# run again. Entries that were being written when the batch was interrupted are deleted and redone.
+class BatchTranscoder:
+
+    # How often to check whether jobs are done.
+    __POLL_INTERVAL_S = 0.1
+
+    __TEMP_VIDEO_DOWNLOAD_SUFFIX = '.batch_part'
+
+    # Each job gets its own yt-dlp temp directories under this prefix.
+    __TMP_DIR_PREFIX = '/tmp/pifi_batch_transcode__'
+
+    # num_jobs: how many videos to process at once.
+    # color_modes: the color modes to transcode for. Color modes that share a pixel format share a cache entry.
+    # yt_dlp_extractors: see VideoProcessor
+    def __init__(self, num_jobs, color_modes = None, yt_dlp_extractors = None):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__transcode_cache = TranscodeCache()
+        self.__num_jobs = max(num_jobs, 1)
+        self.__yt_dlp_extractors = yt_dlp_extractors
+
+        pix_fmts = []
+        for color_mode in color_modes or VideoColorMode.COLOR_MODES:
+            pix_fmt = VideoProcessor.get_pix_fmt(color_mode)
+            if pix_fmt not in pix_fmts:
+                pix_fmts.append(pix_fmt)
+        self.__pix_fmts = pix_fmts
+
+        self.__jobs = []
+        self.__stats = None
+
+    # Returns the urls in the given list, followed by the urls in playlist_file, if any. The playlist file has one url
+    # or file path per line. Blank lines and lines starting with '#' are ignored. Duplicates are removed.
+    @staticmethod
+    def read_urls(urls, playlist_file = None):
+        urls = list(urls)
+        if playlist_file is not None:
+            with open(playlist_file) as file:
+                urls += [line.strip() for line in file]
+        return list(dict.fromkeys(url for url in urls if url and not url.startswith('#')))
+
+    # Processes the videos, and returns stats about the batch. See: __log_stats
+    def run(self, urls):
+        self.__stats = {
+            'num_videos': len(urls),
+            'num_transcoded': 0,
+            'num_skipped': 0,
+            'num_failed': 0,
+            'num_frames': 0,
+            'video_duration_s': 0,
+            'start_time': time.monotonic(),
+        }
+        self.__logger.info(
+            f'Transcoding {len(urls)} videos for pixel formats {self.__pix_fmts}, {self.__num_jobs} at a time.'
+        )
+        self.__transcode_cache.delete_incomplete_entries()
+        self.__delete_incomplete_downloads()
+
+        urls_to_process = list(urls)
+        try:
+            while urls_to_process or self.__jobs:
+                for job in list(self.__jobs):
+                    if job['proc'].poll() is not None:
+                        self.__finish_job(job)
+                while urls_to_process and len(self.__jobs) < self.__num_jobs:
+                    self.__start_job(urls_to_process.pop(0))
+                time.sleep(self.__POLL_INTERVAL_S)
+        finally:
+            for job in list(self.__jobs):
+                self.__stop_job(job)
+
+        self.__log_stats()
+        return self.__stats
+
+    def __start_job(self, url):
+        pix_fmts = [pix_fmt for pix_fmt in self.__pix_fmts if not self.__transcode_cache.has_entry(url, pix_fmt)]
+        if not pix_fmts:
+            self.__logger.info(f'Already cached, skipping: {url}')
+            self.__stats['num_skipped'] += 1
+            return
+
+        job = {
+            'url': url,
+            'pix_fmts': pix_fmts,
+            'transcode_cache_directories': [],
+            'tmp_dir': self.__TMP_DIR_PREFIX + hashlib.md5(url.encode('utf-8')).hexdigest(),
+            'start_time': time.monotonic(),
+        }
+        cmds = []
+        video_path = self.__get_video_path(url)
+        if not os.path.isfile(video_path):
+            temp_video_path = shlex.quote(video_path + self.__TEMP_VIDEO_DOWNLOAD_SUFFIX)
+            download_cmd = VideoProcessor.get_streaming_video_download_cmd(
+                url, self.__yt_dlp_extractors, video_tmp_dir = job['tmp_dir'] + '/video',
+                audio_tmp_dir = job['tmp_dir'] + '/audio'
+            )
+            cmds.append(f'{download_cmd} > {temp_video_path} && mv {temp_video_path} {shlex.quote(video_path)}')
+
+        for pix_fmt in pix_fmts:
+            transcode_cache_directory = self.__transcode_cache.make_incomplete_entry_directory(url, pix_fmt)
+            job['transcode_cache_directories'].append(transcode_cache_directory)
+            # Each job transcodes with a single thread; parallelism comes from running several jobs at once.
+            cmds.append(
+                VideoProcessor.get_transcode_cmd(video_path, transcode_cache_directory, pix_fmt, num_threads = 1)
+            )
+
+        cmd = 'set -o pipefail && ' + ' && '.join(cmds)
+        self.__logger.debug(f'Starting job for {url}: {cmd}')
+        job['proc'] = subprocess.Popen(cmd, shell = True, executable = '/usr/bin/bash', start_new_session = True)
+        self.__jobs.append(job)
+
+    def __finish_job(self, job):
+        self.__jobs.remove(job)
+        if job['proc'].returncode != 0:
+            self.__logger.error(f"Failed to transcode {job['url']}. Exit status: {job['proc'].returncode}.")
+            self.__stats['num_failed'] += 1
+            self.__clean_up_job(job)
+            return
+
+        num_frames = 0
+        duration_s = 0
+        for pix_fmt, transcode_cache_directory in zip(job['pix_fmts'], job['transcode_cache_directories']):
+            num_frames, fps = self.__transcode_cache.finish_transcoded_entry(
+                transcode_cache_directory, job['url'], pix_fmt
+            )
+            if fps:
+                duration_s = num_frames / fps
+        job['transcode_cache_directories'] = []
+        self.__clean_up_job(job)
+
+        elapsed_s = time.monotonic() - job['start_time']
+        self.__stats['num_transcoded'] += 1
+        self.__stats['num_frames'] += num_frames * len(job['pix_fmts'])
+        self.__stats['video_duration_s'] += duration_s
+        self.__logger.info(
+            f"Transcoded {job['url']} ({round(duration_s, 1)} s of video) in {round(elapsed_s, 1)} s. " +
+            f"{self.__get_num_done()} of {self.__stats['num_videos']} videos done."
+        )
+
+    def __stop_job(self, job):
+        try:
+            os.killpg(job['proc'].pid, signal.SIGTERM)
+        except Exception:
+            # might raise: `ProcessLookupError: [Errno 3] No such process`
+            pass
+        job['proc'].wait()
+        self.__jobs.remove(job)
+        self.__clean_up_job(job)
+        video_path = self.__get_video_path(job['url'])
+        if os.path.isfile(video_path + self.__TEMP_VIDEO_DOWNLOAD_SUFFIX):
+            os.remove(video_path + self.__TEMP_VIDEO_DOWNLOAD_SUFFIX)
+
+    def __clean_up_job(self, job):
+        for transcode_cache_directory in job['transcode_cache_directories']:
+            self.__transcode_cache.abandon_incomplete_entry(transcode_cache_directory)
+        shutil.rmtree(job['tmp_dir'], ignore_errors = True)
+
+    # Local files are transcoded in place. Urls are downloaded to where saved videos go, if they haven't been
+    # already.
+    def __get_video_path(self, url):
+        if os.path.isfile(url):
+            return url
+        return VideoProcessor.get_saved_video_path(url)
+
+    # Downloads that were cut short when a previous batch was interrupted.
+    def __delete_incomplete_downloads(self):
+        directory = os.path.dirname(VideoProcessor.get_saved_video_path(''))
+        for file_name in os.listdir(directory):
+            if file_name.endswith(self.__TEMP_VIDEO_DOWNLOAD_SUFFIX):
+                os.remove(directory + '/' + file_name)
+
+    def __get_num_done(self):
+        return self.__stats['num_transcoded'] + self.__stats['num_skipped'] + self.__stats['num_failed']
+
+    def __log_stats(self):
+        stats = self.__stats
+        elapsed_s = time.monotonic() - stats['start_time']
+        stats['elapsed_s'] = elapsed_s
+        stats['frames_per_s'] = stats['num_frames'] / elapsed_s if elapsed_s else 0
+        stats['realtime_factor'] = stats['video_duration_s'] / elapsed_s if elapsed_s else 0
+        self.__logger.info(
+            f"Transcoded {stats['num_transcoded']} videos, skipped {stats['num_skipped']} already cached, " +
+            f"{stats['num_failed']} failed. Took {round(elapsed_s, 1)} s: " +
+            f"{round(stats['frames_per_s'], 1)} frames/s, {round(stats['realtime_factor'], 1)}x realtime."
+        )
@@ -0,0 +1,187 @@
+import hashlib
+import os
+import shlex
+import shutil
+import subprocess
+
+import numpy as np
+
+from pifi.config import Config
+from pifi.directoryutils import DirectoryUtils
+from pifi.logger import Logger
+from pifi.video.frametimestamps import FrameTimestamps
+from pifi.video.incompletedirectories import IncompleteDirectories
+from pifi.video.transcodecache import TranscodeCache
+from pifi.video.videoprocessor import VideoProcessor
+
+"""
+A local video clip, decoded once into frames at the LED matrix resolution, and memory-mapped for playback. Used by
+VideoScreensaver, so that playing a clip doesn't need any subprocesses, and switching clips is instant.
+
+Decoding writes the frames and their timestamps in the same layout as a transcode cache entry, into a directory keyed
+by the clip's path, size, and modification time, as well as the pixel format and display size. Editing a clip thus
+decodes it again. Decoding runs in the background; poll is_ready.
+"""
+class DecodedClip:
+
+    __DIRECTORY = 'data/screensaver_clips'
+
+    # Decode with a single thread, because we decode the next clip while the current one plays.
+    __NUM_DECODING_THREADS = 1
+
+    # path: the clip's video file.
+    # pix_fmt: see VideoProcessor.get_pix_fmt
+    def __init__(self, path, pix_fmt):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__path = path
+        self.__pix_fmt = pix_fmt
+        self.__key = self.__make_key()
+        self.__decode_proc = None
+        self.__is_failed = False
+
+        self.__frames = None
+        self.__timestamps = None
+        self.__end_time = None
+
+    def get_path(self):
+        return self.__path
+
+    # Decodes the clip in the background, unless it was decoded before.
+    def start_decoding(self):
+        if self.__is_decoded() or self.__decode_proc:
+            return
+
+        incomplete_directories = IncompleteDirectories(self.__get_directory())
+        incomplete_directories.delete_abandoned()
+        incomplete_directory = incomplete_directories.make(self.__get_entry_directory())
+        decode_cmd = VideoProcessor.get_ffmpeg_pixel_conversion_cmd(
+            timestamps_output = shlex.quote(incomplete_directory + '/' + TranscodeCache.FRAME_TIMESTAMPS_FILE_NAME),
+            input_path = shlex.quote(self.__path),
+            frames_output = shlex.quote(incomplete_directory + '/' + TranscodeCache.FRAMES_FILE_NAME),
+            num_threads = self.__NUM_DECODING_THREADS,
+            pix_fmt = self.__pix_fmt
+        )
+        self.__logger.info(f'Decoding screensaver clip: {decode_cmd}')
+        self.__decode_proc = subprocess.Popen(
+            decode_cmd, shell = True, executable = '/usr/bin/bash', start_new_session = True
+        )
+
+    # True once the clip is decoded and loaded.
+    def is_ready(self):
+        if self.__frames is not None:
+            return True
+        if self.__is_failed:
+            return False
+
+        if self.__decode_proc:
+            if self.__decode_proc.poll() is None:
+                return False
+            if self.__decode_proc.returncode != 0:
+                self.__logger.error(
+                    f'Decoding screensaver clip {self.__path} exited non-zero: {self.__decode_proc.returncode}.'
+                )
+                self.__fail()
+                return False
+            self.__decode_proc = None
+            shutil.rmtree(self.__get_entry_directory(), ignore_errors = True)
+            os.rename(self.__get_incomplete_directory(), self.__get_entry_directory())
+
+        if not self.__is_decoded():
+            return False
+        self.__load()
+        return self.__frames is not None
+
+    # True if the clip couldn't be decoded, e.g. because it doesn't exist.
+    def is_failed(self):
+        return self.__is_failed
+
+    def get_num_frames(self):
+        return len(self.__frames)
+
+    def get_frame(self, index):
+        return self.__frames[index]
+
+    # Returns the index of the frame that is due elapsed_s seconds into the clip.
+    def get_frame_index(self, elapsed_s):
+        return max(0, int(np.searchsorted(self.__timestamps, elapsed_s, 'right')) - 1)
+
+    # Returns how many seconds into the clip the frame after index is due, or when the clip ends if index is the last
+    # frame.
+    def get_next_frame_time(self, index):
+        if index + 1 < len(self.__timestamps):
+            return float(self.__timestamps[index + 1])
+        return self.__end_time
+
+    # How long the clip plays for, in seconds.
+    def get_duration_s(self):
+        return self.__end_time
+
+    # Reads the first frames, so that they are in the page cache by the time we play them.
+    def pre_roll(self, duration_s):
+        num_frames = self.get_frame_index(duration_s) + 1
+        np.sum(self.__frames[:num_frames], dtype = np.uint64)
+
+    # Stops decoding, if we're still decoding.
+    def stop(self):
+        if self.__decode_proc and self.__decode_proc.poll() is None:
+            self.__decode_proc.terminate()
+            self.__decode_proc.wait()
+            shutil.rmtree(self.__get_incomplete_directory(), ignore_errors = True)
+        self.__decode_proc = None
+
+    def __load(self):
+        entry_directory = self.__get_entry_directory()
+        frame_timestamps = FrameTimestamps.make_from_file(
+            entry_directory + '/' + TranscodeCache.FRAME_TIMESTAMPS_FILE_NAME
+        )
+        frames_path = entry_directory + '/' + TranscodeCache.FRAMES_FILE_NAME
+        frame_shape = self.__get_frame_shape()
+        num_frames = min(os.path.getsize(frames_path) // int(np.prod(frame_shape)), len(frame_timestamps))
+        if num_frames == 0:
+            self.__logger.error(f'Screensaver clip has no frames: {self.__path}')
+            self.__fail()
+            return
+
+        self.__frames = np.memmap(frames_path, np.uint8, 'r', shape = tuple([num_frames] + frame_shape))
+        self.__timestamps = np.array(frame_timestamps.get_all()[:num_frames])
+        self.__end_time = frame_timestamps.get_end_time()
+        if num_frames < len(frame_timestamps) or self.__end_time <= self.__timestamps[-1]:
+            # Without the last frame's duration, show it for as long as the frame before it.
+            self.__end_time = self.__timestamps[-1] + (
+                self.__timestamps[-1] - self.__timestamps[-2] if num_frames > 1 else 1 / 30
+            )
+        self.__logger.info(f'Loaded {num_frames} frames ({round(self.__end_time, 2)} s) of {self.__path}.')
+
+    def __fail(self):
+        self.__is_failed = True
+        shutil.rmtree(self.__get_incomplete_directory(), ignore_errors = True)
+        shutil.rmtree(self.__get_entry_directory(), ignore_errors = True)
+
+    def __is_decoded(self):
+        return os.path.isfile(self.__get_entry_directory() + '/' + TranscodeCache.FRAMES_FILE_NAME)
+
+    def __get_entry_directory(self):
+        return self.__get_directory() + '/' + self.__key
+
+    def __get_incomplete_directory(self):
+        return IncompleteDirectories(self.__get_directory()).get_path(self.__get_entry_directory())
+
+    def __make_key(self):
+        try:
+            stat = os.stat(self.__path)
+            version = f'{stat.st_size}.{stat.st_mtime_ns}'
+        except FileNotFoundError:
+            version = ''
+        clip_hash = hashlib.md5(f'{self.__path}:{version}'.encode('utf-8')).hexdigest()
+        display_width = Config.get_or_throw('leds.display_width')
+        display_height = Config.get_or_throw('leds.display_height')
+        return f'{clip_hash}__{self.__pix_fmt}__{display_width}x{display_height}'
+
+    def __get_frame_shape(self):
+        shape = [Config.get_or_throw('leds.display_height'), Config.get_or_throw('leds.display_width')]
+        if self.__pix_fmt == 'rgb24':
+            shape.append(3)
+        return shape
+
+    def __get_directory(self):
+        return DirectoryUtils().root_dir + '/' + self.__DIRECTORY
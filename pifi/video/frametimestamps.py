@@ -0,0 +1,104 @@
+import collections
+from fractions import Fraction
+
+# The presentation timestamps of a video's decoded frames, parsed from the output of ffmpeg's framecrc muxer. The
+# pixel conversion ffmpeg writes one framecrc line per frame it outputs, in the same order as the frames:
+#
+#   #tb 0: 1/90000
+#   ...
+#   0,          0,          0,     3003,     6144, 0x0b2b5e2f
+#   0,       3003,       3003,     3003,     6144, 0x9c7a8e1a
+#
+# The columns are: stream index, dts, pts, duration, size, and checksum. Timestamps are in units of the time base.
+#
+# Timestamps are in seconds, relative to the first frame's timestamp. Following real timestamps, rather than
+# assuming a constant frame rate, means that variable frame rate videos play correctly.
+#
+# Timestamps may be fed incrementally, as they are read from a fifo, or added one frame at a time by an in-process
+# decoder. Like ReadOnceFrameRingBuffer, frames are indexed by their position in the video, and timestamps of frames
+# that have been played can be discarded.
+class FrameTimestamps:
+
+    def __init__(self):
+        self.__partial_line = b''
+        self.__time_base = None
+
+        # Timestamp of the first frame, in seconds
+        self.__first_time = None
+
+        self.__timestamps = collections.deque()
+
+        # Index of the frame whose timestamp is at the front of self.__timestamps
+        self.__start_index = 0
+
+        # When the most recently fed frame stops being displayed
+        self.__end_time = 0
+
+    @staticmethod
+    def make_from_file(path):
+        frame_timestamps = FrameTimestamps()
+        with open(path, 'rb') as timestamps_file:
+            frame_timestamps.feed(timestamps_file.read())
+        return frame_timestamps
+
+    # data: bytes of framecrc output. May end with a partial line; the remainder will be parsed on the next call.
+    def feed(self, data):
+        lines = (self.__partial_line + data).split(b'\n')
+        self.__partial_line = lines.pop()
+        for line in lines:
+            self.__parse_line(line.strip())
+
+    # Adds the timestamp of the next frame. pts and duration are in units of time_base. duration may be None if
+    # unknown, in which case the frame is assumed to last until the next frame's timestamp.
+    def add(self, pts, duration, time_base):
+        frame_time = pts * Fraction(time_base)
+        if self.__first_time is None:
+            self.__first_time = frame_time
+        timestamp = float(frame_time - self.__first_time)
+        self.__timestamps.append(timestamp)
+        self.__end_time = timestamp + (float(duration * Fraction(time_base)) if duration else 0)
+
+    # Number of frames whose timestamps are known.
+    def __len__(self):
+        return self.__start_index + len(self.__timestamps)
+
+    def get(self, index):
+        if index < self.__start_index or index >= len(self):
+            raise IndexError('index out of range')
+        return self.__timestamps[index - self.__start_index]
+
+    # Returns the timestamps of the frames that haven't been discarded, in order. Unlike get, this is cheap for
+    # looking up many frames.
+    def get_all(self):
+        return list(self.__timestamps)
+
+    # Frees the timestamps of frames with index < index.
+    def discard_before(self, index):
+        while self.__start_index < index and self.__timestamps:
+            self.__timestamps.popleft()
+            self.__start_index += 1
+
+    def get_end_time(self):
+        return self.__end_time
+
+    # Returns None if the frame timestamps don't span any time yet.
+    def get_average_fps(self):
+        if self.__end_time <= 0:
+            return None
+        return len(self) / self.__end_time
+
+    def __parse_line(self, line):
+        if not line:
+            return
+        if line.startswith(b'#'):
+            # E.g. `#tb 0: 1/90000`. Other header lines describe the stream's dimensions, codec, etc.
+            if line.startswith(b'#tb 0:'):
+                self.__time_base = Fraction(line.split(b':', 1)[1].strip().decode('utf-8'))
+            return
+
+        stream_index, dts, pts, duration = line.split(b',')[:4]
+        if int(stream_index) != 0:
+            return
+        if self.__time_base is None:
+            raise Exception(f'Got a frame before the time base: {line}')
+        self.add(int(pts), int(duration), self.__time_base)
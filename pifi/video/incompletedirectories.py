@@ -0,0 +1,54 @@
+import os
+import shutil
+
+from pifi.processutils import ProcessUtils
+
+"""
+Entries of the on-disk caches (see: TranscodeCache, DecodedClip) are written to an incomplete directory next to where
+the entry belongs, and renamed into place once they're fully written. This way, readers never see a partially
+written entry.
+
+The incomplete directory's name includes the writer's pid, because more than one process may write the same entry
+at once (e.g. the Prefetcher and the VideoProcessor). The pid also lets us tell which incomplete directories were
+abandoned by processes that have since exited.
+"""
+class IncompleteDirectories:
+
+    __SUFFIX = '.part'
+
+    # directory: the directory that holds the entries.
+    def __init__(self, directory):
+        self.__directory = directory
+
+    # Returns the incomplete directory that this process writes entry_directory to.
+    def get_path(self, entry_directory):
+        return f'{entry_directory}.{os.getpid()}{self.__SUFFIX}'
+
+    # Returns an empty incomplete directory in which to write entry_directory.
+    def make(self, entry_directory):
+        incomplete_directory = self.get_path(entry_directory)
+        shutil.rmtree(incomplete_directory, ignore_errors = True)
+        os.makedirs(incomplete_directory)
+        return incomplete_directory
+
+    # Deletes incomplete directories left behind by processes that have exited. Incomplete directories that other
+    # running processes are writing are left alone.
+    #
+    # should_delete_own: boolean. Whether to also delete the incomplete directories that this process was writing,
+    #   e.g. because it was interrupted while writing them.
+    def delete_abandoned(self, should_delete_own = False):
+        if not os.path.isdir(self.__directory):
+            return
+        for name in os.listdir(self.__directory):
+            if not name.endswith(self.__SUFFIX):
+                continue
+            try:
+                pid = int(name[:-len(self.__SUFFIX)].rsplit('.', 1)[1])
+            except (IndexError, ValueError):
+                pid = None
+            if (
+                pid is None or
+                (pid == os.getpid() and should_delete_own) or
+                (pid != os.getpid() and not ProcessUtils.is_process_alive(pid))
+            ):
+                shutil.rmtree(self.__directory + '/' + name, ignore_errors = True)
@@ -0,0 +1,209 @@
+import os
+import shlex
+import shutil
+import signal
+import subprocess
+import time
+import traceback
+
+from pifi.config import Config
+from pifi.logger import Logger
+from pifi.playlist import Playlist
+from pifi.video.transcodecache import TranscodeCache
+from pifi.video.videoprocessor import VideoProcessor
+
+# The Prefetcher downloads the next few videos in the queue while the current one plays, so that they start playing
+# without waiting on yt-dlp. If the transcode cache is enabled, it also scales them down to the LED matrix
+# resolution ahead of time. The VideoProcessor uses prefetched videos once they are ready.
+# See: VideoProcessor.get_prefetched_video_path, TranscodeCache
+#
+# Prefetching competes with playback for network and CPU. Downloads are rate limited, and the Prefetcher runs at a
+# low CPU and IO priority, with a single ffmpeg thread.
+class Prefetcher:
+
+    # How often to check the queue for videos to prefetch.
+    __POLL_INTERVAL_S = 1
+
+    __TEMP_VIDEO_DOWNLOAD_SUFFIX = '.prefetch_part'
+
+    # Separate from the VideoProcessor's temp directories, because VideoProcessor housekeeping deletes those.
+    __VIDEO_TMP_DIR = '/tmp/pifi_prefetch_video_tmp'
+    __AUDIO_TMP_DIR = '/tmp/pifi_prefetch_audio_tmp'
+
+    __DEFAULT_NUM_VIDEOS = 2
+    __DEFAULT_MAX_DOWNLOAD_RATE = '2M'
+    __DEFAULT_NICENESS = 19
+
+    def __init__(self):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__playlist = Playlist()
+        self.__transcode_cache = None
+        if TranscodeCache.is_enabled() and Config.get('video.prefetch.should_transcode', True):
+            self.__transcode_cache = TranscodeCache()
+        self.__num_videos = Config.get('video.prefetch.num_videos', self.__DEFAULT_NUM_VIDEOS)
+        self.__max_download_rate = Config.get('video.prefetch.max_download_rate', self.__DEFAULT_MAX_DOWNLOAD_RATE)
+
+        # State of the video currently being prefetched, if any.
+        self.__url = None
+        self.__video_path = None
+        self.__transcode_cache_directory = None
+        self.__proc = None
+        self.__proc_pgid = None
+        self.__start_time = None
+
+        # Urls that we failed to prefetch. We don't retry them; the VideoProcessor will download them as usual.
+        self.__failed_urls = set()
+
+    def run(self):
+        self.__logger.info('Starting prefetcher...')
+        self.__lower_priority()
+        self.__delete_temp_files()
+        if self.__transcode_cache:
+            self.__transcode_cache.delete_incomplete_entries()
+        while True:
+            try:
+                self.__tick()
+            except Exception:
+                self.__logger.error(f'Caught exception: {traceback.format_exc()}')
+                self.__stop_prefetching()
+            time.sleep(self.__POLL_INTERVAL_S)
+
+    def __tick(self):
+        queue = self.__playlist.get_queue()
+        urls_to_prefetch = self.__get_urls_to_prefetch(queue)
+
+        if self.__url is not None:
+            if self.__url not in urls_to_prefetch:
+                # Most likely, the video started playing before we finished prefetching it.
+                self.__logger.info(f'Stopping prefetching {self.__url}, because it is no longer upcoming in the queue.')
+                self.__stop_prefetching()
+            elif self.__proc.poll() is not None:
+                self.__finish_prefetching()
+
+        if self.__url is None:
+            for url in urls_to_prefetch:
+                if not self.__is_prefetched(url):
+                    self.__start_prefetching(url)
+                    break
+
+        self.__delete_stale_prefetched_videos(queue)
+
+    # The next few queued videos, in the order they will be played. Excludes the currently playing video.
+    def __get_urls_to_prefetch(self, queue):
+        urls = []
+        for playlist_item in queue:
+            if len(urls) >= self.__num_videos:
+                break
+            if playlist_item['type'] != Playlist.TYPE_VIDEO or playlist_item['status'] != Playlist.STATUS_QUEUED:
+                continue
+            url = playlist_item['url']
+            if os.path.isfile(url) or url in self.__failed_urls or url in urls:
+                continue
+            urls.append(url)
+        return urls
+
+    def __is_prefetched(self, url):
+        if self.__transcode_cache:
+            return self.__transcode_cache.has_entry(url, VideoProcessor.get_pix_fmt())
+        return (
+            os.path.isfile(VideoProcessor.get_saved_video_path(url)) or
+            os.path.isfile(VideoProcessor.get_prefetched_video_path(url))
+        )
+
+    def __start_prefetching(self, url):
+        cmds = []
+        self.__video_path = VideoProcessor.get_saved_video_path(url)
+        if not os.path.isfile(self.__video_path):
+            self.__video_path = VideoProcessor.get_prefetched_video_path(url)
+            if not os.path.isfile(self.__video_path):
+                temp_video_path = shlex.quote(self.__video_path + self.__TEMP_VIDEO_DOWNLOAD_SUFFIX)
+                download_cmd = VideoProcessor.get_streaming_video_download_cmd(
+                    url, yt_dlp_extractors = 'youtube', video_tmp_dir = self.__VIDEO_TMP_DIR,
+                    audio_tmp_dir = self.__AUDIO_TMP_DIR, max_download_rate = self.__max_download_rate
+                )
+                cmds.append(f'{download_cmd} > {temp_video_path} && mv {temp_video_path} {shlex.quote(self.__video_path)}')
+
+        if self.__transcode_cache:
+            self.__transcode_cache_directory = self.__transcode_cache.make_incomplete_entry_directory(
+                url, VideoProcessor.get_pix_fmt()
+            )
+            cmds.append(
+                VideoProcessor.get_transcode_cmd(self.__video_path, self.__transcode_cache_directory, num_threads = 1)
+            )
+
+        cmd = 'set -o pipefail && ' + ' && '.join(cmds)
+        self.__logger.info(f'Prefetching {url} with cmd: {cmd}')
+        self.__url = url
+        self.__start_time = time.monotonic()
+        self.__proc = subprocess.Popen(cmd, shell = True, executable = '/usr/bin/bash', start_new_session = True)
+        self.__proc_pgid = os.getpgid(self.__proc.pid)
+
+    def __finish_prefetching(self):
+        if self.__proc.returncode != 0:
+            self.__logger.error(
+                f'Failed to prefetch {self.__url}. The prefetch process exited non-zero: {self.__proc.returncode}. ' +
+                'Not retrying it.'
+            )
+            self.__failed_urls.add(self.__url)
+            self.__stop_prefetching()
+            return
+
+        if self.__transcode_cache_directory:
+            self.__transcode_cache.finish_transcoded_entry(
+                self.__transcode_cache_directory, self.__url, VideoProcessor.get_pix_fmt()
+            )
+            self.__transcode_cache_directory = None
+
+        self.__logger.info(f'Prefetched {self.__url} in {round(time.monotonic() - self.__start_time, 3)} s.')
+        self.__stop_prefetching()
+
+    # Stops the prefetch process if it is still running, and cleans up after it.
+    def __stop_prefetching(self):
+        if self.__proc_pgid is not None:
+            try:
+                os.killpg(self.__proc_pgid, signal.SIGTERM)
+            except Exception:
+                # might raise: `ProcessLookupError: [Errno 3] No such process`
+                pass
+            self.__proc.wait()
+
+        if self.__transcode_cache_directory:
+            self.__transcode_cache.abandon_incomplete_entry(self.__transcode_cache_directory)
+        self.__delete_temp_files()
+
+        self.__url = None
+        self.__video_path = None
+        self.__transcode_cache_directory = None
+        self.__proc = None
+        self.__proc_pgid = None
+        self.__start_time = None
+
+    # Deletes prefetched videos that are no longer in the queue, i.e. they have been played or removed.
+    def __delete_stale_prefetched_videos(self, queue):
+        file_names_to_keep = set(
+            os.path.basename(VideoProcessor.get_prefetched_video_path(playlist_item['url'])) for playlist_item in queue
+        )
+        prefetch_directory = VideoProcessor.get_prefetch_directory()
+        for file_name in os.listdir(prefetch_directory):
+            if file_name.removesuffix(self.__TEMP_VIDEO_DOWNLOAD_SUFFIX) not in file_names_to_keep:
+                self.__logger.info(f'Deleting stale prefetched video: {file_name}')
+                os.remove(prefetch_directory + '/' + file_name)
+
+    def __delete_temp_files(self):
+        shutil.rmtree(self.__VIDEO_TMP_DIR, ignore_errors = True)
+        shutil.rmtree(self.__AUDIO_TMP_DIR, ignore_errors = True)
+        if self.__video_path:
+            try:
+                os.remove(self.__video_path + self.__TEMP_VIDEO_DOWNLOAD_SUFFIX)
+            except FileNotFoundError:
+                pass
+
+    def __lower_priority(self):
+        niceness = Config.get('video.prefetch.niceness', self.__DEFAULT_NICENESS)
+        os.nice(niceness)
+        try:
+            # Idle IO scheduling class: only get disk time when no other process wants it.
+            subprocess.check_call(['ionice', '-c', '3', '-p', str(os.getpid())])
+        except Exception as ex:
+            self.__logger.warning(f'Unable to lower IO priority: {ex}')
+        self.__logger.info(f'Running with niceness {niceness}. Download rate limit: {self.__max_download_rate}.')
@@ -0,0 +1,130 @@
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from pifi.logger import Logger
+
+# Decodes a video in-process with PyAV, an FFmpeg binding, as an alternative to decoding it with an ffmpeg
+# subprocess that writes frames and timestamps to fifos. See config value: "video.decode_backend"
+#
+# Decoding and scaling happen on a background thread. PyAV releases the GIL while FFmpeg works, so this doesn't
+# hold up playback on the main thread. Each frame is scaled to the LED matrix size and converted to the pixel
+# format by swscale, then copied once, straight into the frames buffer. Its timestamp is added to the
+# FrameTimestamps.
+#
+# The frames buffer and FrameTimestamps are shared with the main thread without locks: the decoding thread only
+# ever writes frames, and the main thread only ever reads them.
+#
+# PyAV is an optional dependency. See: is_available
+class PyAvDecoder:
+
+    # How often to check whether the frames buffer has room, while it's full.
+    __FULL_BUFFER_POLL_INTERVAL_S = 0.02
+
+    # frames: ReadOnceFrameRingBuffer with frames of shape [height, width] or [height, width, 3].
+    # frame_timestamps: FrameTimestamps
+    # pix_fmt: 'rgb24' or 'gray'. See: VideoProcessor.get_pix_fmt
+    def __init__(self, frames, frame_timestamps, width, height, pix_fmt):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__frames = frames
+        self.__frame_timestamps = frame_timestamps
+        self.__width = width
+        self.__height = height
+        self.__pix_fmt = pix_fmt
+        self.__bytes_per_row = width * (3 if pix_fmt == 'rgb24' else 1)
+
+        # Set whenever a frame is decoded, and once decoding is done.
+        self.__new_frames_event = threading.Event()
+        self.__is_done = False
+        self.__should_stop = False
+        self.__exception = None
+        self.__thread = None
+
+        # When the previously decoded frame ends, in units of the stream's time base
+        self.__next_pts = 0
+
+    @staticmethod
+    def is_available():
+        try:
+            import av # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    # input: a file path, or a readable binary file object, e.g. the stdout of a video download process.
+    # input_format: the container format, e.g. 'mpegts'. If None, it's probed.
+    # start_position_s: if set, frames less than this many seconds after the first frame are dropped, like ffmpeg's
+    #   `-ss` does for inputs that can't be seeked in.
+    def start(self, input, input_format = None, start_position_s = None):
+        self.__thread = threading.Thread(
+            target = self.__decode, args = (input, input_format, start_position_s), daemon = True
+        )
+        self.__thread.start()
+
+    # Blocks until a frame is decoded, decoding is done, or timeout seconds pass. A timeout of None waits
+    # indefinitely.
+    def wait_for_frames(self, timeout):
+        self.__new_frames_event.wait(timeout)
+        self.__new_frames_event.clear()
+
+    # True once the last frame has been decoded, or decoding failed.
+    def is_done(self):
+        return self.__is_done
+
+    # The exception that decoding failed with, if any.
+    def get_exception(self):
+        return self.__exception
+
+    # Stops decoding after the current frame. If the decoding thread is blocked reading its input, it only stops
+    # once the input is closed, e.g. once the download process is killed.
+    def stop(self):
+        self.__should_stop = True
+
+    def __decode(self, input, input_format, start_position_s):
+        import av
+
+        try:
+            with av.open(input, format = input_format) as container:
+                stream = container.streams.video[0]
+                stream.thread_type = 'AUTO'
+                first_frame_time = None
+                for frame in container.decode(stream):
+                    if start_position_s and frame.time is not None:
+                        if first_frame_time is None:
+                            first_frame_time = frame.time
+                        if frame.time - first_frame_time < start_position_s:
+                            continue
+                    if not self.__wait_for_room():
+                        break
+                    self.__write_frame(frame, stream.time_base)
+        except Exception as e:
+            if not self.__should_stop:
+                self.__logger.error(f'Caught exception while decoding: {traceback.format_exc()}')
+                self.__exception = e
+        finally:
+            self.__is_done = True
+            self.__new_frames_event.set()
+
+    # Returns False if we were stopped while waiting.
+    def __wait_for_room(self):
+        while self.__frames.is_full() and not self.__should_stop:
+            time.sleep(self.__FULL_BUFFER_POLL_INTERVAL_S)
+        return not self.__should_stop
+
+    def __write_frame(self, frame, time_base):
+        plane = frame.reformat(width = self.__width, height = self.__height, format = self.__pix_fmt).planes[0]
+
+        # Rows of the plane may be padded.
+        rows = np.frombuffer(plane, np.uint8, self.__height * plane.line_size).reshape(self.__height, plane.line_size)
+        rows = rows[:, :self.__bytes_per_row]
+        write_slot = np.frombuffer(self.__frames.get_write_slot(), np.uint8)
+        write_slot.reshape(self.__height, self.__bytes_per_row)[:] = rows
+
+        # If the frame has no timestamp, assume it follows right after the previous one.
+        pts = self.__next_pts if frame.pts is None else frame.pts
+        self.__next_pts = pts + (frame.duration or 0)
+        self.__frame_timestamps.add(pts, frame.duration, time_base)
+        self.__frames.commit_write()
+        self.__new_frames_event.set()
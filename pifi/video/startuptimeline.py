@@ -0,0 +1,175 @@
+import os
+import shlex
+import tempfile
+import time
+
+import numpy as np
+
+from pifi.logger import Logger
+import pifi.database
+
+# Records how long each stage of starting to play a video takes, so that we can tell where the time goes when
+# startup is slow. Times are in seconds since the VideoProcessor was constructed.
+#
+# Stages in the python process are marked directly. Stages in the bash pipeline (yt-dlp extraction, and the first
+# downloaded bytes if video.should_record_first_byte_times is set) append a line of the form `<stage> <unix time>`
+# to a markers file; see get_marker_cmd. The markers file is read once the first frame has been played.
+#
+# Timelines of videos played from the queue are stored in the DB, keyed by playlist_video_id. See:
+# get_stage_percentiles, utils/video_startup_stats
+class StartupTimeline:
+
+    # Stages, roughly in the order they happen. Which stages a video goes through depends on whether it was
+    # streamed, prefetched, saved, or cached.
+    STAGE_LED_FRAME_PLAYER_INIT = 'led_frame_player_init'
+    STAGE_HOUSEKEEPING = 'housekeeping'
+    STAGE_TRANSCODE_CACHE_LOOKUP = 'transcode_cache_lookup'
+
+    # Exactly one of these is marked when the yt-dlp info cache is looked up. Filtering on them shows how much
+    # startup time the cache saves. See: get_stage_percentiles
+    STAGE_YT_DLP_INFO_CACHE_HIT = 'yt_dlp_info_cache_hit'
+    STAGE_YT_DLP_INFO_CACHE_MISS = 'yt_dlp_info_cache_miss'
+
+    STAGE_PIPELINE_START = 'pipeline_start'
+    STAGE_YT_DLP_VIDEO_EXTRACTED = 'yt_dlp_video_extracted'
+    STAGE_YT_DLP_AUDIO_EXTRACTED = 'yt_dlp_audio_extracted'
+    STAGE_FIRST_VIDEO_BYTE = 'first_video_byte'
+    STAGE_FIRST_AUDIO_BYTE = 'first_audio_byte'
+    STAGE_FIRST_FRAME_DECODED = 'first_frame_decoded'
+    STAGE_FIRST_FRAME_PLAYED = 'first_frame_played'
+
+    __MARKERS_FILE_PREFIX = 'pifi_startup_markers__'
+
+    # How many videos' timelines to keep in the DB.
+    __MAX_NUM_VIDEOS = 1000
+
+    # playlist_video_id: if None, the timeline is logged, but not stored.
+    def __init__(self, playlist_video_id = None):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__playlist_video_id = playlist_video_id
+        self.__start_time = time.time()
+        self.__stages = {}
+        self.__markers_file_path = None
+        self.__is_saved = False
+
+    def construct(self):
+        cursor = pifi.database.Database().get_cursor()
+        cursor.execute("DROP TABLE IF EXISTS video_startup_stages")
+        cursor.execute("""
+            CREATE TABLE video_startup_stages (
+                playlist_video_id INTEGER,
+                stage VARCHAR(100),
+                elapsed_s REAL,
+                create_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (playlist_video_id, stage)
+            )""")
+
+    # If a stage is marked more than once, e.g. because playback was retried, the last mark wins.
+    def mark(self, stage):
+        self.__stages[stage] = time.time() - self.__start_time
+
+    def get_elapsed_s(self):
+        return time.time() - self.__start_time
+
+    # Returns a shell command that marks the stage when it runs. For use in the bash pipeline.
+    def get_marker_cmd(self, stage):
+        if self.__markers_file_path is None:
+            fd, self.__markers_file_path = tempfile.mkstemp(prefix = self.__MARKERS_FILE_PREFIX)
+            os.close(fd)
+        return f'echo {stage} $(date +%s.%N) >> {shlex.quote(self.__markers_file_path)}'
+
+    # Markers files are named with this prefix, followed by a random suffix.
+    @staticmethod
+    def get_markers_file_path_prefix():
+        return tempfile.gettempdir() + '/' + StartupTimeline.__MARKERS_FILE_PREFIX
+
+    # Logs the timeline, and stores it in the DB. Only the first call does anything, so that the timeline isn't
+    # overwritten by later stages of playback.
+    def save(self):
+        if self.__is_saved:
+            return
+        self.__is_saved = True
+        self.__read_markers_file()
+
+        stages = sorted(self.__stages.items(), key = lambda stage: stage[1])
+        self.__logger.info(
+            f'Started playing video after {round(self.get_elapsed_s(), 3)} s. Startup timeline: ' +
+            ', '.join(f'{stage}: {round(elapsed_s, 3)} s' for stage, elapsed_s in stages)
+        )
+
+        if self.__playlist_video_id is None:
+            return
+        cursor = pifi.database.Database().get_cursor()
+        cursor.executemany(
+            ("INSERT OR REPLACE INTO video_startup_stages (playlist_video_id, stage, elapsed_s) " +
+                "VALUES(?, ?, ?)"),
+            [[self.__playlist_video_id, stage, elapsed_s] for stage, elapsed_s in stages]
+        )
+        cursor.execute(
+            ("DELETE FROM video_startup_stages WHERE playlist_video_id NOT IN (" +
+                "SELECT DISTINCT playlist_video_id FROM video_startup_stages " +
+                "ORDER BY playlist_video_id DESC LIMIT ?)"),
+            [self.__MAX_NUM_VIDEOS]
+        )
+
+    # Returns the stored timeline of a video, as a list of (stage, elapsed_s) in the order the stages happened.
+    @staticmethod
+    def get_timeline(playlist_video_id):
+        cursor = pifi.database.Database().get_cursor()
+        cursor.execute(
+            "SELECT stage, elapsed_s FROM video_startup_stages WHERE playlist_video_id = ? ORDER BY elapsed_s",
+            [playlist_video_id]
+        )
+        return [(row['stage'], row['elapsed_s']) for row in cursor.fetchall()]
+
+    # Returns the 50th and 95th percentile of when each stage happened, over the most recent num_videos videos.
+    # Stages are ordered by their median.
+    #
+    # with_stage: string. If set, only videos whose timeline includes this stage are considered, e.g.
+    #   STAGE_YT_DLP_INFO_CACHE_HIT.
+    @staticmethod
+    def get_stage_percentiles(num_videos = 100, with_stage = None):
+        cursor = pifi.database.Database().get_cursor()
+        with_stage_clause = ''
+        params = [num_videos]
+        if with_stage is not None:
+            with_stage_clause = 'WHERE stage = ? '
+            params = [with_stage, num_videos]
+        cursor.execute(
+            ("SELECT stage, elapsed_s FROM video_startup_stages WHERE playlist_video_id IN (" +
+                f"SELECT DISTINCT playlist_video_id FROM video_startup_stages {with_stage_clause}" +
+                "ORDER BY playlist_video_id DESC LIMIT ?)"),
+            params
+        )
+        elapsed_s_by_stage = {}
+        for row in cursor.fetchall():
+            elapsed_s_by_stage.setdefault(row['stage'], []).append(row['elapsed_s'])
+
+        stage_percentiles = []
+        for stage, elapsed_s in elapsed_s_by_stage.items():
+            p50, p95 = np.percentile(elapsed_s, [50, 95])
+            stage_percentiles.append({
+                'stage': stage,
+                'num_videos': len(elapsed_s),
+                'p50_s': round(float(p50), 3),
+                'p95_s': round(float(p95), 3),
+            })
+        return sorted(stage_percentiles, key = lambda stage_percentile: stage_percentile['p50_s'])
+
+    def __read_markers_file(self):
+        if self.__markers_file_path is None:
+            return
+        try:
+            with open(self.__markers_file_path) as markers_file:
+                for line in markers_file:
+                    parts = line.split()
+                    if len(parts) < 2:
+                        continue
+                    try:
+                        self.__stages[parts[0]] = float(parts[1]) - self.__start_time
+                    except ValueError:
+                        self.__logger.warning(f'Unable to parse startup marker: {line}')
+            os.remove(self.__markers_file_path)
+        except FileNotFoundError:
+            pass
+        self.__markers_file_path = None
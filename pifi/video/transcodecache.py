@@ -0,0 +1,215 @@
+import hashlib
+import os
+import shutil
+import time
+
+import numpy as np
+
+from pifi.config import Config
+from pifi.directoryutils import DirectoryUtils
+from pifi.logger import Logger
+from pifi.video.frametimestamps import FrameTimestamps
+from pifi.video.incompletedirectories import IncompleteDirectories
+import pifi.database
+
+"""
+The transcode cache stores videos that have already been scaled down to the LED matrix resolution and converted
+to the pixel format we display. Replaying a cached video memory-maps its frames, rather than running the download
+and ffmpeg decoding and scaling pipeline again.
+
+Each entry is a directory holding the raw frames (rgb24 or gray, display_width x display_height, back to back), their
+timestamps, and the video's audio stream in a matroska container. The number of frames and average fps are stored in
+the DB, along with the entry's size and when it was last played, so that we can evict the least recently played
+entries once the cache exceeds its byte budget.
+
+Entries are keyed by url, pixel format, and display size. All of the monochrome color modes share the gray pixel
+format, and the color modes share rgb24, because the color mode transforms are applied at display time.
+"""
+class TranscodeCache:
+
+    FRAMES_FILE_NAME = 'frames.raw'
+
+    # The frames' timestamps, as output by ffmpeg's framecrc muxer. See: FrameTimestamps
+    FRAME_TIMESTAMPS_FILE_NAME = 'timestamps.framecrc'
+    AUDIO_FILE_NAME = 'audio.mka'
+
+    # Written once the audio extraction is done, regardless of whether it succeeded. Some videos don't have
+    # an audio stream.
+    AUDIO_DONE_FILE_NAME = 'audio.done'
+
+    __DIRECTORY = 'data/transcodes'
+
+    # How long to wait for the audio extraction to finish after the last frame has been decoded.
+    __AUDIO_DONE_TIMEOUT_S = 5
+
+    __DEFAULT_MAX_SIZE_BYTES = 2 * 1024 * 1024 * 1024
+
+    def __init__(self):
+        self.__cursor = pifi.database.Database().get_cursor()
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+
+    def construct(self):
+        self.__cursor.execute("DROP TABLE IF EXISTS transcode_cache")
+        self.__cursor.execute("""
+            CREATE TABLE transcode_cache (
+                cache_key VARCHAR(200) PRIMARY KEY,
+                url TEXT,
+                pix_fmt VARCHAR(20),
+                fps REAL,
+                num_frames INTEGER,
+                has_audio INTEGER,
+                size_bytes INTEGER,
+                create_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                last_access_date DATETIME DEFAULT CURRENT_TIMESTAMP
+            )""")
+        self.__cursor.execute("DROP INDEX IF EXISTS last_access_date_idx")
+        self.__cursor.execute("CREATE INDEX last_access_date_idx ON transcode_cache (last_access_date)")
+
+    @staticmethod
+    def is_enabled():
+        return Config.get('video.transcode_cache.enabled', False)
+
+    # Returns the cache entry row for the video, or None if it's not cached. Marks the entry as recently played.
+    def get_entry(self, url, pix_fmt):
+        cache_key = self.__get_cache_key(url, pix_fmt)
+        self.__cursor.execute("SELECT * FROM transcode_cache WHERE cache_key = ?", [cache_key])
+        entry = self.__cursor.fetchone()
+        if entry is None:
+            return None
+
+        entry_directory = self.get_entry_directory(url, pix_fmt)
+        frames_path = entry_directory + '/' + self.FRAMES_FILE_NAME
+        expected_size = entry['num_frames'] * self.get_bytes_per_frame(pix_fmt)
+        if (
+            not os.path.isfile(frames_path) or os.path.getsize(frames_path) != expected_size or
+            not os.path.isfile(entry_directory + '/' + self.FRAME_TIMESTAMPS_FILE_NAME)
+        ):
+            self.__logger.warning(f'Transcode cache entry is missing or corrupt, deleting it: {cache_key}')
+            self.__delete_entry(cache_key)
+            return None
+
+        self.__cursor.execute(
+            "UPDATE transcode_cache SET last_access_date = datetime() WHERE cache_key = ?", [cache_key]
+        )
+        return entry
+
+    # Unlike get_entry, this doesn't count as playing the entry.
+    def has_entry(self, url, pix_fmt):
+        self.__cursor.execute(
+            "SELECT 1 FROM transcode_cache WHERE cache_key = ?", [self.__get_cache_key(url, pix_fmt)]
+        )
+        return self.__cursor.fetchone() is not None
+
+    # Returns a read-only memory map of the entry's frames, with shape [num_frames, height, width(, 3)].
+    def get_frames(self, url, pix_fmt, entry):
+        return np.memmap(
+            self.get_entry_directory(url, pix_fmt) + '/' + self.FRAMES_FILE_NAME, np.uint8, 'r',
+            shape = tuple([entry['num_frames']] + self.__get_frame_shape(pix_fmt))
+        )
+
+    def get_frame_timestamps(self, url, pix_fmt):
+        return FrameTimestamps.make_from_file(self.get_entry_directory(url, pix_fmt) + '/' + self.FRAME_TIMESTAMPS_FILE_NAME)
+
+    # Returns None if the entry has no audio.
+    def get_audio_path(self, url, pix_fmt, entry):
+        if not entry['has_audio']:
+            return None
+        return self.get_entry_directory(url, pix_fmt) + '/' + self.AUDIO_FILE_NAME
+
+    def get_entry_directory(self, url, pix_fmt):
+        return self.__get_directory() + '/' + self.__get_cache_key(url, pix_fmt)
+
+    # Returns an empty directory in which to write the frames and audio of a new entry. See: IncompleteDirectories
+    def make_incomplete_entry_directory(self, url, pix_fmt):
+        return IncompleteDirectories(self.__get_directory()).make(self.get_entry_directory(url, pix_fmt))
+
+    # Deletes an entry that we stopped writing, e.g. because it would exceed the cache's byte budget.
+    def abandon_incomplete_entry(self, incomplete_directory):
+        shutil.rmtree(incomplete_directory, ignore_errors = True)
+
+    def get_max_size_bytes(self):
+        return Config.get('video.transcode_cache.max_size_bytes', self.__DEFAULT_MAX_SIZE_BYTES)
+
+    # Moves a fully written entry into place, and evicts the least recently played entries if the cache is over
+    # its byte budget.
+    def finish_entry(self, incomplete_directory, url, pix_fmt, fps, num_frames):
+        cache_key = self.__get_cache_key(url, pix_fmt)
+        entry_directory = self.get_entry_directory(url, pix_fmt)
+
+        audio_done_path = incomplete_directory + '/' + self.AUDIO_DONE_FILE_NAME
+        wait_start_time = time.monotonic()
+        while not os.path.exists(audio_done_path):
+            if time.monotonic() - wait_start_time > self.__AUDIO_DONE_TIMEOUT_S:
+                self.__logger.warning('Timed out waiting for audio extraction. Not caching video.')
+                shutil.rmtree(incomplete_directory, ignore_errors = True)
+                return
+            time.sleep(0.1)
+        has_audio = os.path.isfile(incomplete_directory + '/' + self.AUDIO_FILE_NAME)
+
+        self.__delete_entry(cache_key)
+        os.rename(incomplete_directory, entry_directory)
+        size_bytes = self.__get_directory_size(entry_directory)
+        self.__cursor.execute(
+            ("INSERT INTO transcode_cache (cache_key, url, pix_fmt, fps, num_frames, has_audio, size_bytes) " +
+                "VALUES(?, ?, ?, ?, ?, ?, ?)"),
+            [cache_key, url, pix_fmt, fps, num_frames, 1 if has_audio else 0, size_bytes]
+        )
+        self.__logger.info(f'Cached {num_frames} frames ({size_bytes} bytes) for {url} in {entry_directory}.')
+        self.__evict()
+
+    # Finishes an entry whose files were written by VideoProcessor.get_transcode_cmd. Returns [num_frames, fps].
+    def finish_transcoded_entry(self, incomplete_directory, url, pix_fmt):
+        frames_path = incomplete_directory + '/' + self.FRAMES_FILE_NAME
+        num_frames = os.path.getsize(frames_path) // self.get_bytes_per_frame(pix_fmt)
+        fps = FrameTimestamps.make_from_file(
+            incomplete_directory + '/' + self.FRAME_TIMESTAMPS_FILE_NAME
+        ).get_average_fps()
+        self.finish_entry(incomplete_directory, url, pix_fmt, fps, num_frames)
+        return [num_frames, fps]
+
+    # Deletes entries that we were writing when playback was interrupted, as well as entries left behind by
+    # processes that have exited. Entries that other running processes are writing are left alone.
+    def delete_incomplete_entries(self):
+        IncompleteDirectories(self.__get_directory()).delete_abandoned(should_delete_own = True)
+
+    def __evict(self):
+        max_size_bytes = self.get_max_size_bytes()
+        while True:
+            self.__cursor.execute("SELECT COALESCE(SUM(size_bytes), 0) AS total_size_bytes FROM transcode_cache")
+            total_size_bytes = self.__cursor.fetchone()['total_size_bytes']
+            if total_size_bytes <= max_size_bytes:
+                return
+
+            self.__cursor.execute(
+                "SELECT cache_key, url FROM transcode_cache ORDER BY last_access_date ASC, rowid ASC LIMIT 1"
+            )
+            entry = self.__cursor.fetchone()
+            self.__logger.info(f'Transcode cache is over its budget of {max_size_bytes} bytes. Evicting: {entry["url"]}')
+            self.__delete_entry(entry['cache_key'])
+
+    def __delete_entry(self, cache_key):
+        shutil.rmtree(self.__get_directory() + '/' + cache_key, ignore_errors = True)
+        self.__cursor.execute("DELETE FROM transcode_cache WHERE cache_key = ?", [cache_key])
+
+    def __get_cache_key(self, url, pix_fmt):
+        display_width = Config.get_or_throw('leds.display_width')
+        display_height = Config.get_or_throw('leds.display_height')
+        return f"{hashlib.md5(url.encode('utf-8')).hexdigest()}__{pix_fmt}__{display_width}x{display_height}"
+
+    def __get_frame_shape(self, pix_fmt):
+        shape = [Config.get_or_throw('leds.display_height'), Config.get_or_throw('leds.display_width')]
+        if pix_fmt == 'rgb24':
+            shape.append(3)
+        return shape
+
+    def get_bytes_per_frame(self, pix_fmt):
+        return int(np.prod(self.__get_frame_shape(pix_fmt)))
+
+    def __get_directory(self):
+        return DirectoryUtils().root_dir + '/' + self.__DIRECTORY
+
+    def __get_directory_size(self, directory):
+        return sum(
+            os.path.getsize(directory + '/' + name) for name in os.listdir(directory)
+            if os.path.isfile(directory + '/' + name)
+        )
@@ -1,8 +1,6 @@
+import bisect
 import hashlib
-import math
-import numpy as np
 import os
-import pathlib
 import select
 import shlex
 import signal
@@ -12,25 +10,51 @@ import tempfile
 import time
 import traceback
 
+import numpy as np
+
 from pifi.config import Config
 from pifi.logger import Logger
-from pifi.datastructure.readoncecircularbuffer import ReadOnceCircularBuffer
+from pifi.datastructure.readonceframeringbuffer import ReadOnceFrameRingBuffer
 from pifi.directoryutils import DirectoryUtils
 from pifi.led.ledframeplayer import LedFramePlayer
+from pifi.playlist import Playlist
+from pifi.video.audiosink import AudioSink
+from pifi.video.avsync import AvSync
+from pifi.video.frametimestamps import FrameTimestamps
+from pifi.video.pyavdecoder import PyAvDecoder
+from pifi.video.startuptimeline import StartupTimeline
+from pifi.video.transcodecache import TranscodeCache
 from pifi.video.videocolormode import VideoColorMode
 from pifi.video.youtubedlexception import YoutubeDlException
+from pifi.video.ytdlpinfocache import YtDlpInfoCache
 
 class VideoProcessor:
 
     __DATA_DIRECTORY = 'data'
+    __PREFETCH_DIRECTORY = 'data/prefetch'
 
     DEFAULT_VIDEO_EXTENSION = '.mp4'
+
+    # See config value: "video.decode_backend"
+    DECODE_BACKEND_PIPELINE = 'pipeline'
+    DECODE_BACKEND_PYAV = 'pyav'
+
     __TEMP_VIDEO_DOWNLOAD_SUFFIX = '.dl_part'
 
+    # When playing audio with ffplay, start the video clock this much after the first frame is decoded, for better
+    # audio / video sync.
+    __FFPLAY_AV_SYNC_DELAY_S = 0.075
+
     __FIFO_PREFIX = 'pifi_fifo'
-    __FPS_READY_FILE = '/tmp/fps_ready.file'
 
-    __FRAMES_BUFFER_LENGTH = 1024
+    # Max bytes to read from the frame timestamps fifo at a time. Each frame's timestamp takes ~60 bytes.
+    __TIMESTAMPS_READ_SIZE_BYTES = 64 * 1024
+
+    # How often to record the playback position of videos played from the queue. See: Playlist.set_playback_position
+    __PLAYBACK_POSITION_SAVE_INTERVAL_S = 2
+
+    # Default memory budget for the buffer of decoded frames waiting to be played.
+    __DEFAULT_FRAMES_BUFFER_SIZE_BYTES = 16 * 1024 * 1024
 
     # Workaround for https://github.com/yt-dlp/yt-dlp/issues/6447
     __VIDEO_TMP_DIR = '/tmp/pifi_video_tmp'
@@ -46,35 +70,100 @@ class VideoProcessor:
     #   Refer to yt-dlp documentation for the '--use-extractors' flag for more details.
     #
     # show_loading_screen: boolean. Whether or not we display the loading screen at all.
+    #
+    # playlist_video_id: int. If set, the video's startup timeline is stored under this id (see: StartupTimeline),
+    #   and its playback position is recorded, so that it can resume from there if it's re-enqueued.
+    #
+    # start_position_s: float. How many seconds into the video to start playing. Seeks in the saved, prefetched, or
+    #   transcode cached video if there is one. Otherwise, only the rest of the video is downloaded.
     def __init__(self, url, clear_screen, yt_dlp_extractors = None, show_loading_screen = True,
-                 led_frame_player = None):
+                 led_frame_player = None, playlist_video_id = None, start_position_s = 0):
         self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__startup_timeline = StartupTimeline(playlist_video_id)
         self.__url = url
         self.__external_led_frame_player = led_frame_player is not None
         if led_frame_player is not None:
             self.__led_frame_player = led_frame_player
         else:
             self.__led_frame_player = LedFramePlayer(clear_screen = clear_screen)
+        self.__startup_timeline.mark(StartupTimeline.STAGE_LED_FRAME_PLAYER_INIT)
         self.__process_and_play_vid_proc_pgid = None
-        self.__init_time = time.time()
 
         # True if the video already exists (see config value: "video.should_save_video")
         # Also may be True if a filepath was passed into url
         self.__is_video_already_downloaded = False
         self.__yt_dlp_extractors = yt_dlp_extractors
         self.__can_show_loading_screen = show_loading_screen
+        self.__start_position_s = max(start_position_s or 0, 0)
+
+        # Where decoded frame timestamps of 0 are in the video. Not 0 if decoding started from start_position_s.
+        self.__playback_position_offset_s = 0
+
+        self.__playlist_video_id = playlist_video_id
+        self.__playlist = Playlist() if playlist_video_id is not None else None
+        self.__playback_position_s = None
+        self.__playback_position_save_time = 0
+
+        self.__decode_backend = self.__get_decode_backend()
+
+        # See config value: "video.transcode_cache.enabled"
+        self.__transcode_cache = TranscodeCache() if TranscodeCache.is_enabled() else None
+
+        # Frames are written here as they are decoded, if the video is being added to the transcode cache.
+        self.__transcode_cache_directory = None
+        self.__transcode_cache_file = None
+        self.__transcode_cache_timestamps_file = None
+        self.__transcode_cache_num_bytes = 0
+
+        # Set if the Prefetcher has already downloaded the video.
+        self.__prefetched_video_path = None
+
+        # See config value: "video.yt_dlp_info_cache.enabled"
+        self.__yt_dlp_info_cache = YtDlpInfoCache() if YtDlpInfoCache.is_enabled() else None
+
+        # Set if yt-dlp loads the video's info from the cache. Otherwise, set if yt-dlp writes the info for the cache.
+        self.__yt_dlp_info_json_path = None
+        self.__yt_dlp_info_json_incomplete_path = None
+
+        # Set while playing audio, if the video is synced to it. See config value: "video.av_sync.enabled"
+        self.__audio_sink = None
+        self.__audio_fifo_name = None
+
         self.__do_housekeeping(clear_screen)
+        self.__startup_timeline.mark(StartupTimeline.STAGE_HOUSEKEEPING)
         self.__register_signal_handlers()
 
     def process_and_play(self):
         self.__led_frame_player.set_video_color_mode(Config.get('video.color_mode'))
         self.__logger.info(f"Starting process_and_play for url: {self.__url}")
+        if self.__start_position_s:
+            self.__logger.info(f'Resuming the video from {round(self.__start_position_s, 3)} s.')
         self.__show_loading_screen()
-        video_save_path = self.__get_video_save_path()
 
+        if self.__transcode_cache:
+            transcode_cache_entry = self.__transcode_cache.get_entry(self.__url, self.get_pix_fmt())
+            self.__startup_timeline.mark(StartupTimeline.STAGE_TRANSCODE_CACHE_LOOKUP)
+            if transcode_cache_entry:
+                try:
+                    self.__play_transcode_cached_video(transcode_cache_entry)
+                finally:
+                    self.__do_housekeeping(clear_screen = True)
+                self.__logger.info("Finished process_and_play")
+                return
+
+        video_save_path = self.__get_video_save_path()
+        prefetched_video_path = self.get_prefetched_video_path(self.__url)
         if os.path.isfile(video_save_path):
             self.__logger.info(f'Video has already been downloaded. Using saved video: {video_save_path}')
             self.__is_video_already_downloaded = True
+        elif os.path.isfile(prefetched_video_path):
+            if Config.get('video.should_save_video'):
+                os.replace(prefetched_video_path, video_save_path)
+                self.__logger.info(f'Video has been prefetched. Saved it to: {video_save_path}')
+            else:
+                self.__prefetched_video_path = prefetched_video_path
+                self.__logger.info(f'Video has been prefetched. Using prefetched video: {prefetched_video_path}')
+            self.__is_video_already_downloaded = True
         elif Config.get('video.should_predownload_video'):
             self.download_video(self.__get_video_save_path())
             self.__is_video_already_downloaded = True
@@ -88,6 +177,10 @@ class VideoProcessor:
                 clear_screen = True
                 break
             except YoutubeDlException as e:
+                if self.__yt_dlp_info_json_path:
+                    # The cached info's urls may no longer work. Extract the info again when retrying.
+                    self.__logger.warning('Deleting the cached yt-dlp info of the failed video.')
+                    self.__yt_dlp_info_cache.delete_entry(self.__url)
                 if attempt < max_attempts:
                     self.__logger.warning("Caught exception in VideoProcessor.__process_and_play_video: " +
                         traceback.format_exc())
@@ -105,7 +198,9 @@ class VideoProcessor:
         self.__logger.info("Finished process_and_play")
 
     def download_video(self, save_path):
-        download_command = self.__get_streaming_video_download_cmd() + ' > ' + shlex.quote(save_path)
+        download_command = (
+            self.get_streaming_video_download_cmd(self.__url, self.__yt_dlp_extractors) + ' > ' + shlex.quote(save_path)
+        )
         self.__logger.info(f'Downloading video: {download_command}')
         subprocess.call(download_command, shell = True, executable = '/usr/bin/bash')
         self.__logger.info(f'Video download complete: {save_path}')
@@ -117,21 +212,86 @@ class VideoProcessor:
     def __get_video_save_path(self):
         if os.path.isfile(self.__url):
             return self.__url
+        return self.get_saved_video_path(self.__url)
+
+    # See config value: "video.should_save_video"
+    @staticmethod
+    def get_saved_video_path(url):
+        return (
+            VideoProcessor.__get_data_directory(VideoProcessor.__DATA_DIRECTORY) + '/' +
+            hashlib.md5(url.encode('utf-8')).hexdigest() + VideoProcessor.DEFAULT_VIDEO_EXTENSION
+        )
+
+    # Where the Prefetcher downloads videos that are coming up in the queue.
+    @staticmethod
+    def get_prefetched_video_path(url):
         return (
-            self.__get_data_directory() + '/' +
-            hashlib.md5(self.__url.encode('utf-8')).hexdigest() + self.DEFAULT_VIDEO_EXTENSION
+            VideoProcessor.get_prefetch_directory() + '/' +
+            hashlib.md5(url.encode('utf-8')).hexdigest() + VideoProcessor.DEFAULT_VIDEO_EXTENSION
         )
 
-    def __get_data_directory(self):
-        save_dir = DirectoryUtils().root_dir + '/' + self.__DATA_DIRECTORY
+    @staticmethod
+    def get_prefetch_directory():
+        return VideoProcessor.__get_data_directory(VideoProcessor.__PREFETCH_DIRECTORY)
+
+    @staticmethod
+    def __get_data_directory(data_directory):
+        save_dir = DirectoryUtils().root_dir + '/' + data_directory
         os.makedirs(save_dir, exist_ok=True)
         return save_dir
 
+    # Returns the configured decode backend, falling back to the pipeline if it's unavailable.
+    def __get_decode_backend(self):
+        decode_backend = Config.get('video.decode_backend', self.DECODE_BACKEND_PIPELINE)
+        if decode_backend == self.DECODE_BACKEND_PYAV:
+            if PyAvDecoder.is_available():
+                return decode_backend
+            self.__logger.warning('PyAV is not installed. Falling back to the pipeline decode backend.')
+        elif decode_backend != self.DECODE_BACKEND_PIPELINE:
+            self.__logger.warning(
+                f'Unknown decode backend: {decode_backend}. Falling back to the pipeline decode backend.'
+            )
+        return self.DECODE_BACKEND_PIPELINE
+
     def __process_and_play_video(self):
+        self.__playback_position_offset_s = self.__start_position_s
+        if self.__start_position_s and self.__is_video_already_downloaded:
+            keyframe_time_s = self.__get_keyframe_time_before(
+                self.__prefetched_video_path or self.__get_video_save_path(), self.__start_position_s
+            )
+            if keyframe_time_s is None:
+                self.__logger.warning('Unable to find the keyframe at the start position.')
+            else:
+                self.__logger.info(f'Playback starts from the keyframe at {round(keyframe_time_s, 3)} s.')
+                self.__playback_position_offset_s = keyframe_time_s
+        if self.__decode_backend == self.DECODE_BACKEND_PYAV:
+            self.__decode_and_play_video_in_process()
+            return
+
         ffmpeg_to_python_fifo_name = self.__make_fifo(additional_prefix = 'ffmpeg_to_python')
-        fps_fifo_name = self.__make_fifo(additional_prefix = 'fps')
+        timestamps_fifo_name = self.__make_fifo(additional_prefix = 'timestamps')
+
+        self.__transcode_cache_directory = None
+        if self.__transcode_cache and self.__start_position_s:
+            self.__logger.info('Resumed videos are not added to the transcode cache.')
+        elif self.__transcode_cache:
+            self.__transcode_cache_directory = self.__transcode_cache.make_incomplete_entry_directory(
+                self.__url, self.get_pix_fmt()
+            )
+            self.__transcode_cache_file = open(
+                self.__transcode_cache_directory + '/' + TranscodeCache.FRAMES_FILE_NAME, 'wb'
+            )
+            self.__transcode_cache_timestamps_file = open(
+                self.__transcode_cache_directory + '/' + TranscodeCache.FRAME_TIMESTAMPS_FILE_NAME, 'wb'
+            )
+            self.__transcode_cache_num_bytes = 0
+            self.__logger.info(f'Video will be added to the transcode cache: {self.__transcode_cache_directory}')
 
-        process_and_play_vid_cmd = self.__get_process_and_play_vid_cmd(ffmpeg_to_python_fifo_name, fps_fifo_name)
+        self.__look_up_yt_dlp_info()
+        self.__start_audio_sink()
+        process_and_play_vid_cmd = self.__get_process_and_play_vid_cmd(
+            ffmpeg_to_python_fifo_name, timestamps_fifo_name, self.__transcode_cache_directory
+        )
         self.__logger.info('executing process and play cmd: ' + process_and_play_vid_cmd)
         process_and_play_vid_proc = subprocess.Popen(
             process_and_play_vid_cmd, shell = True, executable = '/usr/bin/bash', start_new_session = True
@@ -139,48 +299,171 @@ class VideoProcessor:
         # Store the PGID separately, because attempting to get the PGID later via `os.getpgid` can
         # raise `ProcessLookupError: [Errno 3] No such process` if the process is no longer running
         self.__process_and_play_vid_proc_pgid = os.getpgid(process_and_play_vid_proc.pid)
+        self.__startup_timeline.mark(StartupTimeline.STAGE_PIPELINE_START)
 
-        display_width = Config.get_or_throw('leds.display_width')
-        display_height = Config.get_or_throw('leds.display_height')
-        bytes_per_frame = display_width * display_height
-        np_array_shape = [display_height, display_width]
-        if VideoColorMode.is_color_mode_rgb(Config.get('video.color_mode')):
-            bytes_per_frame = bytes_per_frame * 3
-            np_array_shape.append(3)
+        np_array_shape = self.__get_frame_shape()
+        bytes_per_frame = int(np.prod(np_array_shape))
 
-        vid_start_time = None
+        av_sync = self.__make_av_sync(Config.get('video.should_play_audio'))
         last_frame = None
         vid_processing_lag_counter = 0
         is_ffmpeg_done_outputting = False
-        frames = ReadOnceCircularBuffer(self.__FRAMES_BUFFER_LENGTH)
-        ffmpeg_to_python_fifo = open(ffmpeg_to_python_fifo_name, 'rb')
+        is_ffmpeg_done_outputting_timestamps = False
+        frame_timestamps = FrameTimestamps()
+        frames = ReadOnceFrameRingBuffer.make_for_memory_budget(
+            Config.get('video.frames_buffer_size_bytes', self.__DEFAULT_FRAMES_BUFFER_SIZE_BYTES), np_array_shape
+        )
+        self.__logger.info(f'Buffering up to {frames.get_capacity()} frames.')
 
-        fps = self.__read_fps_from_fifo(fps_fifo_name)
-        frame_length = 1 / fps
-        pathlib.Path(self.__FPS_READY_FILE).touch()
+        # Unbuffered, so that select's view of whether the fifos are readable is accurate: with a buffered reader,
+        # data could sit in python's read buffer while select waits for more data to arrive.
+        #
+        # Opening a fifo blocks until its writer opens it too. ffmpeg opens its output files before it starts
+        # decoding, so this doesn't block ffmpeg from writing frames.
+        ffmpeg_to_python_fifo = open(ffmpeg_to_python_fifo_name, 'rb', buffering = 0)
+        timestamps_fifo = open(timestamps_fifo_name, 'rb', buffering = 0)
+
+        # Rather than spinning, block until either a fifo has data for us to read, or it's time to play the
+        # next frame, whichever comes first. Thus CPU usage scales with the frame rate, and we don't steal CPU
+        # from ffmpeg.
         while True:
-            if is_ffmpeg_done_outputting or frames.is_full():
-                pass
-            else:
-                is_ffmpeg_done_outputting, vid_start_time = self.__populate_frames(
-                    frames, ffmpeg_to_python_fifo, vid_start_time, bytes_per_frame, np_array_shape
+            fifos_to_wait_on = []
+            if not is_ffmpeg_done_outputting and not frames.is_full():
+                fifos_to_wait_on.append(ffmpeg_to_python_fifo)
+            if not is_ffmpeg_done_outputting_timestamps:
+                fifos_to_wait_on.append(timestamps_fifo)
+
+            # Don't wake up for a frame that hasn't been decoded yet; we'll wake up once it's readable instead.
+            timeout = None
+            is_done_outputting = is_ffmpeg_done_outputting and is_ffmpeg_done_outputting_timestamps
+            if av_sync.is_started():
+                next_frame_time = self.__get_next_frame_time(
+                    frame_timestamps, min(len(frames), len(frame_timestamps)), last_frame, is_done_outputting
+                )
+                if next_frame_time is not None:
+                    timeout = av_sync.get_wait_s(next_frame_time)
+
+            readable_fifos, ignore1, ignore2 = select.select(fifos_to_wait_on, [], [], timeout)
+            if ffmpeg_to_python_fifo in readable_fifos:
+                is_ffmpeg_done_outputting = self.__populate_frames(
+                    frames, ffmpeg_to_python_fifo, av_sync, bytes_per_frame
+                )
+            if timestamps_fifo in readable_fifos:
+                is_ffmpeg_done_outputting_timestamps = self.__populate_frame_timestamps(
+                    frame_timestamps, timestamps_fifo
                 )
 
-            if vid_start_time is None:
+            if not av_sync.is_started():
                 # video has not started being processed yet
-                pass
-            else:
-                if self.__init_time:
-                    self.__logger.info(f"Started playing video after {round(time.time() - self.__init_time, 3)} s.")
-                    self.__init_time = None
+                continue
+
+            is_video_done_playing, last_frame, vid_processing_lag_counter = self.__play_video(
+                frames, frame_timestamps, av_sync,
+                is_ffmpeg_done_outputting and is_ffmpeg_done_outputting_timestamps,
+                last_frame, vid_processing_lag_counter
+            )
+            if is_video_done_playing:
+                break
+
+        self.__wait_for_process_and_play_vid_proc(process_and_play_vid_proc)
+
+        if self.__transcode_cache_file and is_ffmpeg_done_outputting and len(frames) > 0:
+            self.__close_transcode_cache_files()
+            self.__transcode_cache.finish_entry(
+                self.__transcode_cache_directory, self.__url, self.get_pix_fmt(),
+                frame_timestamps.get_average_fps(), len(frames)
+            )
+
+    # Decodes the video with PyAV, rather than with an ffmpeg subprocess. Only downloading the video, playing its
+    # audio, and saving it still happen in subprocesses. See: PyAvDecoder
+    def __decode_and_play_video_in_process(self):
+        if self.__transcode_cache:
+            self.__logger.info('Videos decoded in-process are not added to the transcode cache.')
+
+        frame_timestamps = FrameTimestamps()
+        frames = ReadOnceFrameRingBuffer.make_for_memory_budget(
+            Config.get('video.frames_buffer_size_bytes', self.__DEFAULT_FRAMES_BUFFER_SIZE_BYTES),
+            self.__get_frame_shape()
+        )
+        self.__logger.info(f'Buffering up to {frames.get_capacity()} frames.')
+        decoder = PyAvDecoder(
+            frames, frame_timestamps, Config.get_or_throw('leds.display_width'),
+            Config.get_or_throw('leds.display_height'), self.get_pix_fmt()
+        )
+
+        proc = None
+        if self.__is_video_already_downloaded and not self.__start_position_s:
+            video_path = self.__prefetched_video_path or self.__get_video_save_path()
+            if Config.get('video.should_play_audio'):
+                self.__start_audio_sink()
+                play_audio_cmd = self.__get_play_audio_cmd(shlex.quote(video_path))
+                self.__logger.info('executing play audio cmd: ' + play_audio_cmd)
+                proc = subprocess.Popen(
+                    play_audio_cmd, shell = True, executable = '/usr/bin/bash', start_new_session = True
+                )
+            decoder.start(video_path)
+        else:
+            # Resumed videos are piped through __get_vid_data_cmd, even if they have already been downloaded. See:
+            # __get_vid_data_cmd, __get_stream_seek_s
+            self.__look_up_yt_dlp_info()
+            self.__start_audio_sink()
+            download_vid_cmd = self.__get_download_vid_cmd()
+            self.__logger.info('executing download video cmd: ' + download_vid_cmd)
+            proc = subprocess.Popen(
+                download_vid_cmd, shell = True, executable = '/usr/bin/bash', start_new_session = True,
+                stdout = subprocess.PIPE
+            )
+            decoder.start(proc.stdout, 'mpegts', self.__get_stream_seek_s())
+        if proc:
+            self.__process_and_play_vid_proc_pgid = os.getpgid(proc.pid)
+        self.__startup_timeline.mark(StartupTimeline.STAGE_PIPELINE_START)
+
+        av_sync = self.__make_av_sync(Config.get('video.should_play_audio'))
+        last_frame = None
+        vid_processing_lag_counter = 0
+        try:
+            while True:
+                # Block until a frame is decoded, or it's time to play the next frame, whichever comes first.
+                timeout = None
+                if av_sync.is_started():
+                    next_frame_time = self.__get_next_frame_time(
+                        frame_timestamps, min(len(frames), len(frame_timestamps)), last_frame, decoder.is_done()
+                    )
+                    if next_frame_time is not None:
+                        timeout = av_sync.get_wait_s(next_frame_time)
+                if not decoder.is_done():
+                    decoder.wait_for_frames(timeout)
+                elif timeout:
+                    time.sleep(timeout)
+
+                if not av_sync.is_started():
+                    if len(frames) == 0:
+                        if decoder.is_done():
+                            self.__logger.error('No frames were decoded.')
+                            break
+                        continue
+                    av_sync.start()
+                    self.__startup_timeline.mark(StartupTimeline.STAGE_FIRST_FRAME_DECODED)
 
                 is_video_done_playing, last_frame, vid_processing_lag_counter = self.__play_video(
-                    frames, vid_start_time, frame_length, is_ffmpeg_done_outputting,
-                    last_frame, vid_processing_lag_counter
+                    frames, frame_timestamps, av_sync, decoder.is_done(), last_frame, vid_processing_lag_counter
                 )
                 if is_video_done_playing:
                     break
+        finally:
+            # If playback was interrupted, e.g. by an exception, don't keep decoding in the background while we clean
+            # up. This also unblocks the decoding thread if it's waiting for room in the frames buffer.
+            decoder.stop()
 
+        if decoder.get_exception() and proc and proc.stdout:
+            # Nothing reads the download anymore. Unblock it, so that it exits.
+            proc.stdout.close()
+        if proc:
+            self.__wait_for_process_and_play_vid_proc(proc)
+        if decoder.get_exception():
+            raise decoder.get_exception()
+
+    def __wait_for_process_and_play_vid_proc(self, process_and_play_vid_proc):
         self.__logger.info("Waiting for process_and_play_vid_proc to end...")
         while True: # Wait for proc to end
             if process_and_play_vid_proc.poll() is not None:
@@ -192,141 +475,420 @@ class VideoProcessor:
                 break
             time.sleep(0.1)
 
-    def __populate_frames(
-        self, frames, ffmpeg_to_python_fifo, vid_start_time, bytes_per_frame, np_array_shape
-    ):
-        is_ready_to_read, ignore1, ignore2 = select.select([ffmpeg_to_python_fifo], [], [], 0)
-        if not is_ready_to_read:
-            return [False, vid_start_time]
-
-        ffmpeg_output = ffmpeg_to_python_fifo.read(bytes_per_frame)
-        if ffmpeg_output and len(ffmpeg_output) < bytes_per_frame:
-            raise Exception('Expected {} bytes from ffmpeg output, but got {}.'.format(bytes_per_frame, len(ffmpeg_output)))
-        if not ffmpeg_output:
+    # Uses the yt-dlp info cache, if enabled, when streaming the video.
+    def __look_up_yt_dlp_info(self):
+        self.__yt_dlp_info_json_path = None
+        self.__yt_dlp_info_json_incomplete_path = None
+        if not self.__yt_dlp_info_cache or self.__is_video_already_downloaded:
+            return
+
+        self.__yt_dlp_info_json_path = self.__yt_dlp_info_cache.get_info_json_path(self.__url)
+        if self.__yt_dlp_info_json_path:
+            self.__startup_timeline.mark(StartupTimeline.STAGE_YT_DLP_INFO_CACHE_HIT)
+            self.__logger.info(f'Using cached yt-dlp info: {self.__yt_dlp_info_json_path}')
+        else:
+            self.__startup_timeline.mark(StartupTimeline.STAGE_YT_DLP_INFO_CACHE_MISS)
+            self.__yt_dlp_info_json_incomplete_path = self.__yt_dlp_info_cache.make_incomplete_info_json_path(
+                self.__url
+            )
+
+    # If the video should be synced to its audio, starts an AudioSink to play the audio. Call before building the
+    # command that plays the audio. See: __get_play_audio_cmd
+    def __start_audio_sink(self):
+        if not Config.get('video.should_play_audio') or not Config.get('video.av_sync.enabled', False):
+            return
+
+        self.__audio_fifo_name = self.__make_fifo(additional_prefix = 'audio')
+        self.__audio_sink = AudioSink(self.__audio_fifo_name, Config.get('video.av_sync.alsa_device', 'default'))
+        self.__audio_sink.start()
+
+    def __make_av_sync(self, should_play_audio):
+        return AvSync(self.__audio_sink, self.__FFPLAY_AV_SYNC_DELAY_S if should_play_audio else 0)
+
+    def __get_frame_shape(self):
+        np_array_shape = [Config.get_or_throw('leds.display_height'), Config.get_or_throw('leds.display_width')]
+        if VideoColorMode.is_color_mode_rgb(Config.get('video.color_mode')):
+            np_array_shape.append(3)
+        return np_array_shape
+
+    # Plays a video from the transcode cache. The frames are already scaled and converted to the pixel format
+    # we need, so we only have to play the audio.
+    def __play_transcode_cached_video(self, transcode_cache_entry):
+        pix_fmt = self.get_pix_fmt()
+        frames = self.__transcode_cache.get_frames(self.__url, pix_fmt, transcode_cache_entry)
+        frame_timestamps = self.__transcode_cache.get_frame_timestamps(self.__url, pix_fmt)
+        num_frames = min(transcode_cache_entry['num_frames'], len(frame_timestamps))
+        first_frame = self.__get_first_frame_at_start_position(frame_timestamps, num_frames)
+        start_position_s = frame_timestamps.get(first_frame)
+        self.__logger.info(f'Playing {num_frames - first_frame} frames from the transcode cache.')
+
+        audio_path = self.__transcode_cache.get_audio_path(self.__url, pix_fmt, transcode_cache_entry)
+        should_play_audio = Config.get('video.should_play_audio') and audio_path is not None
+        if should_play_audio:
+            self.__start_audio_sink()
+            play_audio_cmd = self.__get_play_audio_cmd(shlex.quote(audio_path), start_position_s)
+            self.__logger.info('executing play audio cmd: ' + play_audio_cmd)
+            play_audio_proc = subprocess.Popen(
+                play_audio_cmd, shell = True, executable = '/usr/bin/bash', start_new_session = True
+            )
+            self.__process_and_play_vid_proc_pgid = os.getpgid(play_audio_proc.pid)
+
+        av_sync = self.__make_av_sync(should_play_audio)
+        av_sync.start()
+
+        last_frame = None
+        while True:
+            # The video clock starts at 0, but the frames' timestamps start at start_position_s.
+            elapsed = av_sync.get_elapsed_s() + start_position_s
+            cur_frame = self.__get_due_frame(frame_timestamps, num_frames, last_frame, elapsed, first_frame)
+            if cur_frame != last_frame:
+                self.__play_frame(
+                    frames, cur_frame, last_frame, av_sync, frame_timestamps.get(cur_frame), elapsed, first_frame
+                )
+                last_frame = cur_frame
+
+            next_frame_time = self.__get_next_frame_time(frame_timestamps, num_frames, last_frame, True, first_frame)
+            if last_frame == num_frames - 1 and elapsed >= next_frame_time:
+                break
+            time.sleep(av_sync.get_wait_s(next_frame_time - start_position_s))
+        self.__logger.info("Video done playing.")
+        av_sync.log_stats()
+
+    # Seeking without re-encoding starts playback from the keyframe at or before position_s (see: __get_vid_data_cmd).
+    # Returns how many seconds into the video that keyframe is, by seeking the same way ffmpeg does. Returns None
+    # if the keyframe can't be found.
+    @staticmethod
+    def __get_keyframe_time_before(video_path, position_s):
+        video_path = shlex.quote(video_path)
+        try:
+            # ffmpeg seeks relative to the start time, but ffprobe's read intervals are absolute.
+            start_time_s = subprocess.check_output(
+                f'ffprobe -v error -show_entries format=start_time -of csv=p=0 {video_path}',
+                shell = True, executable = '/usr/bin/bash'
+            ).decode('utf-8').strip()
+            start_time_s = float(start_time_s) if start_time_s not in ('', 'N/A') else 0
+
+            # Demuxers seek to the keyframe at or before the target, so the first packet read is that keyframe.
+            read_interval = shlex.quote(f'{start_time_s + position_s}%+#1')
+            keyframe_time_s = subprocess.check_output(
+                f'ffprobe -v error -select_streams v:0 -read_intervals {read_interval} ' +
+                f'-show_entries packet=pts_time -of csv=p=0 {video_path}',
+                shell = True, executable = '/usr/bin/bash'
+            ).decode('utf-8').split()[0]
+            return min(max(float(keyframe_time_s) - start_time_s, 0), position_s)
+        except Exception:
+            return None
+
+    # Returns the index of the first frame at or after start_position_s. If start_position_s is past the last
+    # frame, returns 0, i.e. plays the video from the start.
+    def __get_first_frame_at_start_position(self, frame_timestamps, num_frames):
+        if not self.__start_position_s:
+            return 0
+        first_frame = bisect.bisect_left(frame_timestamps.get_all(), self.__start_position_s, hi = num_frames)
+        if first_frame >= num_frames:
+            self.__logger.warning('The start position is past the end of the video. Playing it from the start.')
+            return 0
+        return first_frame
+
+    # Reads one frame. Only call this once the fifo is readable.
+    # Returns True once ffmpeg is done outputting frames.
+    def __populate_frames(self, frames, ffmpeg_to_python_fifo, av_sync, bytes_per_frame):
+        # Read the frame straight into the frames buffer, without allocating anything.
+        write_slot = frames.get_write_slot()
+        num_bytes_read = 0
+        while num_bytes_read < bytes_per_frame:
+            num_bytes_read_this_call = ffmpeg_to_python_fifo.readinto(write_slot[num_bytes_read:])
+            if not num_bytes_read_this_call:
+                break
+            num_bytes_read += num_bytes_read_this_call
+
+        if num_bytes_read and num_bytes_read < bytes_per_frame:
+            raise Exception('Expected {} bytes from ffmpeg output, but got {}.'.format(bytes_per_frame, num_bytes_read))
+        if not num_bytes_read:
             self.__logger.info("no ffmpeg_output, end of video processing.")
-            if vid_start_time is None:
+            if not av_sync.is_started():
                 # under rare circumstances, yt-dlp might fail and we end up in this code path.
-                self.__logger.error("No vid_start_time set. Possible yt-dl crash. See: https://github.com/ytdl-org/youtube-dl/issues/24780")
-                vid_start_time = 0 # set this so that __process_and_play_video doesn't endlessly loop
-            return [True, vid_start_time]
+                self.__logger.error("Video clock not started. Possible yt-dl crash. See: https://github.com/ytdl-org/youtube-dl/issues/24780")
+                av_sync.start() # start it so that __process_and_play_video doesn't endlessly loop
+            return True
 
-        if vid_start_time is None:
-            # Start the video clock as soon as we see ffmpeg output. Ffplay probably sent its
+        if not av_sync.is_started():
+            # Start the video clock as soon as we see ffmpeg output. The audio player probably got its
             # first audio data at around the same time so they stay in sync.
-            # Add time for better audio / video sync
-            vid_start_time = time.time() + (0.075 if Config.get('video.should_play_audio') else 0)
+            av_sync.start()
+            self.__startup_timeline.mark(StartupTimeline.STAGE_FIRST_FRAME_DECODED)
 
-        frames.append(
-            np.frombuffer(ffmpeg_output, np.uint8).reshape(np_array_shape)
-        )
-        return [False, vid_start_time]
+        frames.commit_write()
+        if self.__transcode_cache_file:
+            self.__write_frame_to_transcode_cache(write_slot)
+        return False
+
+    # Reads whatever frame timestamps are available. Only call this once the fifo is readable. Returns True once
+    # ffmpeg is done outputting timestamps.
+    def __populate_frame_timestamps(self, frame_timestamps, timestamps_fifo):
+        data = timestamps_fifo.read(self.__TIMESTAMPS_READ_SIZE_BYTES)
+        if not data:
+            return True
+
+        frame_timestamps.feed(data)
+        if self.__transcode_cache_timestamps_file:
+            self.__transcode_cache_timestamps_file.write(data)
+        return False
+
+    def __write_frame_to_transcode_cache(self, frame_bytes):
+        self.__transcode_cache_num_bytes += len(frame_bytes)
+        if self.__transcode_cache_num_bytes > self.__transcode_cache.get_max_size_bytes():
+            self.__logger.info('Video is too big to fit in the transcode cache. Not caching it.')
+            self.__close_transcode_cache_files()
+            self.__transcode_cache.abandon_incomplete_entry(self.__transcode_cache_directory)
+            return
+        self.__transcode_cache_file.write(frame_bytes)
+
+    def __close_transcode_cache_files(self):
+        if self.__transcode_cache_file:
+            self.__transcode_cache_file.close()
+            self.__transcode_cache_file = None
+        if self.__transcode_cache_timestamps_file:
+            self.__transcode_cache_timestamps_file.close()
+            self.__transcode_cache_timestamps_file = None
 
     def __play_video(
-        self, frames, vid_start_time, frame_length, is_ffmpeg_done_outputting,
+        self, frames, frame_timestamps, av_sync, is_done_outputting,
         last_frame, vid_processing_lag_counter
     ):
-        cur_frame = max(math.floor((time.time() - vid_start_time) / frame_length), 0)
-        if cur_frame >= len(frames):
-            if is_ffmpeg_done_outputting:
-                self.__logger.info("Video done playing. Video processing lag counter: {}.".format(vid_processing_lag_counter))
-                return [True, cur_frame, vid_processing_lag_counter]
-            else:
-                vid_processing_lag_counter += 1
-                if vid_processing_lag_counter % 1000 == 0 or vid_processing_lag_counter == 1:
-                    self.__logger.error(
-                        f"Video processing is lagging. Counter: {vid_processing_lag_counter}. " +
-                        f"Frames available: {frames.unread_length()}."
-                    )
-                cur_frame = len(frames) - 1 # play the most recent frame we have
+        elapsed = av_sync.get_elapsed_s()
+        num_available_frames = min(len(frames), len(frame_timestamps))
+        cur_frame = self.__get_due_frame(frame_timestamps, num_available_frames, last_frame, elapsed)
+
+        next_frame = 0 if cur_frame is None else cur_frame + 1
+        if next_frame >= num_available_frames:
+            if is_done_outputting:
+                if elapsed >= frame_timestamps.get_end_time():
+                    self.__logger.info("Video done playing. Video processing lag counter: {}.".format(vid_processing_lag_counter))
+                    av_sync.log_stats()
+                    return [True, cur_frame, vid_processing_lag_counter]
+            elif cur_frame is not None:
+                # If we don't know the next frame's timestamp yet, it's due no earlier than the end of the last frame
+                # whose timestamp we know.
+                next_frame_time = frame_timestamps.get_end_time()
+                if next_frame < len(frame_timestamps):
+                    next_frame_time = frame_timestamps.get(next_frame)
+                if elapsed >= next_frame_time:
+                    vid_processing_lag_counter += 1
+                    if vid_processing_lag_counter % 1000 == 0 or vid_processing_lag_counter == 1:
+                        self.__logger.error(
+                            f"Video processing is lagging. Counter: {vid_processing_lag_counter}. " +
+                            f"Frames available: {frames.unread_length()}."
+                        )
 
         if cur_frame == last_frame:
             # We don't need to play a frame since we're still supposed to be playing the last frame we played
             return [False, cur_frame, vid_processing_lag_counter]
 
-        # Play the new frame
-        num_skipped_frames = 0
-        if last_frame is None:
-            if cur_frame != 0:
-                num_skipped_frames = cur_frame
-        elif cur_frame - last_frame > 1:
-            num_skipped_frames = cur_frame - last_frame - 1
+        self.__play_frame(frames, cur_frame, last_frame, av_sync, frame_timestamps.get(cur_frame), elapsed)
+        frame_timestamps.discard_before(cur_frame)
+        return [False, cur_frame, vid_processing_lag_counter]
+
+    # frame_time_s: when the frame is due. elapsed: how many seconds into the video we are.
+    # first_frame: the frame that playback started from.
+    def __play_frame(self, frames, cur_frame, last_frame, av_sync, frame_time_s, elapsed, first_frame = 0):
+        num_skipped_frames = cur_frame - (first_frame - 1 if last_frame is None else last_frame) - 1
         if num_skipped_frames > 0:
             self.__logger.error(
                 ("Video playing unable to keep up in real-time. Skipped playing {} frame(s)."
                     .format(num_skipped_frames))
             )
         self.__led_frame_player.play_frame(frames[cur_frame])
-        return [False, cur_frame, vid_processing_lag_counter]
+        av_sync.on_frame_played(elapsed - frame_time_s, max(num_skipped_frames, 0))
+        if last_frame is None:
+            self.__startup_timeline.mark(StartupTimeline.STAGE_FIRST_FRAME_PLAYED)
+            self.__startup_timeline.save()
 
-    def __get_process_and_play_vid_cmd(self, ffmpeg_to_python_fifo_name, fps_fifo_name):
-        video_save_path = self.__get_video_save_path()
-        vid_data_cmd = None
-        if self.__is_video_already_downloaded:
-            vid_data_cmd = '< {} '.format(shlex.quote(video_save_path))
-        else:
-            vid_data_cmd = self.__get_streaming_video_download_cmd() + ' | '
+        self.__playback_position_s = self.__playback_position_offset_s + frame_time_s
+        if time.monotonic() - self.__playback_position_save_time >= self.__PLAYBACK_POSITION_SAVE_INTERVAL_S:
+            self.__save_playback_position()
 
-        # Explanation of the FPS calculation pipeline:
-        #
-        # cat - >/dev/null: Prevent tee from exiting uncleanly (SIGPIPE) after ffprobe has finished probing.
-        #
-        # mbuffer: use mbuffer so that writes to ffprobe are not blocked by shell pipeline backpressure.
-        #   Note: ffprobe may need to read a number of bytes proportional to the video size, thus there may
-        #   be no buffer size that works for all videos (see: https://stackoverflow.com/a/70707003/627663 )
-        #   But our current buffer size works for videos that are ~24 hours long, so it's good enough in
-        #   most cases. Something fails for videos that are 100h+ long, but I believe it's unrelated to
-        #   mbuffer size -- those videos failed even with our old model of calculating FPS separately from
-        #   the video playback pipeline. See: https://github.com/yt-dlp/yt-dlp/issues/3390
-        #
-        # while true ... : The pipeline will wait until a signal is given (the existence of the __FPS_READY_FILE)
-        #   before data is emitted downstream. The signal will be given once the videoprocessor has finished
-        #   calculating the FPS of the video. The FPS is calculated by ffprobe and communicated to the
-        #   videoprocessor via the fps_fifo_name fifo.
-        ffprobe_cmd = f'ffprobe -v 0 -of csv=p=0 -select_streams v:0 -show_entries stream=r_frame_rate - > {fps_fifo_name}'
-        ffprobe_mbuffer = self.__get_mbuffer_cmd(1024 * 1024 * 50, '/tmp/mbuffer-ffprobe.out')
-        fps_cmd = (f'tee >( {ffprobe_cmd} && cat - >/dev/null ) | {ffprobe_mbuffer} | ' +
-            f'{{ while true ; do [ -f {self.__FPS_READY_FILE} ] && break || sleep 0.1 ; done && cat - ; }} | ')
-
-        maybe_play_audio_tee = ''
-        if Config.get('video.should_play_audio'):
-            # Add mbuffer because otherwise the ffplay command blocks the whole pipeline. Because
-            # audio can only play in real-time, this would block ffmpeg from processing the frames
-            # as fast as it otherwise could. This prevents us from building up a big enough buffer
-            # in the frames circular buffer to withstand blips in performance. This
-            # ensures the circular buffer will generally get filled, rather than lingering around
-            # only ~70 frames full. Makes it less likely that we will fall behind in video
-            # processing.
-            maybe_play_audio_tee = (">( " +
-                self.__get_mbuffer_cmd(1024 * 1024 * 10, '/tmp/mbuffer-ffplay.out') + ' | ' +
-                self.__get_ffplay_cmd() +
-                " ) ")
-
-        ffmpeg_tee = f'>( {self.__get_ffmpeg_pixel_conversion_cmd()} > {ffmpeg_to_python_fifo_name} ) '
-
-        maybe_save_video_tee = ''
-        maybe_mv_saved_video_cmd = ''
-        if Config.get('video.should_save_video') and not self.__is_video_already_downloaded:
-            self.__logger.info(f'Video will be saved to: {video_save_path}')
-            temp_video_save_path = video_save_path + self.__TEMP_VIDEO_DOWNLOAD_SUFFIX
-            maybe_save_video_tee = shlex.quote(temp_video_save_path) + ' '
-            maybe_mv_saved_video_cmd = '&& mv ' + shlex.quote(temp_video_save_path) + ' ' + shlex.quote(video_save_path)
+    # Records the playback position of videos played from the queue, so that a re-enqueued video resumes from there.
+    def __save_playback_position(self):
+        if self.__playlist is None or self.__playback_position_s is None:
+            return
+        self.__playback_position_save_time = time.monotonic()
+        try:
+            # Might result in: `sqlite3.OperationalError: database is locked`, when DB is under load
+            self.__playlist.set_playback_position(self.__playlist_video_id, self.__playback_position_s)
+        except Exception as e:
+            self.__logger.warning(f'Unable to save the playback position: {e}')
+
+    # Returns the index of the latest frame that is due to be played, elapsed seconds into the video. Only the first
+    # num_available_frames frames are considered. Returns last_frame if no later frame is due yet.
+    #
+    # first_frame: the frame to start playback from.
+    def __get_due_frame(self, frame_timestamps, num_available_frames, last_frame, elapsed, first_frame = 0):
+        due_frame = last_frame
+        next_frame = first_frame if last_frame is None else last_frame + 1
+        while next_frame < num_available_frames and frame_timestamps.get(next_frame) <= elapsed:
+            due_frame = next_frame
+            next_frame += 1
+        return due_frame
+
+    # Returns how many seconds into the video the frame after last_frame is due. Once we've played the last frame
+    # of the video, returns when it stops being displayed. Returns None if the next frame isn't available yet.
+    def __get_next_frame_time(
+        self, frame_timestamps, num_available_frames, last_frame, is_done_outputting, first_frame = 0
+    ):
+        next_frame = first_frame if last_frame is None else last_frame + 1
+        if next_frame < num_available_frames:
+            return frame_timestamps.get(next_frame)
+        if is_done_outputting:
+            return frame_timestamps.get_end_time()
+        return None
+
+    # transcode_cache_directory: if not None, the video's audio will be extracted into this directory, for
+    #   the transcode cache.
+    def __get_process_and_play_vid_cmd(
+        self, ffmpeg_to_python_fifo_name, timestamps_fifo_name, transcode_cache_directory = None
+    ):
+        ffmpeg_tee = (
+            '>( ' +
+            self.get_ffmpeg_pixel_conversion_cmd(timestamps_fifo_name, start_position_s = self.__get_stream_seek_s()) +
+            f' > {ffmpeg_to_python_fifo_name} ) '
+        )
+
+        # Copy the audio stream as is, without decoding it. Videos without audio will fail to produce an output
+        # file, so touch the done file regardless.
+        maybe_transcode_cache_audio_tee = ''
+        if transcode_cache_directory is not None:
+            audio_path = transcode_cache_directory + '/' + TranscodeCache.AUDIO_FILE_NAME
+            temp_audio_path = shlex.quote(audio_path + '.part')
+            audio_path = shlex.quote(audio_path)
+            audio_done_path = shlex.quote(transcode_cache_directory + '/' + TranscodeCache.AUDIO_DONE_FILE_NAME)
+            maybe_transcode_cache_audio_tee = (
+                f'>( {{ {self.get_standard_ffmpeg_cmd()} -i pipe:0 -vn -c:a copy -f matroska {temp_audio_path} ' +
+                f'&& mv {temp_audio_path} {audio_path} ; touch {audio_done_path} ; cat - >/dev/null ; }} ) '
+            )
 
+        maybe_save_video_tee, maybe_mv_saved_video_cmd = self.__get_save_video_tee()
         process_and_play_vid_cmd = (
             'set -o pipefail && export SHELLOPTS && ' +
-            vid_data_cmd + fps_cmd + "tee " +
-            maybe_play_audio_tee +
+            self.__get_vid_data_cmd() + "tee " +
+            self.__get_play_audio_tee() +
             ffmpeg_tee +
+            maybe_transcode_cache_audio_tee +
             maybe_save_video_tee +
             "> /dev/null " +
             maybe_mv_saved_video_cmd
         )
         return process_and_play_vid_cmd
 
+    # Streams the video to stdout, for decoding in-process. Also plays its audio and saves it, like
+    # __get_process_and_play_vid_cmd does.
+    def __get_download_vid_cmd(self):
+        maybe_save_video_tee, maybe_mv_saved_video_cmd = self.__get_save_video_tee()
+        return (
+            'set -o pipefail && export SHELLOPTS && ' +
+            self.__get_vid_data_cmd() + "tee " +
+            self.__get_play_audio_tee() +
+            maybe_save_video_tee +
+            maybe_mv_saved_video_cmd
+        )
+
+    # Returns the start of a pipeline that outputs the video, from the start position.
+    def __get_vid_data_cmd(self):
+        if self.__is_video_already_downloaded:
+            video_path = shlex.quote(self.__prefetched_video_path or self.__get_video_save_path())
+            if not self.__start_position_s:
+                return f'< {video_path} '
+
+            # Seek without re-encoding. Playback starts from the keyframe at or before the start position.
+            # See: __get_keyframe_time_before
+            return (f'{self.get_standard_ffmpeg_cmd()} -ss {self.__start_position_s} -i {video_path} ' +
+                "-c copy -map 0:v:0 -map '0:a:0?' -f mpegts - | ")
+        return self.get_streaming_video_download_cmd(
+            self.__url, self.__yt_dlp_extractors, startup_timeline = self.__startup_timeline,
+            info_json_path = self.__yt_dlp_info_json_path,
+            write_info_json_path = self.__yt_dlp_info_json_incomplete_path
+        ) + ' | '
+
+    # Streamed videos are downloaded from the start, even when resuming them, because the download is a byte stream
+    # that yt-dlp can't seek in without re-encoding it. Instead, each consumer of the stream (the pixel conversion,
+    # the audio player, and the in-process decoder) skips ahead to the start position, so that the video and audio
+    # both start exactly at it. Returns how far to skip, or None if the stream starts where playback does.
+    def __get_stream_seek_s(self):
+        if not self.__start_position_s or self.__is_video_already_downloaded:
+            return None
+        return self.__start_position_s
+
+    def __get_play_audio_tee(self):
+        if not Config.get('video.should_play_audio'):
+            return ''
+
+        # Add mbuffer because otherwise the audio player blocks the whole pipeline. Because
+        # audio can only play in real-time, this would block ffmpeg from processing the frames
+        # as fast as it otherwise could. This prevents us from building up a big enough buffer
+        # in the frames circular buffer to withstand blips in performance. This
+        # ensures the circular buffer will generally get filled, rather than lingering around
+        # only ~70 frames full. Makes it less likely that we will fall behind in video
+        # processing.
+        #
+        # ffplay can't seek in a pipe, so when resuming a stream, skip ahead by copying the audio from the start
+        # position. Audio packets can be cut anywhere, so this starts exactly at it.
+        maybe_seek_audio_cmd = ''
+        stream_seek_s = self.__get_stream_seek_s()
+        if stream_seek_s:
+            maybe_seek_audio_cmd = (f'{self.get_standard_ffmpeg_cmd()} -ss {stream_seek_s} -i pipe:0 ' +
+                '-vn -c:a copy -f matroska pipe:1 | ')
+        return (">( " +
+            self.__get_mbuffer_cmd(1024 * 1024 * 10, '/tmp/mbuffer-ffplay.out') + ' | ' +
+            maybe_seek_audio_cmd +
+            self.__get_play_audio_cmd() +
+            " ) ")
+
+    # Returns the tee argument to save the video, and the command to move it into place once it's fully saved.
+    def __get_save_video_tee(self):
+        if not Config.get('video.should_save_video') or self.__is_video_already_downloaded:
+            return ['', '']
+
+        video_save_path = self.__get_video_save_path()
+        self.__logger.info(f'Video will be saved to: {video_save_path}')
+        temp_video_save_path = video_save_path + self.__TEMP_VIDEO_DOWNLOAD_SUFFIX
+        return [
+            shlex.quote(temp_video_save_path) + ' ',
+            '&& mv ' + shlex.quote(temp_video_save_path) + ' ' + shlex.quote(video_save_path),
+        ]
+
     # Download the worst video and the best audio with yt-dlp, and mux them together with ffmpeg.
     # See: https://github.com/dasl-/piwall2/blob/53f5e0acf1894b71d180cee12ae49ddd3736d96a/docs/streaming_high_quality_videos_from_youtube-dl_to_stdout.adoc#solution-muxing-a-streaming-download
-    def __get_streaming_video_download_cmd(self):
+    #
+    # video_tmp_dir, audio_tmp_dir: directories for yt-dlp's temporary files. Processes that download videos
+    #   concurrently with the VideoProcessor (i.e. the Prefetcher) must pass their own, because VideoProcessor
+    #   housekeeping deletes the default ones.
+    #
+    # max_download_rate: string. If set, limits the download rate of each of the video and audio streams. Refer to
+    #   yt-dlp documentation for the '--limit-rate' flag for the format.
+    #
+    # startup_timeline: StartupTimeline. If set, marks when yt-dlp finishes extracting each stream. If the
+    #   video.should_record_first_byte_times config is also set, marks when each stream's first byte is downloaded.
+    #
+    # info_json_path: string. If set, yt-dlp loads the video's info from this file rather than extracting it.
+    #   See: YtDlpInfoCache
+    #
+    # write_info_json_path: string. If set, yt-dlp writes the video's info to this file. Must end with
+    #   YtDlpInfoCache.INFO_JSON_SUFFIX.
+    @staticmethod
+    def get_streaming_video_download_cmd(
+        url, yt_dlp_extractors = None, video_tmp_dir = None, audio_tmp_dir = None, max_download_rate = None,
+        startup_timeline = None, info_json_path = None, write_info_json_path = None
+    ):
+        video_tmp_dir = video_tmp_dir or VideoProcessor.__VIDEO_TMP_DIR
+        should_record_first_byte_times = (
+            startup_timeline is not None and Config.get('video.should_record_first_byte_times', False)
+        )
+        audio_tmp_dir = audio_tmp_dir or VideoProcessor.__AUDIO_TMP_DIR
+
         # --retries infinite: in case downloading has transient errors
-        yt_dlp_cmd_template = "mkdir -p {0} && cd {0} && yt-dlp {1} --retries infinite --format {2} --output - {3} | {4}"
+        yt_dlp_cmd_template = (
+            "mkdir -p {0} && cd {0} && yt-dlp {1} --retries infinite --format {2} --output - {3} | {4}{5}"
+        )
 
         log_opts = '--no-progress'
         if Logger.get_level() <= Logger.DEBUG:
@@ -335,8 +897,16 @@ class VideoProcessor:
             log_opts += ' --newline'
 
         use_extractors = ''
-        if self.__yt_dlp_extractors is not None:
-            use_extractors = f'--use-extractors {shlex.quote(self.__yt_dlp_extractors)}'
+        if yt_dlp_extractors is not None:
+            use_extractors = f'--use-extractors {shlex.quote(yt_dlp_extractors)}'
+
+        yt_dlp_input = shlex.quote(url)
+        if info_json_path is not None:
+            yt_dlp_input = f'--load-info-json {shlex.quote(info_json_path)}'
+
+        limit_rate = ''
+        if max_download_rate is not None:
+            limit_rate = f'--limit-rate {shlex.quote(str(max_download_rate))}'
 
         # 50 MB. Based on one video, 1080p avc1 video consumes about 0.36 MB/s. So this should
         # be enough buffer for ~139s for a 1080p video, which is a lot higher resolution than we
@@ -363,21 +933,44 @@ class VideoProcessor:
         # See: https://gist.github.com/dasl-/967bf1e2f7d53609b2d5b5418ce76851
         video_format_sort = "--format-sort 'quality, res, +fps'"
 
-        video_extra_opts = f' {log_opts} {use_extractors} {video_format_sort} '
+        video_extra_opts = f' {log_opts} {use_extractors} {limit_rate} {video_format_sort} '
+        if write_info_json_path is not None:
+            # yt-dlp appends the suffix to the output template, which is also why `%` must be escaped.
+            info_json_template = write_info_json_path.removesuffix(YtDlpInfoCache.INFO_JSON_SUFFIX).replace('%', '%%')
+            video_extra_opts += f"--write-info-json --output {shlex.quote('infojson:' + info_json_template)} "
+        video_first_byte_marker = ''
+        if startup_timeline is not None:
+            video_extra_opts += VideoProcessor.__get_yt_dlp_startup_marker_opts(
+                startup_timeline, StartupTimeline.STAGE_YT_DLP_VIDEO_EXTRACTED
+            )
+        if should_record_first_byte_times:
+            video_first_byte_marker = VideoProcessor.__get_first_byte_marker_cmd(
+                startup_timeline, StartupTimeline.STAGE_FIRST_VIDEO_BYTE
+            )
         yt_dlp_video_cmd = yt_dlp_cmd_template.format(
-            shlex.quote(self.__VIDEO_TMP_DIR),
-            shlex.quote(self.__url),
+            shlex.quote(video_tmp_dir),
+            yt_dlp_input,
             shlex.quote(video_format),
             video_extra_opts,
-            self.__get_mbuffer_cmd(video_buffer_size)
+            video_first_byte_marker,
+            VideoProcessor.__get_mbuffer_cmd(video_buffer_size)
         )
 
         # Also use a 50MB buffer, because in some cases, the audio stream we download may also contain video.
         audio_buffer_size = 1024 * 1024 * 50
-        audio_extra_opts = f' {log_opts} {use_extractors} '
+        audio_extra_opts = f' {log_opts} {use_extractors} {limit_rate} '
+        audio_first_byte_marker = ''
+        if startup_timeline is not None:
+            audio_extra_opts += VideoProcessor.__get_yt_dlp_startup_marker_opts(
+                startup_timeline, StartupTimeline.STAGE_YT_DLP_AUDIO_EXTRACTED
+            )
+        if should_record_first_byte_times:
+            audio_first_byte_marker = VideoProcessor.__get_first_byte_marker_cmd(
+                startup_timeline, StartupTimeline.STAGE_FIRST_AUDIO_BYTE
+            )
         yt_dlp_audio_cmd = yt_dlp_cmd_template.format(
-            shlex.quote(self.__AUDIO_TMP_DIR),
-            shlex.quote(self.__url),
+            shlex.quote(audio_tmp_dir),
+            yt_dlp_input,
             # bestaudio: try to select the best audio-only format
             # bestaudio*: this is the fallback option -- select the best quality format that contains audio.
             #   It may also contain video, e.g. in the case that there are no audio-only formats available.
@@ -385,28 +978,90 @@ class VideoProcessor:
             #   fail for them.
             shlex.quote('bestaudio/bestaudio*'),
             audio_extra_opts,
-            self.__get_mbuffer_cmd(audio_buffer_size)
+            audio_first_byte_marker,
+            VideoProcessor.__get_mbuffer_cmd(audio_buffer_size)
         )
 
         # Mux video from the first input with audio from the second input: https://stackoverflow.com/a/12943003/627663
         # We need to specify, because in some cases, either input could contain both audio and video. But in most
         # cases, the first input will have only video, and the second input will have only audio.
-        return (f"{self.get_standard_ffmpeg_cmd()} -i <({yt_dlp_video_cmd}) -i <({yt_dlp_audio_cmd}) " +
+        return (f"{VideoProcessor.get_standard_ffmpeg_cmd()} -i <({yt_dlp_video_cmd}) -i <({yt_dlp_audio_cmd}) " +
             "-c copy -map 0:v:0 -map 1:a:0 -shortest -f mpegts -")
 
-    def __get_ffmpeg_pixel_conversion_cmd(self):
-        pix_fmt = 'gray'
-        if VideoColorMode.is_color_mode_rgb(Config.get('video.color_mode')):
-            pix_fmt = 'rgb24'
+    # Runs the marker command once yt-dlp has extracted the video info, right before it starts downloading.
+    @staticmethod
+    def __get_yt_dlp_startup_marker_opts(startup_timeline, stage):
+        # yt-dlp treats the command as an output template. Escape the `%` of the marker command, and reference a
+        # field in a trailing comment: otherwise yt-dlp would append the output file name to the command.
+        exec_cmd = startup_timeline.get_marker_cmd(stage).replace('%', '%%') + ' # %(id)s'
+        return f" --exec {shlex.quote('before_dl:' + exec_cmd)} "
+
+    # Passes its input through, running the marker command once the first byte has been read. This costs an extra
+    # process and copy of the stream, which is why it's opt in.
+    @staticmethod
+    def __get_first_byte_marker_cmd(startup_timeline, stage):
+        return f'{{ dd bs=1 count=1 status=none && {startup_timeline.get_marker_cmd(stage)} ; cat ; }} | '
+
+    # color_mode: if set, returns the pixel format for this color mode rather than the configured one.
+    @staticmethod
+    def get_pix_fmt(color_mode = None):
+        if VideoColorMode.is_color_mode_rgb(color_mode or Config.get('video.color_mode')):
+            return 'rgb24'
+        return 'gray'
+
+    # Scales the video down to the LED matrix size, and outputs its frames in the pixel format for the color mode.
+    # Also outputs the frames' timestamps, in framecrc format, to timestamps_output. See: FrameTimestamps
+    #
+    # num_threads: if set, limits how many threads ffmpeg uses for decoding and scaling.
+    # pix_fmt: if set, outputs frames in this pixel format rather than the one for the configured color mode.
+    # start_position_s: if set, skips this many seconds into the input. Frames before it are decoded and dropped, so
+    #   this works for piped input too, and output starts exactly at it.
+    @staticmethod
+    def get_ffmpeg_pixel_conversion_cmd(
+        timestamps_output, input_path = 'pipe:0', frames_output = 'pipe:1', num_threads = None, pix_fmt = None,
+        start_position_s = None
+    ):
+        pix_fmt = shlex.quote(pix_fmt or VideoProcessor.get_pix_fmt())
+        scale = f"scale={Config.get_or_throw('leds.display_width')}x{Config.get_or_throw('leds.display_height')}"
+        threads_opts = ''
+        if num_threads is not None:
+            threads_opts = f'-threads {num_threads} -filter_complex_threads {num_threads} '
+        seek_opts = ''
+        if start_position_s:
+            seek_opts = f'-ss {start_position_s} '
+
+        return (
+            VideoProcessor.get_standard_ffmpeg_cmd() + ' ' + threads_opts + seek_opts +
+            f'-i {input_path} ' +
+            # resize video, and make a copy of each frame for each of the outputs
+            '-filter_complex ' + shlex.quote(f'[0:v:0]{scale},format={pix_fmt},split[frames][timestamps]') + ' ' +
+            # Keep each frame's timestamp, rather than dropping or duplicating frames to reach a constant frame rate.
+            '-vsync passthrough ' +
+            f"-map '[frames]' -f rawvideo -pix_fmt {pix_fmt} {frames_output} " + # output in numpy compatible byte format
+            # Write each frame's timestamp as soon as the frame is output.
+            f"-map '[timestamps]' -c:v rawvideo -flush_packets 1 -f framecrc {timestamps_output}"
+        )
 
+    # Writes the files of a transcode cache entry for a downloaded video, like the VideoProcessor does while playing
+    # a video. Audio is optional; videos without audio will fail to produce an audio file. See:
+    # TranscodeCache.finish_transcoded_entry
+    @staticmethod
+    def get_transcode_cmd(video_path, transcode_cache_directory, pix_fmt = None, num_threads = None):
+        video_path = shlex.quote(video_path)
+        frames_path = shlex.quote(transcode_cache_directory + '/' + TranscodeCache.FRAMES_FILE_NAME)
+        timestamps_path = shlex.quote(transcode_cache_directory + '/' + TranscodeCache.FRAME_TIMESTAMPS_FILE_NAME)
+        audio_path = transcode_cache_directory + '/' + TranscodeCache.AUDIO_FILE_NAME
+        temp_audio_path = shlex.quote(audio_path + '.part')
+        audio_path = shlex.quote(audio_path)
+        audio_done_path = shlex.quote(transcode_cache_directory + '/' + TranscodeCache.AUDIO_DONE_FILE_NAME)
+        pixel_conversion_cmd = VideoProcessor.get_ffmpeg_pixel_conversion_cmd(
+            timestamps_path, input_path = video_path, frames_output = frames_path, num_threads = num_threads,
+            pix_fmt = pix_fmt
+        )
         return (
-            self.get_standard_ffmpeg_cmd() + ' '
-            '-i pipe:0 ' + # read input video from stdin
-            '-filter:v ' + shlex.quote( # resize video
-                'scale=' + str(Config.get_or_throw('leds.display_width')) + 'x' + str(Config.get_or_throw('leds.display_height'))) + " "
-            '-c:a copy ' + # don't process the audio at all
-            '-f rawvideo -pix_fmt ' + shlex.quote(pix_fmt) + " " # output in numpy compatible byte format
-            'pipe:1' # output to stdout
+            f'{pixel_conversion_cmd} && ' +
+            f'{{ {VideoProcessor.get_standard_ffmpeg_cmd()} -i {video_path} -vn -c:a copy -f matroska {temp_audio_path} && ' +
+            f'mv {temp_audio_path} {audio_path} ; touch {audio_done_path} ; }}'
         )
 
     @staticmethod
@@ -425,40 +1080,34 @@ class VideoProcessor:
         # https://gist.github.com/dasl-/1ad012f55f33f14b44393960f66c6b00
         return f"ffmpeg -hide_banner {log_opts} "
 
-    def __get_ffplay_cmd(self):
+    # Plays the audio with ffplay. If the video is synced to the audio, decodes the audio for the AudioSink instead.
+    #
+    # start_position_s: if set, seeks this many seconds into the input.
+    def __get_play_audio_cmd(self, input_path = 'pipe:0', start_position_s = None):
+        seek_opts = f'-ss {start_position_s} ' if start_position_s else ''
+        if self.__audio_sink:
+            return (f'{self.get_standard_ffmpeg_cmd()} {seek_opts}-i {input_path} ' +
+                f'{AudioSink.get_ffmpeg_output_args()} > {shlex.quote(self.__audio_fifo_name)}')
+        return self.__get_ffplay_cmd(input_path, seek_opts)
+
+    def __get_ffplay_cmd(self, input_path = 'pipe:0', seek_opts = ''):
         return (
             "ffplay " +
             "-nodisp " + # Disable graphical display.
             "-vn " + # Disable video
             "-autoexit " + # Exit when video is done playing
-            "-i pipe:0 " + # play input from stdin
+            seek_opts +
+            f"-i {input_path} " + # play input from stdin, by default
             "-v quiet" # supress verbose ffplay output
         )
 
-    def __get_mbuffer_cmd(self, buffer_size_bytes, log_file = None):
+    @staticmethod
+    def __get_mbuffer_cmd(buffer_size_bytes, log_file = None):
         log_file_clause = ' -Q '
         if log_file:
             log_file_clause = f' -l {log_file} '
         return f'mbuffer -q {log_file_clause} -m ' + shlex.quote(str(buffer_size_bytes)) + 'b'
 
-    def __read_fps_from_fifo(self, fps_fifo_name):
-        fps = None
-        try:
-            fps_fifo = open(fps_fifo_name, 'r')
-            # Need to call .read() rather than .readline() because in some cases, the output could
-            # contain multiple lines. We're only interested in the first line. Closing the fifo
-            # after only reading the first line when it has multi-line output would result in
-            # SIGPIPE errors
-            fps_parts = fps_fifo.read().splitlines()[0].strip().split('/')
-            fps_fifo.close()
-            fps = float(fps_parts[0]) / float(fps_parts[1])
-        except Exception as ex:
-            self.__logger.error("Got an error determining the fps: " + str(ex))
-            self.__logger.error("Assuming 30 fps for this video.")
-            fps = 30
-        self.__logger.info(f'Calculated video fps: {fps}')
-        return fps
-
     def __make_fifo(self, additional_prefix = None):
         prefix = self.__FIFO_PREFIX + '__'
         if additional_prefix:
@@ -503,12 +1152,30 @@ class VideoProcessor:
             except Exception:
                 # might raise: `ProcessLookupError: [Errno 3] No such process`
                 pass
+            self.__process_and_play_vid_proc_pgid = None
+
+        if self.__audio_sink:
+            self.__audio_sink.stop()
+            self.__audio_sink = None
+
+        # E.g. if we're being killed because the video is being preempted by a game.
+        self.__save_playback_position()
+
+        self.__close_transcode_cache_files()
+        if self.__transcode_cache:
+            self.__transcode_cache.delete_incomplete_entries()
+
+        # yt-dlp writes the info before it starts downloading, so it's worth caching even if playback was cut short.
+        if self.__yt_dlp_info_json_incomplete_path:
+            self.__yt_dlp_info_cache.finish_entry(self.__url, self.__yt_dlp_info_json_incomplete_path)
+            self.__yt_dlp_info_json_incomplete_path = None
 
-        self.__logger.info(f"Deleting fifos, temp dirs, incomplete video downloads, and {self.__FPS_READY_FILE} ...")
+        self.__logger.info("Deleting fifos, temp dirs, and incomplete video downloads...")
         fifos_path_glob = shlex.quote(tempfile.gettempdir() + "/" + self.__FIFO_PREFIX) + '*'
         incomplete_video_downloads_path_glob = f'*{shlex.quote(self.__TEMP_VIDEO_DOWNLOAD_SUFFIX)}'
-        cleanup_files_cmd = (f'sudo rm -rf {fifos_path_glob} {incomplete_video_downloads_path_glob} ' +
-            f'{self.__FPS_READY_FILE} {self.__VIDEO_TMP_DIR} {self.__AUDIO_TMP_DIR}')
+        startup_markers_path_glob = shlex.quote(StartupTimeline.get_markers_file_path_prefix()) + '*'
+        cleanup_files_cmd = (f'sudo rm -rf {fifos_path_glob} {startup_markers_path_glob} ' +
+            f'{incomplete_video_downloads_path_glob} {self.__VIDEO_TMP_DIR} {self.__AUDIO_TMP_DIR}')
         subprocess.check_output(cleanup_files_cmd, shell = True, executable = '/usr/bin/bash')
 
     def __register_signal_handlers(self):
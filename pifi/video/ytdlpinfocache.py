@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+from pifi.config import Config
+from pifi.directoryutils import DirectoryUtils
+from pifi.logger import Logger
+import pifi.database
+
+"""
+The yt-dlp info cache stores the info JSON that yt-dlp extracts for a video: its metadata and the list of formats,
+including their direct media urls. Replaying a cached video feeds the info JSON to yt-dlp via `--load-info-json`,
+which skips fetching and parsing the video page, so both the video and the audio download start immediately.
+
+Direct media urls expire. YouTube's urls carry an `expire` timestamp, and a download may re-request byte ranges
+for as long as it runs, so an entry expires once its urls wouldn't outlast a full download of the video. Entries also
+expire after a maximum age, because the formats available for a video may change.
+"""
+class YtDlpInfoCache:
+
+    INFO_JSON_SUFFIX = '.info.json'
+
+    __DIRECTORY = 'data/yt_dlp_info'
+    __INCOMPLETE_SUFFIX = '.part'
+
+    __DEFAULT_MAX_AGE_S = 6 * 60 * 60
+
+    # Stream urls must stay valid for this long after the video's duration, to allow for slow downloads.
+    __URL_EXPIRY_MARGIN_S = 10 * 60
+
+    # E.g. `...&expire=1700000000&...` in a url's query string, or `.../expire/1700000000/...` in its path.
+    __URL_EXPIRE_REGEX = re.compile(r'[?&/]expire[=/](\d+)')
+
+    def __init__(self):
+        self.__cursor = pifi.database.Database().get_cursor()
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+
+    def construct(self):
+        self.__cursor.execute("DROP TABLE IF EXISTS yt_dlp_info_cache")
+        self.__cursor.execute("""
+            CREATE TABLE yt_dlp_info_cache (
+                cache_key VARCHAR(200) PRIMARY KEY,
+                url TEXT,
+                expire_time INTEGER,
+                create_date DATETIME DEFAULT CURRENT_TIMESTAMP
+            )""")
+
+    @staticmethod
+    def is_enabled():
+        return Config.get('video.yt_dlp_info_cache.enabled', False)
+
+    # Returns the path of the cached info JSON for the video, or None if there is no fresh entry.
+    def get_info_json_path(self, url):
+        cache_key = self.__get_cache_key(url)
+        self.__cursor.execute("SELECT * FROM yt_dlp_info_cache WHERE cache_key = ?", [cache_key])
+        entry = self.__cursor.fetchone()
+        if entry is None:
+            return None
+
+        info_json_path = self.__get_info_json_path(cache_key)
+        if entry['expire_time'] <= time.time() or not os.path.isfile(info_json_path):
+            self.__delete_entry(cache_key)
+            return None
+        return info_json_path
+
+    # Returns a path for yt-dlp to write a new entry's info JSON to. The path includes our pid, in case more than one
+    # process writes the same entry at once.
+    def make_incomplete_info_json_path(self, url):
+        directory = self.__get_directory()
+        os.makedirs(directory, exist_ok = True)
+        return (
+            f'{directory}/{self.__get_cache_key(url)}.{os.getpid()}{self.__INCOMPLETE_SUFFIX}{self.INFO_JSON_SUFFIX}'
+        )
+
+    # Adds the info JSON that yt-dlp wrote to incomplete_info_json_path to the cache, unless its urls are about to
+    # expire. Also deletes expired entries.
+    def finish_entry(self, url, incomplete_info_json_path):
+        try:
+            with open(incomplete_info_json_path) as info_json_file:
+                info = json.load(info_json_file)
+        except FileNotFoundError:
+            self.__logger.info('yt-dlp did not write an info JSON. Not caching it.')
+            return
+        except ValueError:
+            self.__logger.warning('Unable to parse the info JSON that yt-dlp wrote. Not caching it.')
+            os.remove(incomplete_info_json_path)
+            return
+
+        expire_time = self.__get_expire_time(info)
+        if expire_time is None:
+            os.remove(incomplete_info_json_path)
+            return
+
+        cache_key = self.__get_cache_key(url)
+        os.replace(incomplete_info_json_path, self.__get_info_json_path(cache_key))
+        self.__cursor.execute(
+            "INSERT OR REPLACE INTO yt_dlp_info_cache (cache_key, url, expire_time) VALUES(?, ?, ?)",
+            [cache_key, url, expire_time]
+        )
+        self.__logger.info(f'Cached yt-dlp info for {url} for {round(expire_time - time.time())} s.')
+        self.__delete_expired_entries()
+        self.__delete_abandoned_incomplete_entries()
+
+    # E.g. if the cached info JSON led to a failed download.
+    def delete_entry(self, url):
+        self.__delete_entry(self.__get_cache_key(url))
+
+    # Returns None if the info shouldn't be cached at all.
+    def __get_expire_time(self, info):
+        if info.get('is_live'):
+            # Live streams' urls are short lived, and they have no duration to plan around.
+            self.__logger.info('Not caching yt-dlp info for live stream.')
+            return None
+
+        expire_time = int(time.time()) + Config.get('video.yt_dlp_info_cache.max_age_s', self.__DEFAULT_MAX_AGE_S)
+        duration = info.get('duration') or 0
+        for video_format in info.get('formats') or []:
+            match = self.__URL_EXPIRE_REGEX.search(video_format.get('url') or '')
+            if match:
+                expire_time = min(expire_time, int(match.group(1)) - int(duration) - self.__URL_EXPIRY_MARGIN_S)
+
+        if expire_time <= time.time():
+            self.__logger.info("Not caching yt-dlp info, because its urls expire before we'd be done downloading.")
+            return None
+        return expire_time
+
+    def __delete_expired_entries(self):
+        self.__cursor.execute("SELECT cache_key FROM yt_dlp_info_cache WHERE expire_time <= ?", [int(time.time())])
+        for entry in self.__cursor.fetchall():
+            self.__delete_entry(entry['cache_key'])
+
+    # Incomplete entries are normally finished or deleted by the process that wrote them, unless it was killed.
+    def __delete_abandoned_incomplete_entries(self):
+        directory = self.__get_directory()
+        max_age_s = Config.get('video.yt_dlp_info_cache.max_age_s', self.__DEFAULT_MAX_AGE_S)
+        for name in os.listdir(directory):
+            if not name.endswith(self.__INCOMPLETE_SUFFIX + self.INFO_JSON_SUFFIX):
+                continue
+            path = directory + '/' + name
+            if os.path.getmtime(path) < time.time() - max_age_s:
+                os.remove(path)
+
+    def __delete_entry(self, cache_key):
+        try:
+            os.remove(self.__get_info_json_path(cache_key))
+        except FileNotFoundError:
+            pass
+        self.__cursor.execute("DELETE FROM yt_dlp_info_cache WHERE cache_key = ?", [cache_key])
+
+    def __get_info_json_path(self, cache_key):
+        return self.__get_directory() + '/' + cache_key + self.INFO_JSON_SUFFIX
+
+    def __get_cache_key(self, url):
+        return hashlib.md5(url.encode('utf-8')).hexdigest()
+
+    def __get_directory(self):
+        return DirectoryUtils().root_dir + '/' + self.__DIRECTORY
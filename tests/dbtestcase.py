@@ -0,0 +1,36 @@
+"""
+Base TestCase for tests that use the DB or the config.
+
+Each test gets its own temporary directory and DB, which are deleted after the test.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from pifi.config import Config
+import pifi.database
+from pifi.database import Database
+
+
+class DbTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.db_path = os.path.join(self.tmp_dir, 'pifi.db')
+
+        self._patch(mock.patch.object(Database, '_Database__DB_PATH', self.db_path))
+        # Each thread reuses its DB cursor, so make sure we don't reuse one from a previous test's DB.
+        self._patch(mock.patch.object(pifi.database.thread_local, 'database_cursor', None, create = True))
+
+    # Starts patcher, and stops it after the test.
+    def _patch(self, patcher):
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _set_config(self, config):
+        Config._Config__is_loaded = True
+        Config._Config__config = config
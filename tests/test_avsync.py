@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Unit tests for AvSync, the video clock that follows the audio's playback
+position, and AudioSink, which reports that position.
+
+Covers:
+- running on the wall clock without audio
+- holding the first frame until the audio starts
+- correcting small drift gradually, and large drift all at once
+- falling back to the wall clock when there is no audio
+- counting the audio that the player has consumed
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.video.audiosink import AudioSink
+from pifi.video.avsync import AvSync
+
+
+class FakeAudioSink:
+
+    def __init__(self):
+        self.position_s = None
+        self.done = False
+
+    def get_position_s(self):
+        return self.position_s
+
+    def is_done(self):
+        return self.done
+
+
+class TestAvSync(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch('time.monotonic', side_effect = lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_wall_clock(self):
+        av_sync = AvSync(start_delay_s = 0.075)
+        self.assertFalse(av_sync.is_started())
+        av_sync.start()
+        self.assertEqual(av_sync.get_elapsed_s(), 0)
+        self.now += 1.075
+        self.assertAlmostEqual(av_sync.get_elapsed_s(), 1)
+        self.assertAlmostEqual(av_sync.get_wait_s(1.5), 0.5)
+
+    def test_holds_until_audio_starts(self):
+        audio_sink = FakeAudioSink()
+        av_sync = AvSync(audio_sink, start_delay_s = 0.075)
+        av_sync.start()
+        self.now += 1
+        self.assertEqual(av_sync.get_elapsed_s(), 0)
+        audio_sink.position_s = 0
+        self.now += 1
+        self.assertEqual(av_sync.get_elapsed_s(), 0)
+
+        audio_sink.position_s = 0.5
+        self.now += 0.5
+        self.assertAlmostEqual(av_sync.get_elapsed_s(), 0.5)
+
+        # Poll the audio, rather than trusting the wall clock for long.
+        self.assertEqual(av_sync.get_wait_s(10), 0.05)
+
+    def test_corrects_small_drift_gradually(self):
+        audio_sink = FakeAudioSink()
+        av_sync = AvSync(audio_sink)
+        av_sync.start()
+        audio_sink.position_s = 0.01
+        av_sync.get_elapsed_s()
+
+        # The audio is falling behind: 1 s of wall time, but 0.9 s of audio.
+        self.now += 1
+        audio_sink.position_s = 0.91
+        # The video is 0.09 s ahead, but the clock only slows down by 5%.
+        self.assertAlmostEqual(av_sync.get_elapsed_s(), 0.95)
+        self.assertEqual(av_sync.get_stats()['num_resyncs'], 0)
+
+    def test_resyncs_large_drift(self):
+        audio_sink = FakeAudioSink()
+        av_sync = AvSync(audio_sink)
+        av_sync.start()
+        audio_sink.position_s = 0.01
+        av_sync.get_elapsed_s()
+
+        # The audio stalled.
+        self.now += 2
+        self.assertAlmostEqual(av_sync.get_elapsed_s(), 0.01)
+        av_sync.on_frame_played(0.002, 0)
+
+        # The video fell behind.
+        self.now += 0.5
+        audio_sink.position_s = 1.5
+        self.assertAlmostEqual(av_sync.get_elapsed_s(), 1.5)
+        av_sync.on_frame_played(0.001, 30)
+
+        stats = av_sync.get_stats()
+        self.assertEqual(stats['num_resyncs'], 2)
+        self.assertEqual(stats['num_frames_played'], 2)
+        self.assertEqual(stats['num_dropped_frames'], 30)
+        self.assertEqual(stats['max_abs_drift_s'], 1.99)
+
+    def test_no_audio(self):
+        audio_sink = FakeAudioSink()
+        audio_sink.done = True
+        av_sync = AvSync(audio_sink)
+        av_sync.start()
+        self.now += 1
+        self.assertAlmostEqual(av_sync.get_elapsed_s(), 1)
+        self.assertAlmostEqual(av_sync.get_wait_s(3), 2)
+
+    def test_audio_start_timeout(self):
+        av_sync = AvSync(FakeAudioSink())
+        av_sync.start()
+        self.now += 1
+        self.assertEqual(av_sync.get_elapsed_s(), 0)
+        self.now += 3
+        self.assertEqual(av_sync.get_elapsed_s(), 0)
+        self.now += 1
+        self.assertAlmostEqual(av_sync.get_elapsed_s(), 1)
+
+
+class TestAudioSink(unittest.TestCase):
+
+    BYTES_PER_S = AudioSink.SAMPLE_RATE * AudioSink.NUM_CHANNELS * 2
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.fifo_name = os.path.join(self.tmp_dir, 'pcm')
+        os.mkfifo(self.fifo_name)
+
+    def _start(self, player_cmd):
+        patcher = mock.patch.object(AudioSink, '_AudioSink__get_player_cmd', return_value = player_cmd)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        audio_sink = AudioSink(self.fifo_name)
+        audio_sink.start()
+        self.addCleanup(audio_sink.stop)
+        return audio_sink
+
+    def _wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_audio_in_the_pipe_has_not_been_played(self):
+        # A player that doesn't read anything yet.
+        audio_sink = self._start(['sleep', '30'])
+        self.assertIsNone(audio_sink.get_position_s())
+        with open(self.fifo_name, 'wb') as pcm_fifo:
+            # Longer than the sound card's buffer, but fits in the pipe.
+            pcm_fifo.write(b'\0' * 48 * 1024)
+            pcm_fifo.flush()
+            self._wait_for(lambda: audio_sink.get_position_s() is not None)
+            self.assertEqual(audio_sink.get_position_s(), 0)
+
+    def test_played_audio(self):
+        audio_sink = self._start(['sh', '-c', 'cat > /dev/null'])
+        with open(self.fifo_name, 'wb') as pcm_fifo:
+            pcm_fifo.write(b'\0' * self.BYTES_PER_S)
+        self._wait_for(audio_sink.is_done)
+        self.assertEqual(audio_sink.get_duration_s(), 1)
+
+        # All but the sound card's buffer has been played.
+        self.assertAlmostEqual(audio_sink.get_position_s(), 0.9)
+
+    def test_stop_without_audio(self):
+        audio_sink = self._start(['sh', '-c', 'cat > /dev/null'])
+        audio_sink.stop()
+        self._wait_for(audio_sink.is_done)
+        self.assertIsNone(audio_sink.get_position_s())
+
+
+if __name__ == '__main__':
+    unittest.main()
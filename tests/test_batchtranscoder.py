@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Unit tests for BatchTranscoder, which adds batches of videos to the transcode
+cache ahead of time.
+
+Covers:
+- reading urls from the command line and a playlist file
+- transcoding local files for each pixel format, several at a time
+- skipping videos that are already cached, so that batches can be resumed
+- cleaning up after videos that fail to transcode
+"""
+
+import os
+import shlex
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.directoryutils import DirectoryUtils
+from pifi.video.batchtranscoder import BatchTranscoder
+from pifi.video.transcodecache import TranscodeCache
+from pifi.video.videocolormode import VideoColorMode
+from pifi.video.videoprocessor import VideoProcessor
+
+from tests.dbtestcase import DbTestCase
+
+WIDTH = 4
+HEIGHT = 2
+NUM_FRAMES = 30
+
+
+# Stands in for ffmpeg: writes a transcode cache entry with NUM_FRAMES frames at 30 fps, unless the video's file
+# name starts with 'bad'.
+def fake_transcode_cmd(video_path, transcode_cache_directory, pix_fmt = None, num_threads = None):
+    if os.path.basename(video_path).startswith('bad'):
+        return 'exit 1'
+    bytes_per_frame = WIDTH * HEIGHT * (3 if pix_fmt == 'rgb24' else 1)
+    timestamps = '#tb 0: 1/30\\n' + ''.join(f'0, {i}, {i}, 1, {bytes_per_frame}, 0x0\\n' for i in range(NUM_FRAMES))
+    directory = shlex.quote(transcode_cache_directory)
+    return (
+        f'head -c {bytes_per_frame * NUM_FRAMES} /dev/zero > {directory}/{TranscodeCache.FRAMES_FILE_NAME} && ' +
+        f"printf '{timestamps}' > {directory}/{TranscodeCache.FRAME_TIMESTAMPS_FILE_NAME} && " +
+        f'touch {directory}/{TranscodeCache.AUDIO_DONE_FILE_NAME}'
+    )
+
+
+class TestBatchTranscoder(DbTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self._set_config({
+            'leds': {'display_width': WIDTH, 'display_height': HEIGHT},
+            'video': {'color_mode': 'color', 'transcode_cache': {'enabled': True}},
+        })
+
+        def set_root_dir(directory_utils):
+            directory_utils.root_dir = self.tmp_dir
+        self._patch(mock.patch.object(DirectoryUtils, '__init__', set_root_dir))
+        self._patch(mock.patch.object(VideoProcessor, 'get_transcode_cmd', side_effect = fake_transcode_cmd))
+        TranscodeCache().construct()
+
+    def _make_video(self, name):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as video_file:
+            video_file.write(b'video')
+        return path
+
+    def test_read_urls(self):
+        playlist_file = os.path.join(self.tmp_dir, 'playlist.txt')
+        with open(playlist_file, 'w') as file:
+            file.write('# party\nhttps://youtu.be/a\n\n  https://youtu.be/b  \nhttps://youtu.be/c\n')
+        self.assertEqual(
+            BatchTranscoder.read_urls(['https://youtu.be/c', 'https://youtu.be/a'], playlist_file),
+            ['https://youtu.be/c', 'https://youtu.be/a', 'https://youtu.be/b']
+        )
+
+    def test_transcodes_each_pixel_format_and_skips_cached_videos(self):
+        videos = [self._make_video(f'video{i}.mp4') for i in range(3)]
+        stats = BatchTranscoder(2).run(videos)
+        self.assertEqual(stats['num_transcoded'], 3)
+        self.assertEqual(stats['num_frames'], 3 * 2 * NUM_FRAMES)
+        self.assertAlmostEqual(stats['video_duration_s'], 3)
+
+        transcode_cache = TranscodeCache()
+        for video in videos:
+            for pix_fmt in ['rgb24', 'gray']:
+                entry = transcode_cache.get_entry(video, pix_fmt)
+                self.assertEqual(entry['num_frames'], NUM_FRAMES)
+                self.assertEqual(entry['fps'], 30)
+
+        # Resuming the batch only transcodes what's missing.
+        videos.append(self._make_video('video3.mp4'))
+        stats = BatchTranscoder(2).run(videos)
+        self.assertEqual(stats['num_skipped'], 3)
+        self.assertEqual(stats['num_transcoded'], 1)
+
+        # Color modes that share a pixel format share an entry.
+        stats = BatchTranscoder(2, [VideoColorMode.COLOR_MODE_BW, VideoColorMode.COLOR_MODE_R]).run(videos)
+        self.assertEqual(stats['num_skipped'], 4)
+
+    def test_failed_video(self):
+        videos = [self._make_video('bad.mp4'), self._make_video('good.mp4')]
+        stats = BatchTranscoder(1, [VideoColorMode.COLOR_MODE_COLOR]).run(videos)
+        self.assertEqual(stats['num_failed'], 1)
+        self.assertEqual(stats['num_transcoded'], 1)
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'data/transcodes')), [
+            os.path.basename(TranscodeCache().get_entry_directory(videos[1], 'rgb24'))
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the DB access layer (Database and DatabaseCursor).
+
+Covers:
+- connections use WAL mode
+- statements that fail with `database is locked` are retried, and lock waits are recorded
+- statements inside an explicit transaction are not retried
+- constructing the schema waits for other writers, and releases the write lock if it fails
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.database import Database, DatabaseCursor
+
+from tests.dbtestcase import DbTestCase
+
+
+class TestDatabase(DbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cursor = Database().get_cursor()
+        self.cursor.execute("CREATE TABLE t (x INTEGER)")
+
+    # Holds the write lock from another connection for hold_s.
+    def _hold_write_lock(self, hold_s):
+        conn = sqlite3.connect(self.db_path, isolation_level = None, check_same_thread = False)
+        self.addCleanup(conn.close)
+        conn.execute("BEGIN IMMEDIATE")
+        timer = threading.Timer(hold_s, conn.execute, ["COMMIT"])
+        timer.start()
+        self.addCleanup(timer.join)
+
+    def test_wal_mode(self):
+        self.cursor.execute("PRAGMA journal_mode")
+        self.assertEqual(self.cursor.fetchone()['journal_mode'], 'wal')
+
+    def test_retries_locked_statements(self):
+        self._hold_write_lock(0.4)
+        sql = "INSERT INTO t (x) VALUES(?)"
+        self.cursor.execute(sql, [1])
+        self.assertEqual(self.cursor.rowcount, 1)
+
+        stats = DatabaseCursor.get_stats()[sql]
+        self.assertGreater(stats['num_lock_waits'], 0)
+        self.assertGreaterEqual(stats['lock_wait_s'], 0.3)
+        self.assertEqual(stats['num_failed'], 0)
+
+        # Readers aren't blocked by the writer.
+        self._hold_write_lock(0.4)
+        self.cursor.execute("SELECT count(*) AS n FROM t")
+        self.assertEqual(self.cursor.fetchone()['n'], 1)
+        self.assertEqual(DatabaseCursor.get_stats()["SELECT count(*) AS n FROM t"]['num_lock_waits'], 0)
+
+    def test_does_not_retry_inside_transaction(self):
+        self.cursor.execute("BEGIN TRANSACTION")
+        self.addCleanup(self.cursor.execute, "ROLLBACK")
+        self._hold_write_lock(0.4)
+        sql = "INSERT INTO t (x) VALUES(2)"
+        with self.assertRaisesRegex(sqlite3.OperationalError, 'locked'):
+            self.cursor.execute(sql)
+        stats = DatabaseCursor.get_stats()[sql]
+        self.assertEqual(stats['num_lock_waits'], 0)
+        self.assertEqual(stats['num_failed'], 1)
+
+    def test_construct_waits_for_other_writers(self):
+        self._hold_write_lock(0.4)
+        Database().construct()
+        self.assertGreater(DatabaseCursor.get_stats()["BEGIN IMMEDIATE TRANSACTION"]['num_lock_waits'], 0)
+
+        # Constructing an up to date DB doesn't leave the write lock held.
+        Database().construct()
+        conn = sqlite3.connect(self.db_path, isolation_level = None, timeout = 0)
+        self.addCleanup(conn.close)
+        conn.execute("INSERT INTO t (x) VALUES(3)")
+
+    def test_failed_construct_releases_write_lock(self):
+        self.cursor.execute("CREATE TABLE pifi_schema_version (version INTEGER)")
+        self.cursor.execute("INSERT INTO pifi_schema_version (version) VALUES(1000)")
+        with self.assertRaisesRegex(Exception, 'newer than should be possible'):
+            Database().construct()
+
+        conn = sqlite3.connect(self.db_path, isolation_level = None, timeout = 0)
+        self.addCleanup(conn.close)
+        conn.execute("INSERT INTO t (x) VALUES(4)")
+
+
+if __name__ == '__main__':
+    unittest.main()
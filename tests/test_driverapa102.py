@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Unit tests for DriverApa102.
+
+Uses a fake apa102 library whose SPI write checks its buffer the way Blinka's does, so that no hardware is
+required. Covers:
+- zig-zagging rows and re-ordering colors into the SPI bytes
+- brightness in each LED's start frame
+- clearing the screen
+"""
+
+import os
+import sys
+import types
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.config import Config
+
+WIDTH = 3
+HEIGHT = 2
+
+
+class _FakeSpi:
+    """Mimics Blinka's SPI.write, which starts with `if not buf: return`."""
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, buf):
+        if not buf:
+            return
+        self.writes.append(bytes(buf))
+
+
+class _FakeApa102:
+
+    LED_START = 0b11100000
+
+    def __init__(self, num_led, mosi, sclk, order):
+        self.spi = _FakeSpi()
+        self.global_brightness = None
+
+    def set_global_brightness(self, brightness):
+        self.global_brightness = brightness
+
+    def clock_start_frame(self):
+        pass
+
+    def clock_end_frame(self):
+        pass
+
+    def send_to_spi(self, data):
+        self.spi.write(data)
+
+
+class TestDriverApa102(unittest.TestCase):
+
+    def setUp(self):
+        Config._Config__is_loaded = True
+        Config._Config__config = {'leds': {'display_width': WIDTH, 'display_height': HEIGHT}}
+
+        apa102 = types.ModuleType('apa102_pi.driver.apa102')
+        apa102.APA102 = _FakeApa102
+        apa102.RGB_MAP = {'rgb': [3, 2, 1]}
+        driver_package = types.ModuleType('apa102_pi.driver')
+        driver_package.apa102 = apa102
+        modules_patcher = patch.dict(sys.modules, {
+            'apa102_pi': types.ModuleType('apa102_pi'),
+            'apa102_pi.driver': driver_package,
+            'apa102_pi.driver.apa102': apa102,
+        })
+        modules_patcher.start()
+        self.addCleanup(modules_patcher.stop)
+        sys.modules.pop('pifi.led.drivers.driverapa102', None)
+        self.addCleanup(sys.modules.pop, 'pifi.led.drivers.driverapa102', None)
+
+        from pifi.led.drivers.driverapa102 import DriverApa102
+        self.driver = DriverApa102()
+        self.spi = self.driver._DriverApa102__pixels.spi
+
+    def _led(self, spi_bytes, index):
+        return list(spi_bytes[index * 4:(index + 1) * 4])
+
+    def test_clear_screen_on_init(self):
+        self.assertEqual(self.spi.writes, [bytes([_FakeApa102.LED_START, 0, 0, 0]) * WIDTH * HEIGHT])
+
+    def test_display_frame(self):
+        frame = np.arange(WIDTH * HEIGHT * 3, dtype = np.uint8).reshape(HEIGHT, WIDTH, 3)
+        self.driver.display_frame(frame)
+        spi_bytes = self.spi.writes[-1]
+        self.assertEqual(len(spi_bytes), WIDTH * HEIGHT * 4)
+
+        # The first row is flipped horizontally, and colors are sent in the order given by RGB_MAP.
+        self.assertEqual(self._led(spi_bytes, 0), [_FakeApa102.LED_START, 8, 7, 6])
+        self.assertEqual(self._led(spi_bytes, 2), [_FakeApa102.LED_START, 2, 1, 0])
+        self.assertEqual(self._led(spi_bytes, 3), [_FakeApa102.LED_START, 11, 10, 9])
+
+    def test_brightness(self):
+        self.driver.set_brightness(100)
+        self.driver.clear_screen()
+        self.assertEqual(self._led(self.spi.writes[-1], 0), [_FakeApa102.LED_START | 31, 0, 0, 0])
+        self.assertEqual(self.driver._DriverApa102__pixels.global_brightness, 31)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Unit tests for FrameTimestamps, which parses frame timestamps from ffmpeg's
+framecrc output.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.video.frametimestamps import FrameTimestamps
+
+# A variable frame rate video, starting at a nonzero timestamp like mpegts streams do.
+FRAMECRC = (
+    b'#software: Lavf59.27.100\n' +
+    b'#tb 0: 1/90000\n' +
+    b'#media_type 0: video\n' +
+    b'#codec_id 0: rawvideo\n' +
+    b'#dimensions 0: 64x32\n' +
+    b'#sar 0: 1/1\n' +
+    b'0,     126000,     126000,     3000,     6144, 0x0b2b5e2f\n' +
+    b'0,     129000,     129000,     3000,     6144, 0x9c7a8e1a\n' +
+    b'0,     135000,     135000,     9000,     6144, 0x1f2e3d4c\n'
+)
+
+
+class TestFrameTimestamps(unittest.TestCase):
+
+    def test_timestamps_are_relative_to_first_frame(self):
+        frame_timestamps = FrameTimestamps()
+        frame_timestamps.feed(FRAMECRC)
+        self.assertEqual(len(frame_timestamps), 3)
+        self.assertEqual([frame_timestamps.get(i) for i in range(3)], [0, 3000 / 90000, 9000 / 90000])
+        self.assertAlmostEqual(frame_timestamps.get_end_time(), 18000 / 90000)
+        self.assertAlmostEqual(frame_timestamps.get_average_fps(), 3 / (18000 / 90000))
+
+    def test_feed_partial_lines(self):
+        frame_timestamps = FrameTimestamps()
+        for i in range(0, len(FRAMECRC), 7):
+            frame_timestamps.feed(FRAMECRC[i:i + 7])
+        self.assertEqual(len(frame_timestamps), 3)
+        self.assertEqual(frame_timestamps.get(2), 9000 / 90000)
+
+    def test_discard_before(self):
+        frame_timestamps = FrameTimestamps()
+        frame_timestamps.feed(FRAMECRC)
+        frame_timestamps.discard_before(2)
+        self.assertEqual(len(frame_timestamps), 3)
+        self.assertEqual(frame_timestamps.get(2), 9000 / 90000)
+        with self.assertRaises(IndexError):
+            frame_timestamps.get(1)
+
+
+if __name__ == '__main__':
+    unittest.main()
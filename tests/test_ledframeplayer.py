@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Unit tests for LedFramePlayer.
+
+Uses a fake LED driver so that no hardware is required. Covers:
+- fade_to_frame() interpolation and timing
+- unchanged-frame suppression
+- frames rejected by the driver, and copying of the current frame
+- the driver's vsync wait time
+- async output thread handoff and counters
+- Gamma curve generation and the on-disk curve cache
+- FrameTransformPlan equivalence with the per-channel reference transform
+"""
+
+import copy
+import shutil
+import tempfile
+import time
+import types
+import unittest
+import sys
+import os
+from unittest.mock import patch
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.config import Config
+from pifi.led.frametransformplan import FrameTransformPlan
+from pifi.led.gamma import Gamma
+from pifi.led.ledframeplayer import LedFramePlayer
+from pifi.video.videocolormode import VideoColorMode
+
+
+class _FakeDriver:
+    """Records every frame it is asked to display, unless told to reject them."""
+
+    def __init__(self, clear_screen=True):
+        self.frames = []
+        self.brightness = None
+        self.should_reject_frames = False
+        self.last_vsync_wait_s = None
+
+    def display_frame(self, frame):
+        if self.should_reject_frames:
+            return False
+        self.frames.append(np.array(frame, copy=True))
+
+    def set_brightness(self, brightness):
+        self.brightness = brightness
+
+    def clear_screen(self):
+        pass
+
+    def get_last_vsync_wait_time(self):
+        return self.last_vsync_wait_s
+
+    def can_multiple_driver_instances_coexist(self):
+        return True
+
+
+BASE_CONFIG = {
+    'leds': {
+        'driver': 'apa102',
+        'display_width': 8,
+        'display_height': 4,
+        'brightness': 10,
+        'gamma_enabled': False,
+    },
+}
+
+
+class LedFramePlayerTestCase(unittest.TestCase):
+
+    def _config(self):
+        return copy.deepcopy(BASE_CONFIG)
+
+    def setUp(self):
+        Config._Config__is_loaded = True
+        Config._Config__config = self._config()
+
+        fake_module = types.ModuleType('pifi.led.drivers.driverapa102')
+        fake_module.DriverApa102 = _FakeDriver
+        modules_patcher = patch.dict(sys.modules, {'pifi.led.drivers.driverapa102': fake_module})
+        modules_patcher.start()
+        self.addCleanup(modules_patcher.stop)
+
+        settings_patcher = patch('pifi.led.ledframeplayer.SettingsDb')
+        settings_patcher.start().return_value.get.return_value = None
+        self.addCleanup(settings_patcher.stop)
+
+        self.player = LedFramePlayer()
+        self.addCleanup(self.player.stop_output_thread)
+        self.driver = self.player._LedFramePlayer__driver
+
+    def _frame(self, value):
+        return np.full([4, 8, 3], value, np.uint8)
+
+
+class TestFadeToFrame(LedFramePlayerTestCase):
+
+    def test_first_fade_plays_frame_directly(self):
+        self.player.fade_to_frame(self._frame(200), duration=0.05)
+        self.assertEqual(len(self.driver.frames), 1)
+        np.testing.assert_array_equal(self.driver.frames[0], self._frame(200))
+
+    def test_fade_ends_on_target_frame(self):
+        self.player.play_frame(self._frame(0))
+        self.player.fade_to_frame(self._frame(255), duration=0.05)
+        np.testing.assert_array_equal(self.driver.frames[-1], self._frame(255))
+        np.testing.assert_array_equal(self.player.get_current_frame(), self._frame(255))
+
+    def test_intermediate_frames_are_monotonic(self):
+        self.player.play_frame(self._frame(250))
+        self.player.fade_to_frame(self._frame(10), duration=0.1)
+        values = [int(f[0, 0, 0]) for f in self.driver.frames]
+        self.assertGreater(len(values), 3)
+        self.assertEqual(values, sorted(values, reverse=True))
+        for value in values:
+            self.assertGreaterEqual(value, 10)
+            self.assertLessEqual(value, 250)
+
+    def test_fade_lasts_requested_duration(self):
+        self.player.play_frame(self._frame(0))
+        start = time.monotonic()
+        self.player.fade_to_frame(self._frame(100), duration=0.1)
+        elapsed = time.monotonic() - start
+        self.assertGreaterEqual(elapsed, 0.1)
+        self.assertLess(elapsed, 0.3)
+
+    def test_zero_duration_skips_intermediate_frames(self):
+        self.player.play_frame(self._frame(0))
+        self.player.fade_to_frame(self._frame(100), duration=0)
+        self.assertEqual(len(self.driver.frames), 2)
+
+
+class TestSkipUnchangedFrames(LedFramePlayerTestCase):
+
+    KEEP_ALIVE_INTERVAL = 0.05
+
+    def _config(self):
+        config = super()._config()
+        config['leds']['unchanged_frame_keep_alive_interval'] = self.KEEP_ALIVE_INTERVAL
+        return config
+
+    def test_identical_frame_is_skipped(self):
+        self.player.play_frame(self._frame(10))
+        self.player.play_frame(self._frame(10))
+        self.player.play_frame(self._frame(20))
+        self.assertEqual(len(self.driver.frames), 2)
+        self.assertEqual(self.player.get_output_stats()['skipped_unchanged_frames'], 1)
+
+    def test_unchanged_frame_is_resent_after_keep_alive_interval(self):
+        self.player.play_frame(self._frame(10))
+        time.sleep(self.KEEP_ALIVE_INTERVAL * 1.5)
+        self.player.play_frame(self._frame(10))
+        self.assertEqual(len(self.driver.frames), 2)
+
+    def test_unchanged_frame_is_resent_after_clear_screen(self):
+        self.player.play_frame(self._frame(10))
+        self.player.clear_screen()
+        self.player.play_frame(self._frame(10))
+        self.assertEqual(len(self.driver.frames), 2)
+
+
+class TestCurrentFrame(LedFramePlayerTestCase):
+
+    def test_current_frame_is_a_copy(self):
+        frame = self._frame(10)
+        self.player.play_frame(frame)
+        frame[:] = 20
+        np.testing.assert_array_equal(self.player.get_current_frame(), self._frame(10))
+
+    def test_rejected_frame_is_not_recorded(self):
+        self.player.play_frame(self._frame(10))
+        self.driver.should_reject_frames = True
+        self.player.play_frame(self._frame(20))
+        np.testing.assert_array_equal(self.player.get_current_frame(), self._frame(10))
+
+    def test_frame_is_resent_after_being_rejected(self):
+        self.driver.should_reject_frames = True
+        self.player.play_frame(self._frame(10))
+        self.driver.should_reject_frames = False
+        self.player.play_frame(self._frame(10))
+        self.assertEqual(len(self.driver.frames), 1)
+        self.assertEqual(self.player.get_output_stats()['skipped_unchanged_frames'], 0)
+
+
+class TestVsyncWaitTime(LedFramePlayerTestCase):
+
+    def test_last_vsync_wait_time_comes_from_driver(self):
+        self.assertIsNone(self.player.get_last_vsync_wait_time())
+        self.driver.last_vsync_wait_s = 0.01
+        self.assertEqual(self.player.get_last_vsync_wait_time(), 0.01)
+
+
+class TestAsyncOutput(LedFramePlayerTestCase):
+
+    REFRESH_RATE = 5
+
+    def _config(self):
+        config = super()._config()
+        config['leds']['output_thread'] = {'enabled': True, 'refresh_rate': self.REFRESH_RATE}
+        return config
+
+    def _wait_for_ticks(self, num_ticks):
+        time.sleep(num_ticks / self.REFRESH_RATE)
+
+    def test_frame_is_copied_on_publish(self):
+        frame = self._frame(100)
+        self.player.play_frame(frame)
+        frame.fill(0)
+        self._wait_for_ticks(1.5)
+        self.assertEqual(len(self.driver.frames), 1)
+        np.testing.assert_array_equal(self.driver.frames[0], self._frame(100))
+
+    def test_newest_frame_wins(self):
+        # Let the output thread's first tick pass, so that all three frames are published between ticks.
+        self._wait_for_ticks(0.5)
+        for value in (10, 20, 30):
+            self.player.play_frame(self._frame(value))
+        self._wait_for_ticks(1)
+        self.assertEqual(len(self.driver.frames), 1)
+        np.testing.assert_array_equal(self.driver.frames[0], self._frame(30))
+        stats = self.player.get_output_stats()
+        self.assertEqual(stats['superseded_frames'], 2)
+        self.assertEqual(stats['output_frames'], 1)
+
+    def test_clear_screen_discards_pending_frame(self):
+        self._wait_for_ticks(0.5)
+        self.player.play_frame(self._frame(10))
+        self.player.clear_screen()
+        self._wait_for_ticks(1)
+        self.assertEqual(len(self.driver.frames), 0)
+
+    def test_slow_driver_drops_ticks(self):
+        original_display_frame = self.driver.display_frame
+
+        def slow_display_frame(frame):
+            time.sleep(3.5 / self.REFRESH_RATE)
+            original_display_frame(frame)
+
+        self.driver.display_frame = slow_display_frame
+        self.player.play_frame(self._frame(10))
+        self._wait_for_ticks(6)
+        self.assertGreaterEqual(self.player.get_output_stats()['dropped_frames'], 2)
+
+    def test_output_thread_is_stopped_at_exit(self):
+        with patch('pifi.led.ledframeplayer.atexit') as mock_atexit:
+            player = LedFramePlayer()
+            mock_atexit.register.assert_called_once_with(player.stop_output_thread)
+            player.stop_output_thread()
+            mock_atexit.unregister.assert_called_once_with(player.stop_output_thread)
+        self.assertIsNone(player._LedFramePlayer__output_thread)
+
+
+class TestGamma(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.curves_file_path = os.path.join(tmp_dir, 'data', 'gamma_tables.npz')
+        path_patcher = patch.object(Gamma, 'CURVES_FILE_PATH', self.curves_file_path)
+        path_patcher.start()
+        self.addCleanup(path_patcher.stop)
+        Gamma._Gamma__curves_cache.clear()
+        self.addCleanup(Gamma._Gamma__curves_cache.clear)
+
+    def test_curves_match_gamma_formula(self):
+        gamma = Gamma()
+        for curve_index in (0, Gamma.DEFAULT_GAMMA_INDEX, len(gamma.scale_red_curves) - 1):
+            correction = (20 + curve_index) / 10
+            for curves, max_out in ((gamma.scale_red_curves, 255), (gamma.scale_green_curves, 114), (gamma.scale_blue_curves, 95)):
+                expected = [int(round(pow(i / 255, correction) * max_out)) for i in range(256)]
+                self.assertEqual(curves[curve_index].tolist(), expected)
+
+    def test_black_and_white_zeroes_leading_values_of_all_channels(self):
+        color = Gamma(VideoColorMode.COLOR_MODE_COLOR)
+        bw = Gamma(VideoColorMode.COLOR_MODE_BW)
+        for curve_index in range(len(bw.scale_red_curves)):
+            stacked = np.stack([color.scale_red_curves[curve_index], color.scale_green_curves[curve_index], color.scale_blue_curves[curve_index]])
+            first_nonzero = int(np.argmax(stacked.min(axis=0) > 0))
+            self.assertEqual(bw.scale_red_curves[curve_index][:first_nonzero].tolist(), [0] * first_nonzero)
+            self.assertEqual(bw.scale_red_curves[curve_index][first_nonzero:].tolist(), color.scale_red_curves[curve_index][first_nonzero:].tolist())
+
+    def test_streaming_estimator_is_stable_under_noise(self):
+        rng = np.random.default_rng(0)
+        gamma = Gamma(VideoColorMode.COLOR_MODE_BW, estimator=Gamma.ESTIMATOR_STREAMING)
+        indices = [
+            gamma.getGammaIndexForMonochromeFrame(np.clip(rng.normal(120, 40, [16, 32]), 0, 255).astype(np.uint8))
+            for _ in range(100)
+        ]
+        self.assertLessEqual(len(set(indices)), 2)
+
+    def test_streaming_estimator_follows_scene_cuts(self):
+        exact = Gamma(VideoColorMode.COLOR_MODE_BW)
+        streaming = Gamma(VideoColorMode.COLOR_MODE_BW, estimator=Gamma.ESTIMATOR_STREAMING)
+        dark = np.full([16, 32], 5, np.uint8)
+        bright = np.full([16, 32], 250, np.uint8)
+        self.assertEqual(streaming.getGammaIndexForMonochromeFrame(dark), exact.getGammaIndexForMonochromeFrame(dark))
+        self.assertEqual(streaming.getGammaIndexForMonochromeFrame(bright), exact.getGammaIndexForMonochromeFrame(bright))
+
+    def test_rejects_unknown_estimator(self):
+        with self.assertRaises(Exception):
+            Gamma(estimator='magic')
+
+    def _load_curves_file(self):
+        with np.load(self.curves_file_path) as curves_file:
+            return curves_file['curves'], curves_file['params']
+
+    def test_curves_are_loaded_from_disk(self):
+        Gamma()
+        self.assertTrue(os.path.exists(self.curves_file_path))
+        curves, params = self._load_curves_file()
+        curves[0, 0, 100] = 42
+        np.savez(self.curves_file_path, curves=curves, params=params)
+
+        Gamma._Gamma__curves_cache.clear()
+        self.assertEqual(Gamma().scale_red_curves[0][100], 42)
+
+    def test_invalid_file_is_regenerated(self):
+        os.makedirs(os.path.dirname(self.curves_file_path))
+        with open(self.curves_file_path, 'wb') as curves_file:
+            curves_file.write(b'not a curves file')
+        gamma = Gamma()
+        self.assertEqual(gamma.scale_red_curves.shape, (40, 256))
+        self.assertEqual(self._load_curves_file()[0].shape, (3, 40, 256))
+
+    def test_file_with_stale_params_is_regenerated(self):
+        Gamma()
+        curves, params = self._load_curves_file()
+        curves[0, 0, 100] = 42
+        params[-1] += 0.1
+        np.savez(self.curves_file_path, curves=curves, params=params)
+
+        Gamma._Gamma__curves_cache.clear()
+        self.assertNotEqual(Gamma().scale_red_curves[0][100], 42)
+        self.assertFalse(np.array_equal(self._load_curves_file()[1], params))
+
+
+def _reference_transform(frame, color_mode, gamma, flip_x, flip_y):
+    """Straightforward per-channel transform that FrameTransformPlan must match."""
+    if gamma is None:
+        curves = [np.arange(256)] * 3
+    else:
+        if VideoColorMode.is_color_mode_rgb(color_mode):
+            index = Gamma.DEFAULT_GAMMA_INDEX
+        else:
+            index = gamma.getGammaIndexForMonochromeFrame(frame)
+        curves = [
+            np.array(gamma.scale_red_curves[index]),
+            np.array(gamma.scale_green_curves[index]),
+            np.array(gamma.scale_blue_curves[index]),
+        ]
+
+    frame = frame.astype(np.intp)
+    if color_mode in (VideoColorMode.COLOR_MODE_INVERT_COLOR, VideoColorMode.COLOR_MODE_INVERT_BW):
+        frame = 255 - frame
+    if frame.ndim == 2:
+        frame = np.stack([frame] * 3, axis=-1)
+
+    channels = {
+        VideoColorMode.COLOR_MODE_R: (0,),
+        VideoColorMode.COLOR_MODE_G: (1,),
+        VideoColorMode.COLOR_MODE_B: (2,),
+    }.get(color_mode, (0, 1, 2))
+    out = np.zeros(frame.shape, np.uint8)
+    for c in channels:
+        out[:, :, c] = curves[c][frame[:, :, c]]
+
+    if flip_y:
+        out = out[::-1]
+    if flip_x:
+        out = out[:, ::-1]
+    return out
+
+
+class TestFrameTransformPlan(unittest.TestCase):
+
+    def test_matches_reference_transform(self):
+        rng = np.random.default_rng(0)
+        for color_mode in VideoColorMode.COLOR_MODES:
+            is_rgb = VideoColorMode.is_color_mode_rgb(color_mode)
+            shape = [5, 7, 3] if is_rgb else [5, 7]
+            for gamma in (None, Gamma(video_color_mode=color_mode)):
+                for flip_x in (False, True):
+                    for flip_y in (False, True):
+                        with self.subTest(color_mode=color_mode, gamma=gamma is not None, flip_x=flip_x, flip_y=flip_y):
+                            plan = FrameTransformPlan(color_mode, gamma, 7, 5, flip_x, flip_y)
+                            for _ in range(3):
+                                frame = rng.integers(0, 256, shape, dtype=np.uint8)
+                                np.testing.assert_array_equal(
+                                    plan.transform(frame),
+                                    _reference_transform(frame, color_mode, gamma, flip_x, flip_y)
+                                )
+
+    def test_reuses_output_buffer(self):
+        plan = FrameTransformPlan(VideoColorMode.COLOR_MODE_COLOR, Gamma(), 7, 5, False, True)
+        first = plan.transform(np.zeros([5, 7, 3], np.uint8))
+        second = plan.transform(np.ones([5, 7, 3], np.uint8))
+        self.assertIs(first, second)
+
+    def test_rejects_unknown_color_mode(self):
+        with self.assertRaises(Exception):
+            FrameTransformPlan('sepia', None, 7, 5, False, False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Unit tests for resuming re-enqueued videos from their playback position.
+
+Covers:
+- recording a video's playback position, and keeping it when it's re-enqueued
+- adding the playback position column to an existing playlist
+- skipping to the start position of a resumed stream while decoding it
+- finding the keyframe that a resumed saved video starts playing from
+"""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.database import Database
+from pifi.playlist import Playlist
+from pifi.video.videoprocessor import VideoProcessor
+
+from tests.dbtestcase import DbTestCase
+
+
+class TestPlaybackPosition(DbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._set_config({'leds': {'display_width': 32, 'display_height': 16}})
+
+    def _enqueue(self, playlist):
+        return playlist.enqueue(
+            'https://www.youtube.com/watch?v=abc', 'color', '', 'title', '0:03:00', Playlist.TYPE_VIDEO, ''
+        )
+
+    def test_reenqueued_video_keeps_its_playback_position(self):
+        playlist = Playlist()
+        playlist.construct()
+        playlist_video_id = self._enqueue(playlist)
+        self.assertEqual(playlist.get_next_playlist_item()['playback_position_s'], 0)
+
+        self.assertTrue(playlist.set_current_video(playlist_video_id))
+        playlist.set_playback_position(playlist_video_id, 42.5)
+        self.assertTrue(playlist.reenqueue(playlist_video_id))
+
+        playlist_item = playlist.get_next_playlist_item()
+        self.assertEqual(playlist_item['playlist_video_id'], playlist_video_id)
+        self.assertEqual(playlist_item['playback_position_s'], 42.5)
+
+        # Videos enqueued anew start from the beginning.
+        other_playlist_video_id = self._enqueue(playlist)
+        self.assertEqual(playlist.get_playlist_item_by_id(other_playlist_video_id)['playback_position_s'], 0)
+
+    def test_schema_update_adds_playback_position(self):
+        cursor = Database().get_cursor()
+        cursor.execute("CREATE TABLE pifi_schema_version (version INTEGER)")
+        cursor.execute("INSERT INTO pifi_schema_version (version) VALUES(7)")
+        cursor.execute("""
+            CREATE TABLE playlist_videos (
+                playlist_video_id INTEGER PRIMARY KEY, type VARCHAR(20) DEFAULT 'TYPE_VIDEO', url TEXT,
+                status VARCHAR(20), is_skip_requested INTEGER DEFAULT 0, priority INTEGER DEFAULT 0
+            )""")
+        cursor.execute("INSERT INTO playlist_videos (url, status) VALUES('https://x', 'STATUS_QUEUED')")
+
+        Database().construct()
+        self.assertEqual(Playlist().get_next_playlist_item()['playback_position_s'], 0)
+
+    def test_resumed_stream_is_seeked_in_while_decoding(self):
+        # The download streams the whole video to stdout, rather than having yt-dlp cut and re-encode it.
+        cmd = VideoProcessor.get_streaming_video_download_cmd('https://x')
+        self.assertNotIn('--download-sections', cmd)
+        self.assertNotIn('--force-keyframes-at-cuts', cmd)
+
+        cmd = VideoProcessor.get_ffmpeg_pixel_conversion_cmd('timestamps', start_position_s = 42.5)
+        self.assertIn(' -ss 42.5 -i pipe:0 ', cmd)
+        self.assertNotIn('-ss', VideoProcessor.get_ffmpeg_pixel_conversion_cmd('timestamps'))
+
+    def test_saved_video_position_starts_at_keyframe(self):
+        get_keyframe_time_before = VideoProcessor._VideoProcessor__get_keyframe_time_before
+
+        # ffprobe outputs the start time, and then the keyframe's timestamp.
+        with mock.patch('subprocess.check_output', side_effect = [b'0.040000\n', b'40.080000\n']) as check_output:
+            self.assertAlmostEqual(get_keyframe_time_before('/video.mp4', 42.5), 40.04)
+        self.assertIn("-read_intervals '42.54%+#1'", check_output.call_args_list[1].args[0])
+
+        with mock.patch('subprocess.check_output', side_effect = [b'N/A\n', b'40.000000\n']):
+            self.assertAlmostEqual(get_keyframe_time_before('/video.mp4', 42.5), 40)
+
+        with mock.patch('subprocess.check_output', side_effect = [b'0.000000\n', b'']):
+            self.assertIsNone(get_keyframe_time_before('/video.mp4', 42.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
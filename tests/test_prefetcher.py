@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the Prefetcher, which downloads upcoming videos in the queue
+while the current one plays.
+
+The yt-dlp download command is replaced with one that writes a fixed payload.
+
+Covers:
+- prefetching the next N queued videos, one at a time
+- stopping a prefetch once its video starts playing
+- deleting prefetched videos once they leave the queue
+"""
+
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.playlist import Playlist
+from pifi.video.prefetcher import Prefetcher
+from pifi.video.videoprocessor import VideoProcessor
+
+from tests.dbtestcase import DbTestCase
+
+
+class TestPrefetcher(DbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.prefetch_directory = os.path.join(self.tmp_dir, 'prefetch')
+        os.makedirs(self.prefetch_directory)
+        self.download_delay_s = 0
+
+        self._set_config({
+            'leds': {'display_width': 8, 'display_height': 4},
+            'video': {'prefetch': {'enabled': True, 'num_videos': 2}},
+        })
+
+        self._patch(mock.patch.object(VideoProcessor, 'get_prefetch_directory', return_value = self.prefetch_directory))
+        self._patch(mock.patch.object(
+            VideoProcessor, 'get_saved_video_path', return_value = os.path.join(self.tmp_dir, 'missing.mp4')
+        ))
+        self._patch(mock.patch.object(
+            VideoProcessor, 'get_streaming_video_download_cmd',
+            side_effect = lambda url, **kwargs: f'sleep {self.download_delay_s} && printf video'
+        ))
+
+        self.playlist = Playlist()
+        self.playlist.construct()
+        self.prefetcher = Prefetcher()
+        self.addCleanup(self.prefetcher._Prefetcher__stop_prefetching)
+
+    def _enqueue(self, url):
+        self.playlist.enqueue(url, 'color', '', url, '1:00', Playlist.TYPE_VIDEO, '')
+        return self.playlist.get_queue()[-1]['playlist_video_id']
+
+    def _tick_until_idle(self):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            self.prefetcher._Prefetcher__tick()
+            if self.prefetcher._Prefetcher__url is None:
+                return
+            time.sleep(0.05)
+        self.fail('Prefetching did not finish.')
+
+    def _is_prefetched(self, url):
+        return os.path.isfile(VideoProcessor.get_prefetched_video_path(url))
+
+    def test_prefetches_next_videos(self):
+        for url in ['a', 'b', 'c']:
+            self._enqueue(url)
+
+        self._tick_until_idle()
+        self._tick_until_idle()
+        self._tick_until_idle()
+
+        self.assertTrue(self._is_prefetched('a'))
+        self.assertTrue(self._is_prefetched('b'))
+        self.assertFalse(self._is_prefetched('c'))
+        with open(VideoProcessor.get_prefetched_video_path('a')) as video_file:
+            self.assertEqual(video_file.read(), 'video')
+
+    def test_stops_prefetching_video_that_started_playing(self):
+        self.download_delay_s = 10
+        playlist_video_id = self._enqueue('a')
+        self.prefetcher._Prefetcher__tick()
+        self.assertEqual(self.prefetcher._Prefetcher__url, 'a')
+
+        self.playlist.set_current_video(playlist_video_id)
+        self.prefetcher._Prefetcher__tick()
+        self.assertIsNone(self.prefetcher._Prefetcher__url)
+        self.assertEqual(os.listdir(self.prefetch_directory), [])
+
+    def test_deletes_prefetched_videos_that_left_the_queue(self):
+        playlist_video_id = self._enqueue('a')
+        self._tick_until_idle()
+        self._tick_until_idle()
+        self.assertTrue(self._is_prefetched('a'))
+
+        self.playlist.set_current_video(playlist_video_id)
+        self.prefetcher._Prefetcher__tick()
+        self.assertTrue(self._is_prefetched('a'))
+
+        self.playlist.end_video(playlist_video_id)
+        self.prefetcher._Prefetcher__tick()
+        self.assertFalse(self._is_prefetched('a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Unit tests for PyAvDecoder, which decodes videos in-process with PyAV.
+
+Covers:
+- decoding and scaling frames into the frames buffer
+- taking each frame's timestamp from the decoder
+- pausing while the frames buffer is full
+- stopping while the frames buffer is full
+- skipping to a start position in input that can't be seeked in
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.video.frametimestamps import FrameTimestamps
+from pifi.video.pyavdecoder import PyAvDecoder
+from pifi.datastructure.readonceframeringbuffer import ReadOnceFrameRingBuffer
+
+
+@unittest.skipUnless(PyAvDecoder.is_available(), 'PyAV is not installed')
+class TestPyAvDecoder(unittest.TestCase):
+
+    NUM_FRAMES = 30
+    FPS = 30
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.video_path = os.path.join(cls.tmp_dir, 'testsrc.mp4')
+        cls._make_video(cls.video_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    # Encodes FFmpeg's test pattern, at a size that isn't a multiple of the LED matrix size.
+    @classmethod
+    def _make_video(cls, path):
+        import av
+
+        with av.open(f'testsrc=size=100x50:rate={cls.FPS}', format = 'lavfi') as source:
+            with av.open(path, 'w') as output:
+                stream = output.add_stream('mpeg4', rate = cls.FPS)
+                stream.width = 100
+                stream.height = 50
+                stream.pix_fmt = 'yuv420p'
+                for i, frame in enumerate(source.decode(video = 0)):
+                    if i == cls.NUM_FRAMES:
+                        break
+                    frame.pts = None
+                    output.mux(stream.encode(frame.reformat(format = 'yuv420p')))
+                output.mux(stream.encode())
+
+    def _decode(self, frames, frame_timestamps, pix_fmt):
+        decoder = PyAvDecoder(frames, frame_timestamps, 32, 16, pix_fmt)
+        decoder.start(self.video_path)
+        return decoder
+
+    def _wait_until_done(self, decoder):
+        deadline = time.monotonic() + 10
+        while not decoder.is_done() and time.monotonic() < deadline:
+            decoder.wait_for_frames(1)
+        self.assertTrue(decoder.is_done())
+        self.assertIsNone(decoder.get_exception())
+
+    def test_decode(self):
+        frames = ReadOnceFrameRingBuffer(64, [16, 32, 3])
+        frame_timestamps = FrameTimestamps()
+        self._wait_until_done(self._decode(frames, frame_timestamps, 'rgb24'))
+
+        self.assertEqual(len(frames), self.NUM_FRAMES)
+        self.assertEqual(len(frame_timestamps), self.NUM_FRAMES)
+        for i in range(self.NUM_FRAMES):
+            self.assertAlmostEqual(frame_timestamps.get(i), i / self.FPS)
+        self.assertAlmostEqual(frame_timestamps.get_end_time(), self.NUM_FRAMES / self.FPS)
+
+        # testsrc's frames are colorful, not blank.
+        frame = frames[0]
+        self.assertGreater(len(np.unique(frame.reshape(-1, 3), axis = 0)), 4)
+
+    def test_gray(self):
+        frames = ReadOnceFrameRingBuffer(64, [16, 32])
+        self._wait_until_done(self._decode(frames, FrameTimestamps(), 'gray'))
+        self.assertEqual(len(frames), self.NUM_FRAMES)
+
+    def test_waits_for_room_in_full_buffer(self):
+        frames = ReadOnceFrameRingBuffer(4, [16, 32, 3])
+        frame_timestamps = FrameTimestamps()
+        decoder = self._decode(frames, frame_timestamps, 'rgb24')
+
+        deadline = time.monotonic() + 10
+        while not frames.is_full() and time.monotonic() < deadline:
+            decoder.wait_for_frames(1)
+        time.sleep(0.1)
+        self.assertEqual(len(frames), 4)
+        self.assertFalse(decoder.is_done())
+
+        # Playing frames makes room for more.
+        for i in range(self.NUM_FRAMES):
+            while len(frames) <= i and time.monotonic() < deadline:
+                decoder.wait_for_frames(1)
+            frames[i]
+        self._wait_until_done(decoder)
+        self.assertEqual(len(frame_timestamps), self.NUM_FRAMES)
+
+    def test_stop_while_buffer_is_full(self):
+        frames = ReadOnceFrameRingBuffer(4, [16, 32, 3])
+        decoder = self._decode(frames, FrameTimestamps(), 'rgb24')
+        deadline = time.monotonic() + 10
+        while not frames.is_full() and time.monotonic() < deadline:
+            decoder.wait_for_frames(1)
+
+        decoder.stop()
+        self._wait_until_done(decoder)
+        self.assertEqual(len(frames), 4)
+
+    def test_start_position(self):
+        frames = ReadOnceFrameRingBuffer(self.NUM_FRAMES, [16, 32, 3])
+        frame_timestamps = FrameTimestamps()
+        decoder = PyAvDecoder(frames, frame_timestamps, 32, 16, 'rgb24')
+        with open(self.video_path, 'rb') as video_file:
+            decoder.start(video_file, start_position_s = 0.5)
+            self._wait_until_done(decoder)
+
+        self.assertEqual(len(frame_timestamps), self.NUM_FRAMES // 2)
+        self.assertEqual(frame_timestamps.get(0), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
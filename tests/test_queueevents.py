@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Unit tests for QueueEvents, which lets the server wake up the Queue.
+
+Covers:
+- publishing events to the Queue's socket and receiving them without blocking
+- coalescing repeated events, keeping the time each was first published
+- publishing when the Queue isn't running
+"""
+
+import os
+import select
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.queueevents import QueueEvents
+
+
+class TestQueueEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.socket_path = os.path.join(self.tmp_dir, 'queue_events')
+
+    def test_publish_and_receive(self):
+        server_socket = QueueEvents(self.socket_path).make_server_socket()
+        self.addCleanup(server_socket.close)
+        self.assertEqual(QueueEvents.receive(server_socket), {})
+
+        queue_events = QueueEvents(self.socket_path)
+        queue_events.publish(QueueEvents.EVENT_PLAYLIST_CHANGED)
+        self.assertEqual(select.select([server_socket], [], [], 1)[0], [server_socket])
+        queue_events.publish(QueueEvents.EVENT_SETTINGS_CHANGED)
+        queue_events.publish(QueueEvents.EVENT_PLAYLIST_CHANGED)
+        server_socket.sendto(b'garbage', self.socket_path)
+
+        events = QueueEvents.receive(server_socket)
+        self.assertEqual(
+            set(events), {QueueEvents.EVENT_PLAYLIST_CHANGED, QueueEvents.EVENT_SETTINGS_CHANGED}
+        )
+        self.assertLessEqual(events[QueueEvents.EVENT_PLAYLIST_CHANGED], events[QueueEvents.EVENT_SETTINGS_CHANGED])
+        self.assertEqual(QueueEvents.receive(server_socket), {})
+
+    def test_publish_without_queue(self):
+        # Doesn't raise.
+        QueueEvents(self.socket_path).publish(QueueEvents.EVENT_PLAYLIST_CHANGED)
+
+        # A stale socket file left behind by a previous Queue is replaced.
+        server_socket = QueueEvents(self.socket_path).make_server_socket()
+        server_socket.close()
+        QueueEvents(self.socket_path).publish(QueueEvents.EVENT_PLAYLIST_CHANGED)
+        server_socket = QueueEvents(self.socket_path).make_server_socket()
+        self.addCleanup(server_socket.close)
+        self.assertEqual(QueueEvents.receive(server_socket), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Unit tests for ReadOnceFrameRingBuffer, the preallocated buffer of decoded
+video frames used by VideoProcessor.
+"""
+
+import io
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.datastructure.readonceframeringbuffer import ReadOnceFrameRingBuffer
+
+SHAPE = [2, 3, 3]
+
+
+class TestReadOnceFrameRingBuffer(unittest.TestCase):
+
+    def _write(self, buffer, value):
+        buffer.get_write_slot()[:] = bytes([value]) * 18
+        buffer.commit_write()
+
+    def test_capacity_from_memory_budget(self):
+        self.assertEqual(ReadOnceFrameRingBuffer.make_for_memory_budget(18 * 10 + 5, SHAPE).get_capacity(), 10)
+        self.assertEqual(ReadOnceFrameRingBuffer.make_for_memory_budget(1, SHAPE).get_capacity(), 2)
+
+    def test_readinto_write_slot(self):
+        buffer = ReadOnceFrameRingBuffer(4, SHAPE)
+        data = io.BytesIO(bytes(range(18)))
+        self.assertEqual(data.readinto(buffer.get_write_slot()), 18)
+        buffer.commit_write()
+        np.testing.assert_array_equal(buffer[0], np.arange(18, dtype=np.uint8).reshape(SHAPE))
+
+    def test_full_until_frames_are_read(self):
+        buffer = ReadOnceFrameRingBuffer(3, SHAPE)
+        for value in range(3):
+            self._write(buffer, value)
+        self.assertTrue(buffer.is_full())
+        self.assertEqual(buffer.unread_length(), 3)
+        with self.assertRaises(Exception):
+            buffer.get_write_slot()
+
+        # The most recently read frame keeps its slot, so reading frame 0 doesn't make room yet.
+        self.assertEqual(buffer[0][0, 0, 0], 0)
+        self.assertTrue(buffer.is_full())
+
+        # Skipping ahead frees the slots of the skipped frames.
+        frame = buffer[2]
+        self.assertFalse(buffer.is_full())
+        self._write(buffer, 3)
+        self._write(buffer, 4)
+        self.assertTrue(buffer.is_full())
+        self.assertEqual(frame[0, 0, 0], 2)
+        self.assertEqual(buffer.unread_length(), 2)
+        self.assertEqual(buffer[4][0, 0, 0], 4)
+
+    def test_frames_can_only_be_read_once(self):
+        buffer = ReadOnceFrameRingBuffer(3, SHAPE)
+        self._write(buffer, 0)
+        self._write(buffer, 1)
+        buffer[1]
+        with self.assertRaises(IndexError):
+            buffer[0]
+        with self.assertRaises(IndexError):
+            buffer[2]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Unit tests for SettingsDb's in-memory mirror of the settings table.
+
+Covers:
+- reads are served from the mirror without querying the DB
+- changes committed by other connections are seen within one check interval
+- changes made through the same connection are seen right away
+"""
+
+import os
+import sqlite3
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.database import DatabaseCursor
+from pifi.settingsdb import SettingsDb
+
+from tests.dbtestcase import DbTestCase
+
+
+class TestSettingsDb(DbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.now = 1000
+        self._patch(mock.patch('pifi.settingsdb.time.monotonic', lambda: self.now))
+        SettingsDb().construct()
+
+    def _set_from_other_connection(self, key, value):
+        conn = sqlite3.connect(self.db_path, isolation_level = None)
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES(?, ?)", [key, value])
+        conn.close()
+
+    def _num_queries(self, sql):
+        return DatabaseCursor.get_stats().get(sql, {}).get('num_statements', 0)
+
+    def test_reads_from_mirror(self):
+        settings_db = SettingsDb()
+        settings_db.set(SettingsDb.BRIGHTNESS, '40')
+        self.assertEqual(settings_db.get(SettingsDb.BRIGHTNESS), '40')
+
+        num_selects = self._num_queries("SELECT * FROM settings")
+        num_checks = self._num_queries("PRAGMA data_version")
+        for _ in range(10):
+            self.assertEqual(SettingsDb().get(SettingsDb.BRIGHTNESS), '40')
+            self.assertEqual(SettingsDb().get(SettingsDb.RESTART_SCREENSAVER, '0'), '0')
+        self.assertEqual(self._num_queries("SELECT * FROM settings"), num_selects)
+        self.assertEqual(self._num_queries("PRAGMA data_version"), num_checks)
+
+        # Once the check interval passes, an unchanged DB only costs a version check.
+        self.now += 1
+        self.assertEqual(settings_db.get_row(SettingsDb.BRIGHTNESS)['value'], '40')
+        self.assertEqual(self._num_queries("SELECT * FROM settings"), num_selects)
+        self.assertEqual(self._num_queries("PRAGMA data_version"), num_checks + 1)
+
+    def test_sees_changes(self):
+        settings_db = SettingsDb()
+        self.assertIsNone(settings_db.get(SettingsDb.BRIGHTNESS))
+
+        # Another process changed the brightness.
+        self._set_from_other_connection(SettingsDb.BRIGHTNESS, '70')
+        self.now += 0.05
+        self.assertIsNone(settings_db.get(SettingsDb.BRIGHTNESS))
+        self.now += 0.06
+        self.assertEqual(settings_db.get(SettingsDb.BRIGHTNESS), '70')
+
+        # Changes through our own connection don't need to wait for the check interval.
+        settings_db.set(SettingsDb.IS_SCREENSAVER_ENABLED, False)
+        self.assertFalse(settings_db.is_enabled(SettingsDb.IS_SCREENSAVER_ENABLED, True))
+
+        # Nor do changes we're told about.
+        self._set_from_other_connection(SettingsDb.IS_SCREENSAVER_ENABLED, '1')
+        SettingsDb.invalidate_mirror()
+        self.assertTrue(settings_db.is_enabled(SettingsDb.IS_SCREENSAVER_ENABLED))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Unit tests for SharedFrameRing, the shared memory frame ring between producer
+processes and the display service.
+
+Covers:
+- publishing and reading the newest frame
+- superseded frames
+- the display ownership / priority handshake
+- the ring file's permissions
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.led.sharedframering import SharedFrameRing
+
+WIDTH = 8
+HEIGHT = 4
+
+
+class TestSharedFrameRing(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.path = os.path.join(tmp_dir, 'frames')
+        self.socket_path = os.path.join(tmp_dir, 'socket')
+
+        self.reader = self._make_ring()
+        self.reader.create()
+        self.wakeup_socket = self.reader.make_wakeup_server_socket()
+        self.addCleanup(self.wakeup_socket.close)
+
+        self.writer = self._make_ring()
+        self.assertTrue(self.writer.attach())
+
+        self.out_frame = np.zeros([HEIGHT, WIDTH, 3], np.uint8)
+
+    def _make_ring(self):
+        ring = SharedFrameRing(WIDTH, HEIGHT, self.path, self.socket_path)
+        self.addCleanup(ring.close)
+        return ring
+
+    def _frame(self, value):
+        return np.full([HEIGHT, WIDTH, 3], value, np.uint8)
+
+    def _set_owner(self, pid, priority):
+        header = np.memmap(self.path, np.uint64, 'r+', shape = (8,))
+        header[2] = pid
+        header[3] = priority
+        header.flush()
+
+    def test_attach_fails_before_create(self):
+        ring = SharedFrameRing(WIDTH, HEIGHT, self.path + '_missing', self.socket_path)
+        self.assertFalse(ring.attach())
+
+    def test_create_makes_file_writable_by_everyone(self):
+        path = self.path + '_umask'
+        ring = SharedFrameRing(WIDTH, HEIGHT, path, self.socket_path)
+        self.addCleanup(ring.close)
+        old_umask = os.umask(0o077)
+        try:
+            ring.create()
+        finally:
+            os.umask(old_umask)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o666)
+
+    def test_attach_fails_on_dimension_mismatch(self):
+        ring = SharedFrameRing(WIDTH + 1, HEIGHT, self.path, self.socket_path)
+        self.assertFalse(ring.attach())
+
+    def test_publish_and_read_newest(self):
+        self.assertTrue(self.writer.publish(SharedFrameRing.KIND_FRAME, self._frame(7), 50, SharedFrameRing.PRIORITY_PLAYBACK))
+        sequence, kind, brightness = self.reader.read_newest(0, self.out_frame)
+        self.assertEqual(kind, SharedFrameRing.KIND_FRAME)
+        self.assertEqual(brightness, 50)
+        np.testing.assert_array_equal(self.out_frame, self._frame(7))
+        self.assertIsNone(self.reader.read_newest(sequence, self.out_frame))
+        self.assertEqual(self.wakeup_socket.recv(16), b'\0')
+
+    def test_only_newest_frame_is_read(self):
+        for value in range(10):
+            self.writer.publish(SharedFrameRing.KIND_FRAME, self._frame(value), 50, SharedFrameRing.PRIORITY_PLAYBACK)
+        self.writer.publish(SharedFrameRing.KIND_CLEAR, None, 60, SharedFrameRing.PRIORITY_PLAYBACK)
+        sequence, kind, brightness = self.reader.read_newest(0, self.out_frame)
+        self.assertEqual(sequence, 11)
+        self.assertEqual(kind, SharedFrameRing.KIND_CLEAR)
+        self.assertEqual(brightness, 60)
+
+    def test_cannot_take_over_from_live_higher_priority_owner(self):
+        owner = subprocess.Popen(['sleep', '10'])
+        self.addCleanup(owner.wait)
+        self.addCleanup(owner.kill)
+        self._set_owner(owner.pid, SharedFrameRing.PRIORITY_PLAYBACK)
+
+        self.assertFalse(self.writer.acquire(SharedFrameRing.PRIORITY_QUEUE))
+        self.assertFalse(self.writer.publish(SharedFrameRing.KIND_CLEAR, None, 50, SharedFrameRing.PRIORITY_QUEUE))
+        self.assertTrue(self.writer.acquire(SharedFrameRing.PRIORITY_PLAYBACK))
+
+    def test_cannot_publish_after_being_taken_over_by_equal_priority(self):
+        owner = subprocess.Popen(['sleep', '10'])
+        self.addCleanup(owner.wait)
+        self.addCleanup(owner.kill)
+        self._set_owner(owner.pid, SharedFrameRing.PRIORITY_PLAYBACK)
+
+        self.assertFalse(self.writer.publish(SharedFrameRing.KIND_CLEAR, None, 50, SharedFrameRing.PRIORITY_PLAYBACK))
+
+    def test_can_take_over_from_exited_owner(self):
+        owner = subprocess.Popen(['true'])
+        owner.wait()
+        self._set_owner(owner.pid, SharedFrameRing.PRIORITY_PLAYBACK)
+
+        self.assertTrue(self.writer.publish(SharedFrameRing.KIND_CLEAR, None, 50, SharedFrameRing.PRIORITY_QUEUE))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Unit tests for StartupTimeline, which records how long each stage of starting
+to play a video takes.
+
+Covers:
+- stages marked in python and by shell marker commands
+- only marking the first downloaded bytes when configured to
+- storing timelines keyed by playlist_video_id
+- p50 / p95 per stage over recent videos
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.config import Config
+from pifi.database import Database
+from pifi.video.startuptimeline import StartupTimeline
+from pifi.video.videoprocessor import VideoProcessor
+
+from tests.dbtestcase import DbTestCase
+
+
+class TestStartupTimeline(DbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        StartupTimeline().construct()
+
+    def _insert_timeline(self, playlist_video_id, elapsed_s_by_stage):
+        Database().get_cursor().executemany(
+            "INSERT INTO video_startup_stages (playlist_video_id, stage, elapsed_s) VALUES(?, ?, ?)",
+            [[playlist_video_id, stage, elapsed_s] for stage, elapsed_s in elapsed_s_by_stage.items()]
+        )
+
+    def test_save(self):
+        timeline = StartupTimeline(7)
+        timeline.mark(StartupTimeline.STAGE_PIPELINE_START)
+        marker_cmd = timeline.get_marker_cmd(StartupTimeline.STAGE_FIRST_VIDEO_BYTE)
+        subprocess.check_call(marker_cmd, shell = True, executable = '/usr/bin/bash')
+        timeline.mark(StartupTimeline.STAGE_FIRST_FRAME_PLAYED)
+        timeline.save()
+
+        stages = [stage for stage, elapsed_s in StartupTimeline.get_timeline(7)]
+        self.assertEqual(stages, [
+            StartupTimeline.STAGE_PIPELINE_START,
+            StartupTimeline.STAGE_FIRST_VIDEO_BYTE,
+            StartupTimeline.STAGE_FIRST_FRAME_PLAYED,
+        ])
+
+        # Later marks don't overwrite the saved timeline.
+        timeline.mark(StartupTimeline.STAGE_FIRST_FRAME_PLAYED)
+        timeline.save()
+        self.assertEqual(len(StartupTimeline.get_timeline(7)), 3)
+
+    def test_first_byte_markers_are_opt_in(self):
+        self._set_config({'leds': {'display_width': 32, 'display_height': 16}})
+        timeline = StartupTimeline(7)
+
+        # The yt-dlp extraction markers are always added, but the first byte markers cost an extra process per stream.
+        cmd = VideoProcessor.get_streaming_video_download_cmd('https://x', startup_timeline = timeline)
+        self.assertIn(StartupTimeline.STAGE_YT_DLP_VIDEO_EXTRACTED, cmd)
+        self.assertIn(StartupTimeline.STAGE_YT_DLP_AUDIO_EXTRACTED, cmd)
+        self.assertNotIn(StartupTimeline.STAGE_FIRST_VIDEO_BYTE, cmd)
+        self.assertNotIn('dd bs=1', cmd)
+
+        Config._Config__config['video'] = {'should_record_first_byte_times': True}
+        cmd = VideoProcessor.get_streaming_video_download_cmd('https://x', startup_timeline = timeline)
+        self.assertIn(StartupTimeline.STAGE_FIRST_VIDEO_BYTE, cmd)
+        self.assertIn(StartupTimeline.STAGE_FIRST_AUDIO_BYTE, cmd)
+
+    def test_timeline_without_playlist_video_id_is_not_stored(self):
+        timeline = StartupTimeline()
+        timeline.mark(StartupTimeline.STAGE_FIRST_FRAME_PLAYED)
+        timeline.save()
+        self.assertEqual(StartupTimeline.get_stage_percentiles(), [])
+
+    def test_stage_percentiles(self):
+        for playlist_video_id in range(1, 21):
+            self._insert_timeline(playlist_video_id, {
+                StartupTimeline.STAGE_PIPELINE_START: 0.1,
+                StartupTimeline.STAGE_FIRST_FRAME_PLAYED: playlist_video_id,
+            })
+        # Only the most recent videos count.
+        self._insert_timeline(0, {StartupTimeline.STAGE_FIRST_FRAME_PLAYED: 1000})
+
+        stage_percentiles = StartupTimeline.get_stage_percentiles(num_videos = 20)
+        self.assertEqual(
+            [stage_percentile['stage'] for stage_percentile in stage_percentiles],
+            [StartupTimeline.STAGE_PIPELINE_START, StartupTimeline.STAGE_FIRST_FRAME_PLAYED]
+        )
+        first_frame_played = stage_percentiles[1]
+        self.assertEqual(first_frame_played['num_videos'], 20)
+        self.assertEqual(first_frame_played['p50_s'], 10.5)
+        self.assertEqual(first_frame_played['p95_s'], 19.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
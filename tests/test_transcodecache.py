@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Unit tests for TranscodeCache, the cache of videos that have already been
+scaled to the LED matrix resolution.
+
+Covers:
+- finishing and looking up entries
+- memory mapping cached frames
+- LRU eviction once the cache exceeds its byte budget
+- deleting incomplete entries abandoned by exited processes
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.database import Database
+from pifi.video.incompletedirectories import IncompleteDirectories
+from pifi.video.transcodecache import TranscodeCache
+
+from tests.dbtestcase import DbTestCase
+
+WIDTH = 8
+HEIGHT = 4
+BYTES_PER_FRAME = WIDTH * HEIGHT * 3
+
+
+class TestTranscodeCache(DbTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self._set_config({
+            'leds': {'display_width': WIDTH, 'display_height': HEIGHT},
+            'video': {'transcode_cache': {'enabled': True, 'max_size_bytes': BYTES_PER_FRAME * 35}},
+        })
+
+        self._patch(mock.patch.object(
+            TranscodeCache, '_TranscodeCache__get_directory', return_value = os.path.join(self.tmp_dir, 'transcodes')
+        ))
+
+        self.cache = TranscodeCache()
+        self.cache.construct()
+
+    def _add_entry(self, url, num_frames, with_audio = True):
+        directory = self.cache.make_incomplete_entry_directory(url, 'rgb24')
+        frames = np.arange(num_frames * BYTES_PER_FRAME, dtype = np.uint32).astype(np.uint8)
+        frames.tofile(os.path.join(directory, TranscodeCache.FRAMES_FILE_NAME))
+        with open(os.path.join(directory, TranscodeCache.FRAME_TIMESTAMPS_FILE_NAME), 'w') as timestamps_file:
+            timestamps_file.write('#tb 0: 1/30\n')
+            for i in range(num_frames):
+                timestamps_file.write(f'0, {i}, {i}, 1, {BYTES_PER_FRAME}, 0x00000000\n')
+        if with_audio:
+            open(os.path.join(directory, TranscodeCache.AUDIO_FILE_NAME), 'wb').close()
+        open(os.path.join(directory, TranscodeCache.AUDIO_DONE_FILE_NAME), 'wb').close()
+        self.cache.finish_entry(directory, url, 'rgb24', 30, num_frames)
+        return frames.reshape(num_frames, HEIGHT, WIDTH, 3)
+
+    def _set_last_access_date(self, url, date):
+        Database().get_cursor().execute(
+            "UPDATE transcode_cache SET last_access_date = ? WHERE url = ?", [date, url]
+        )
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.get_entry('a', 'rgb24'))
+
+    def test_hit(self):
+        expected_frames = self._add_entry('a', 3)
+        entry = self.cache.get_entry('a', 'rgb24')
+        self.assertEqual(entry['num_frames'], 3)
+        self.assertEqual(entry['fps'], 30)
+        self.assertEqual(self.cache.get_frame_timestamps('a', 'rgb24').get(2), 2 / 30)
+        np.testing.assert_array_equal(self.cache.get_frames('a', 'rgb24', entry), expected_frames)
+        self.assertTrue(self.cache.get_audio_path('a', 'rgb24', entry).endswith(TranscodeCache.AUDIO_FILE_NAME))
+        self.assertIsNone(self.cache.get_entry('a', 'gray'))
+
+    def test_entry_without_audio(self):
+        self._add_entry('a', 3, with_audio = False)
+        entry = self.cache.get_entry('a', 'rgb24')
+        self.assertIsNone(self.cache.get_audio_path('a', 'rgb24', entry))
+
+    def test_corrupt_entry_is_deleted(self):
+        self._add_entry('a', 3)
+        frames_path = os.path.join(self.cache.get_entry_directory('a', 'rgb24'), TranscodeCache.FRAMES_FILE_NAME)
+        with open(frames_path, 'r+b') as frames_file:
+            frames_file.truncate(BYTES_PER_FRAME)
+        self.assertIsNone(self.cache.get_entry('a', 'rgb24'))
+        self.assertFalse(os.path.exists(self.cache.get_entry_directory('a', 'rgb24')))
+
+    def test_least_recently_played_entry_is_evicted(self):
+        self._add_entry('a', 10)
+        self._set_last_access_date('a', '2020-01-02 00:00:00')
+        self._add_entry('b', 10)
+        self._set_last_access_date('b', '2020-01-01 00:00:00')
+        self._add_entry('c', 10)
+
+        self.assertIsNotNone(self.cache.get_entry('a', 'rgb24'))
+        self.assertIsNone(self.cache.get_entry('b', 'rgb24'))
+        self.assertFalse(os.path.exists(self.cache.get_entry_directory('b', 'rgb24')))
+        self.assertIsNotNone(self.cache.get_entry('c', 'rgb24'))
+
+    def test_delete_incomplete_entries(self):
+        directory = self.cache.make_incomplete_entry_directory('a', 'rgb24')
+        self._add_entry('b', 1)
+        self.cache.delete_incomplete_entries()
+        self.assertFalse(os.path.exists(directory))
+        self.assertIsNotNone(self.cache.get_entry('b', 'rgb24'))
+
+    def test_incomplete_entries_of_other_live_processes_are_kept(self):
+        other_process = subprocess.Popen(['sleep', '10'])
+        self.addCleanup(other_process.wait)
+        self.addCleanup(other_process.kill)
+        exited_process = subprocess.Popen(['true'])
+        exited_process.wait()
+
+        entry_directory = self.cache.get_entry_directory('a', 'rgb24')
+        live_directory = f'{entry_directory}.{other_process.pid}.part'
+        dead_directory = f'{entry_directory}.{exited_process.pid}.part'
+        os.makedirs(live_directory)
+        os.makedirs(dead_directory)
+
+        self.cache.delete_incomplete_entries()
+        self.assertTrue(os.path.exists(live_directory))
+        self.assertFalse(os.path.exists(dead_directory))
+
+    def test_own_incomplete_directories_are_kept_unless_asked(self):
+        # E.g. DecodedClip decodes the next clip while the current one plays, all in the same process.
+        directory = os.path.join(self.tmp_dir, 'entries')
+        incomplete_directories = IncompleteDirectories(directory)
+        incomplete_directory = incomplete_directories.make(os.path.join(directory, 'a'))
+        self.assertEqual(incomplete_directory, f'{directory}/a.{os.getpid()}.part')
+
+        incomplete_directories.delete_abandoned()
+        self.assertTrue(os.path.exists(incomplete_directory))
+        incomplete_directories.delete_abandoned(should_delete_own = True)
+        self.assertFalse(os.path.exists(incomplete_directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
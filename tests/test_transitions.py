@@ -167,9 +167,15 @@ class TestSupportsLiveTransition(unittest.TestCase):
         Config._Config__is_loaded = True
         Config._Config__config = copy.deepcopy(BASE_CONFIG)
 
-    def test_video_screensaver_returns_false(self):
+    def test_video_screensaver_returns_true_in_color(self):
         from pifi.screensaver.videoscreensaver import VideoScreensaver
         ss = VideoScreensaver(led_frame_player=None)
+        self.assertTrue(ss.supports_live_transition())
+
+    def test_video_screensaver_returns_false_in_bw(self):
+        from pifi.screensaver.videoscreensaver import VideoScreensaver
+        Config._Config__config['video'] = {'color_mode': 'bw'}
+        ss = VideoScreensaver(led_frame_player=None)
         self.assertFalse(ss.supports_live_transition())
 
 
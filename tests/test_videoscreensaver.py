@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Unit tests for VideoScreensaver, which plays saved clips back to back from
+memory-mapped decoded frames, and DecodedClip, which holds those frames.
+
+Covers:
+- playing each frame when its timestamp is due, and sleeping until the next one
+- starting the next clip exactly when the current one ends
+- honoring the screensaver timeout in the middle of a clip
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.config import Config
+from pifi.directoryutils import DirectoryUtils
+from pifi.led.blackholeframeplayer import BlackHoleFramePlayer
+from pifi.screensaver.videoscreensaver import VideoScreensaver
+from pifi.video.decodedclip import DecodedClip
+from pifi.video.transcodecache import TranscodeCache
+
+DISPLAY_WIDTH = 4
+DISPLAY_HEIGHT = 2
+
+
+class RecordingFramePlayer(BlackHoleFramePlayer):
+
+    def __init__(self):
+        super().__init__()
+        self.frames = []
+
+    def play_frame(self, frame):
+        super().play_frame(frame)
+        self.frames.append(int(frame[0, 0, 0]))
+
+
+class TestVideoScreensaver(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root_dir)
+        os.makedirs(self.root_dir + '/data/screensavers')
+
+        def set_root_dir(directory_utils):
+            directory_utils.root_dir = self.root_dir
+        patcher = mock.patch.object(DirectoryUtils, '__init__', set_root_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        Config._Config__is_loaded = True
+        Config._Config__config = {
+            'leds': {'display_width': DISPLAY_WIDTH, 'display_height': DISPLAY_HEIGHT},
+            'video': {'color_mode': 'color'},
+            'screensavers': {'configs': {'video_screensaver': {'saved_videos': []}}},
+        }
+
+    def _set_saved_videos(self, saved_videos, timeout = None):
+        Config._Config__config['screensavers']['configs']['video_screensaver'] = {
+            'saved_videos': saved_videos,
+            'timeout': timeout,
+        }
+
+    # Writes a clip whose frames are filled with first_value, first_value + 1, ..., as if it had been decoded.
+    def _write_decoded_clip(self, name, timestamps, end_time, first_value):
+        path = self.root_dir + '/data/screensavers/' + name
+        with open(path, 'wb') as clip_file:
+            clip_file.write(name.encode('utf-8'))
+
+        entry_directory = DecodedClip(path, 'rgb24')._DecodedClip__get_entry_directory()
+        os.makedirs(entry_directory)
+        frames = np.zeros((len(timestamps), DISPLAY_HEIGHT, DISPLAY_WIDTH, 3), np.uint8)
+        for i in range(len(timestamps)):
+            frames[i] = first_value + i
+        frames.tofile(entry_directory + '/' + TranscodeCache.FRAMES_FILE_NAME)
+
+        framecrc = '#tb 0: 1/1000\n'
+        pts_ms = [round(timestamp * 1000) for timestamp in timestamps] + [round(end_time * 1000)]
+        for i in range(len(timestamps)):
+            framecrc += f'0, {pts_ms[i]}, {pts_ms[i]}, {pts_ms[i + 1] - pts_ms[i]}, 24, 0x00000000\n'
+        with open(entry_directory + '/' + TranscodeCache.FRAME_TIMESTAMPS_FILE_NAME, 'w') as timestamps_file:
+            timestamps_file.write(framecrc)
+
+    def _make_screensaver(self):
+        frame_player = RecordingFramePlayer()
+        screensaver = VideoScreensaver(led_frame_player = frame_player)
+        self.addCleanup(screensaver.teardown)
+        return screensaver, frame_player
+
+    def _patch_monotonic(self):
+        self.now = 100.0
+        patcher = mock.patch('time.monotonic', side_effect = lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_no_saved_videos(self):
+        screensaver, frame_player = self._make_screensaver()
+        screensaver.setup()
+        self.assertFalse(screensaver._tick())
+        self.assertEqual(frame_player.frames, [])
+
+    def test_plays_frames_when_due(self):
+        self._write_decoded_clip('a.mp4', [0, 0.1, 0.3], 0.4, first_value = 10)
+        self._set_saved_videos(['a.mp4'])
+        self._patch_monotonic()
+        screensaver, frame_player = self._make_screensaver()
+        screensaver.setup()
+
+        screensaver._tick()
+        self.assertEqual(frame_player.frames, [10])
+        self.assertAlmostEqual(screensaver.get_tick_sleep(), 0.1)
+
+        # Ticking before the next frame is due doesn't play anything.
+        self.now += 0.05
+        screensaver._tick()
+        self.assertEqual(frame_player.frames, [10])
+
+        self.now += 0.1
+        screensaver._tick()
+        self.assertEqual(frame_player.frames, [10, 11])
+        self.assertAlmostEqual(screensaver.get_tick_sleep(), 0.1)
+
+    def test_next_clip_starts_when_current_clip_ends(self):
+        self._write_decoded_clip('a.mp4', [0, 0.1, 0.3], 0.4, first_value = 10)
+        self._write_decoded_clip('b.mp4', [0, 0.1], 0.2, first_value = 20)
+        self._set_saved_videos(['a.mp4', 'b.mp4'])
+        self._patch_monotonic()
+        screensaver, frame_player = self._make_screensaver()
+
+        with mock.patch('random.choice', side_effect = lambda paths: paths[0]):
+            screensaver.setup()
+            screensaver._tick()
+            self.now += 0.35
+            screensaver._tick()
+
+            # A tick that is a little late starts the next clip where it would have been, had it started on time.
+            self.now += 0.08
+            screensaver._tick()
+        self.assertEqual(frame_player.frames, [10, 12, 20])
+        self.assertAlmostEqual(screensaver.get_tick_sleep(), 0.1 - 0.03)
+
+    def test_single_clip_loops(self):
+        self._write_decoded_clip('a.mp4', [0, 0.125], 0.25, first_value = 10)
+        self._set_saved_videos(['a.mp4'])
+        self._patch_monotonic()
+        screensaver, frame_player = self._make_screensaver()
+        screensaver.setup()
+
+        for _ in range(5):
+            screensaver._tick()
+            self.now += 0.125
+        self.assertEqual(frame_player.frames, [10, 11, 10, 11, 10])
+
+    def test_timeout_in_the_middle_of_a_clip(self):
+        self._write_decoded_clip('a.mp4', [i / 10 for i in range(100)], 10, first_value = 0)
+        self._set_saved_videos(['a.mp4'], timeout = 0.3)
+        screensaver, frame_player = self._make_screensaver()
+
+        start = time.monotonic()
+        screensaver.play()
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertGreater(len(frame_player.frames), 1)
+        self.assertLess(len(frame_player.frames), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
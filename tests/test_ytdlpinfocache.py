@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Unit tests for YtDlpInfoCache, the cache of the info JSON that yt-dlp extracts
+for a video.
+
+Covers:
+- caching an info JSON that yt-dlp wrote, and looking it up
+- expiring entries before their media urls expire
+- not caching live streams
+"""
+
+import json
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pifi.video.ytdlpinfocache import YtDlpInfoCache
+
+from tests.dbtestcase import DbTestCase
+
+
+class TestYtDlpInfoCache(DbTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self._set_config({'video': {'yt_dlp_info_cache': {'enabled': True, 'max_age_s': 3600}}})
+
+        self._patch(mock.patch.object(
+            YtDlpInfoCache, '_YtDlpInfoCache__get_directory', return_value = os.path.join(self.tmp_dir, 'yt_dlp_info')
+        ))
+
+        self.cache = YtDlpInfoCache()
+        self.cache.construct()
+
+    # Writes an info JSON like yt-dlp would, and adds it to the cache.
+    def _add_entry(self, url, url_expire_time, duration = 60, is_live = False):
+        info = {
+            'id': 'abc',
+            'duration': duration,
+            'is_live': is_live,
+            'formats': [
+                {'format_id': '160', 'url': f'https://example.com/videoplayback?expire={url_expire_time}&itag=160'},
+                {'format_id': '140', 'url': f'https://example.com/videoplayback/expire/{url_expire_time}/itag/140'},
+            ],
+        }
+        incomplete_info_json_path = self.cache.make_incomplete_info_json_path(url)
+        self.assertTrue(incomplete_info_json_path.endswith(YtDlpInfoCache.INFO_JSON_SUFFIX))
+        with open(incomplete_info_json_path, 'w') as info_json_file:
+            json.dump(info, info_json_file)
+        self.cache.finish_entry(url, incomplete_info_json_path)
+        self.assertFalse(os.path.exists(incomplete_info_json_path))
+
+    def test_hit(self):
+        self.assertIsNone(self.cache.get_info_json_path('a'))
+        self._add_entry('a', int(time.time()) + 6 * 60 * 60)
+        info_json_path = self.cache.get_info_json_path('a')
+        with open(info_json_path) as info_json_file:
+            self.assertEqual(json.load(info_json_file)['id'], 'abc')
+
+        self.cache.delete_entry('a')
+        self.assertIsNone(self.cache.get_info_json_path('a'))
+        self.assertFalse(os.path.exists(info_json_path))
+
+    def test_urls_that_expire_before_the_download_would_finish_are_not_cached(self):
+        # The urls outlast the video's duration, but not by enough margin.
+        self._add_entry('a', int(time.time()) + 2 * 60 * 60, duration = 2 * 60 * 60 - 60)
+        self.assertIsNone(self.cache.get_info_json_path('a'))
+
+    def test_entry_expires(self):
+        self._add_entry('a', int(time.time()) + 6 * 60 * 60)
+        with mock.patch('time.time', return_value = time.time() + 3600):
+            self.assertIsNone(self.cache.get_info_json_path('a'))
+
+    def test_live_streams_are_not_cached(self):
+        self._add_entry('a', int(time.time()) + 6 * 60 * 60, duration = None, is_live = True)
+        self.assertIsNone(self.cache.get_info_json_path('a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -80,7 +80,7 @@ class TerminalFramePlayer(FramePlayerBase):
             return None
         return self._current_frame.copy()
 
-    def fade_to_frame(self, frame):
+    def fade_to_frame(self, frame, duration=None):
         """For terminal preview, just render directly (no fade)."""
         self.play_frame(frame)
 